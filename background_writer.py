@@ -0,0 +1,87 @@
+import logging
+import queue
+import threading
+
+
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+_STOP = object()
+
+
+class BackgroundWriter:
+    """
+    Base for writers whose I/O happens on a background thread.
+
+    put() only queues an item. The thread starts on the first one, takes whatever has piled
+    up since its last pass and hands it to write_batch() in one call, so a burst of items
+    costs one write. Subclasses implement write_batch() and may override opened()/closed()
+    to set up and tear down their resources on the writer thread.
+    """
+
+    thread_name = 'background-writer'
+
+    def __init__(self, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def put(self, item):
+        if self._thread is None:
+            self._start()
+        self._queue.put(item)
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+                self._thread.start()
+
+    def opened(self):
+        pass
+
+    def write_batch(self, items):
+        raise NotImplementedError
+
+    def closed(self):
+        pass
+
+    def _run(self):
+        self.opened()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            # Drain whatever else is waiting, then one write for the whole batch
+            batch = [item]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            items = [item for item in batch if item is not _STOP]
+            try:
+                if items:
+                    self.write_batch(items)
+            except Exception as e:
+                logging.error(f"Error in {self.thread_name}: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if len(items) < len(batch):
+                self.closed()
+                return
+
+    def flush(self):
+        """
+        Blocks until everything put so far has been written.
+        """
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
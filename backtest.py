@@ -0,0 +1,315 @@
+import argparse
+import csv
+import logging
+import time
+from dataclasses import dataclass, field, asdict
+from datetime import datetime, timezone
+
+import numpy as np
+
+from candle_storage import CandleStorage, DEFAULT_ROOT, dedup_sorted, to_records
+from signals import (
+    INCREASE_2H_THRESHOLD,
+    INCREASE_1H_THRESHOLD,
+    INCREASE_SINCE_LAST_CHECK_THRESHOLD,
+    DROP_FROM_PREVIOUS_THRESHOLD,
+    DROP_FROM_HIGHEST_THRESHOLD,
+    TAKE_PROFIT_THRESHOLD,
+    percent_change,
+)
+
+# Sell detection scans the held product's prices this many bars at a time
+SELL_SEARCH_CHUNK = 50_000
+
+
+@dataclass(frozen=True)
+class StrategyParams:
+    increase_2h: float = INCREASE_2H_THRESHOLD
+    increase_1h: float = INCREASE_1H_THRESHOLD
+    increase_since_last_check: float = INCREASE_SINCE_LAST_CHECK_THRESHOLD
+    drop_from_previous: float = DROP_FROM_PREVIOUS_THRESHOLD
+    drop_from_highest: float = DROP_FROM_HIGHEST_THRESHOLD
+    take_profit: float = TAKE_PROFIT_THRESHOLD
+    scan_interval: int = 3600  # the live bot scans at the top of every hour
+    fee_rate: float = 0.005
+    slippage: float = 0.0
+
+
+@dataclass
+class Trade:
+    product_id: str
+    buy_time: float
+    buy_price: float
+    sell_time: float = None
+    sell_price: float = None
+    amount: float = 0.0
+    fees: float = 0.0
+    reason: str = None
+    pnl: float = None
+
+
+@dataclass
+class BacktestResult:
+    params: StrategyParams
+    initial_cash: float
+    final_equity: float
+    trades: list = field(default_factory=list)
+    equity_times: np.ndarray = None
+    equity: np.ndarray = None
+    elapsed: float = 0.0
+
+    @property
+    def pnl(self):
+        return self.final_equity - self.initial_cash
+
+    @property
+    def return_pct(self):
+        return self.pnl / self.initial_cash * 100
+
+    @property
+    def max_drawdown(self):
+        """
+        Largest peak to trough drop of the equity curve, in percent.
+        """
+        if self.equity is None or len(self.equity) == 0:
+            return 0.0
+        peaks = np.maximum.accumulate(self.equity)
+        return float(((peaks - self.equity) / peaks).max() * 100)
+
+    @property
+    def win_rate(self):
+        closed = [trade for trade in self.trades if trade.pnl is not None]
+        if not closed:
+            return 0.0
+        return sum(1 for trade in closed if trade.pnl > 0) / len(closed) * 100
+
+    def trade_log(self):
+        return [asdict(trade) for trade in self.trades]
+
+    def summary(self):
+        return (f"PnL {self.pnl:.2f} ({self.return_pct:.2f}%), max drawdown {self.max_drawdown:.2f}%, "
+                f"{len(self.trades)} trades, win rate {self.win_rate:.1f}%, ran in {self.elapsed:.2f}s")
+
+
+class ProductSeries:
+    """
+    One product's candles as plain arrays, sorted by time.
+    """
+    __slots__ = ('product_id', 'times', 'opens', 'closes')
+
+    def __init__(self, product_id, records):
+        records = dedup_sorted(to_records(records))
+        self.product_id = product_id
+        self.times = np.ascontiguousarray(records['time'])
+        self.opens = np.ascontiguousarray(records['open'])
+        self.closes = np.ascontiguousarray(records['close'])
+
+    @classmethod
+    def from_arrays(cls, product_id, times, opens, closes):
+        """
+        Wraps arrays that are already sorted and de-duplicated, without copying them.
+        """
+        series = cls.__new__(cls)
+        series.product_id = product_id
+        series.times, series.opens, series.closes = times, opens, closes
+        return series
+
+
+def load_storage(storage, product_ids, granularity, start, end):
+    """
+    :return: dict of product_id -> ProductSeries for products that have data in [start, end)
+    """
+    series = {}
+    for product_id in product_ids:
+        records = storage.read(product_id, granularity, start, end)
+        if len(records):
+            series[product_id] = ProductSeries(product_id, records)
+    return series
+
+
+def load_csv(csv_path, product_id=None):
+    """
+    Reads the historical_data.csv schema, product_id is needed if the file has no such column.
+    """
+    rows = {}
+    with open(csv_path, newline='') as f:
+        for row in csv.DictReader(f):
+            pid = row.get('product_id') or product_id
+            if not pid:
+                raise ValueError(f"{csv_path} has no product_id column, pass product_id")
+            rows.setdefault(pid, []).append([int(float(row['time'])), float(row['low']), float(row['high']),
+                                             float(row['open']), float(row['close']), float(row['volume'])])
+    return {pid: ProductSeries(pid, product_rows) for pid, product_rows in rows.items()}
+
+
+def _scan_signals(series, scan_times, granularity):
+    """
+    2h/1h increase and the current price of every product at every scan time.
+
+    Only bars that have started before the scan count, same as what the live scan sees.
+    :return: three (products x scans) arrays, NaN where there is no data
+    """
+    shape = (len(series), len(scan_times))
+    increase_2h, increase_1h, current = np.full(shape, np.nan), np.full(shape, np.nan), np.full(shape, np.nan)
+    cutoff_2h = scan_times - 2 * 3600
+    cutoff_1h = scan_times - 3600
+    cutoff_2h -= cutoff_2h % granularity
+    cutoff_1h -= cutoff_1h % granularity
+    for i, s in enumerate(series):
+        end = np.searchsorted(s.times, scan_times) - 1
+        has_bar = end >= 0
+        last_close = np.where(has_bar, s.closes[np.maximum(end, 0)], np.nan)
+        current[i] = last_close
+        for out, cutoff in ((increase_2h, cutoff_2h), (increase_1h, cutoff_1h)):
+            first = np.searchsorted(s.times, cutoff)
+            in_window = has_bar & (first <= end)
+            first_open = np.where(in_window, s.opens[np.minimum(first, len(s.times) - 1)], np.nan)
+            out[i] = percent_change(first_open, last_close)
+    return increase_2h, increase_1h, current
+
+
+def _find_exit(s, entry_index, fill_price, params):
+    """
+    First bar at or after entry_index where a sell rule fires.
+
+    :return: (bar index, reason) or (None, None) if the position is still open at the end
+    """
+    highest, previous = fill_price, fill_price
+    for chunk_start in range(entry_index, len(s.closes), SELL_SEARCH_CHUNK):
+        prices = s.closes[chunk_start:chunk_start + SELL_SEARCH_CHUNK]
+        # The live loop bumps the highest price before it checks the drop from it
+        highs = np.maximum.accumulate(np.concatenate(([highest], prices)))[1:]
+        previous_prices = np.concatenate(([previous], prices[:-1]))
+        rules = (
+            ('drop_from_previous', percent_change(previous_prices, prices) <= params.drop_from_previous),
+            ('drop_from_highest', percent_change(highs, prices) <= params.drop_from_highest),
+            ('take_profit', percent_change(np.full(len(prices), fill_price), prices) >= params.take_profit),
+        )
+        fired = rules[0][1] | rules[1][1] | rules[2][1]
+        if fired.any():
+            j = int(fired.argmax())
+            reason = next(name for name, hits in rules if hits[j])
+            return chunk_start + j, reason
+        highest, previous = highs[-1], prices[-1]
+    return None, None
+
+
+def run_backtest(series, granularity, params=StrategyParams(), initial_cash=1000.0, start=None, end=None):
+    """
+    Replays candles through the buy scan and sell rules of the live bot.
+
+    Like the live bot it holds at most one position, spends all its cash on the strongest
+    candidate of a scan, and only scans again once that position has been sold. Buys fill at
+    the open of the first bar after the scan, sells at the close of the bar that fired a rule.
+
+    :param series: dict of product_id -> ProductSeries
+    """
+    started = time.perf_counter()
+    products = list(series.values())
+    if not products:
+        return BacktestResult(params, initial_cash, initial_cash, elapsed=time.perf_counter() - started)
+
+    first = min(s.times[0] for s in products) if start is None else int(start)
+    last = max(s.times[-1] for s in products) + granularity if end is None else int(end)
+    first_scan = first - first % params.scan_interval + params.scan_interval
+    scan_times = np.arange(first_scan, last, params.scan_interval, dtype=np.int64)
+    increase_2h, increase_1h, current = _scan_signals(products, scan_times, granularity)
+
+    cash = initial_cash
+    trades = []
+    equity_times, equity = [first], [cash]
+    last_checked = np.full(len(products), np.nan)
+    busy_until = -1
+
+    for k, scan_time in enumerate(scan_times):
+        if scan_time < busy_until:
+            continue
+        prices = current[:, k]
+        scores = np.vstack((increase_2h[:, k], increase_1h[:, k], percent_change(last_checked, prices)))
+        scores = np.where(np.isnan(scores), -np.inf, scores)
+        thresholds = np.array([[params.increase_2h], [params.increase_1h], [params.increase_since_last_check]])
+        met = (scores >= thresholds).any(axis=0)
+        # Whatever the scan saw becomes the last checked price for the next one
+        last_checked = np.where(np.isnan(prices), last_checked, prices)
+        if not met.any():
+            continue
+
+        # Strongest move wins, ties go to the first product like the live ranking
+        best = np.where(met, scores.max(axis=0), -np.inf)
+        s = products[int(np.argmax(best))]
+        entry = int(np.searchsorted(s.times, scan_time))
+        if entry >= len(s.times):
+            continue
+
+        spent = cash
+        fill_price = s.opens[entry] * (1 + params.slippage)
+        buy_fee = spent * params.fee_rate
+        amount = (spent - buy_fee) / fill_price
+        trade = Trade(s.product_id, float(s.times[entry]), float(fill_price), amount=float(amount), fees=float(buy_fee))
+        trades.append(trade)
+
+        exit_index, reason = _find_exit(s, entry, fill_price, params)
+        stop = len(s.times) if exit_index is None else exit_index + 1
+        held_times = s.times[entry:stop] + granularity
+        held_equity = amount * s.closes[entry:stop]
+        equity_times.extend(held_times.tolist())
+        equity.extend(held_equity.tolist())
+
+        if exit_index is None:
+            # Still holding at the end, mark it to the last close
+            cash = float(held_equity[-1])
+            trade.pnl = cash - spent
+            break
+
+        sell_price = s.closes[exit_index] * (1 - params.slippage)
+        proceeds = amount * sell_price
+        sell_fee = proceeds * params.fee_rate
+        trade.sell_time = float(s.times[exit_index] + granularity)
+        trade.sell_price = float(sell_price)
+        trade.reason = reason
+        trade.fees += float(sell_fee)
+        cash = float(proceeds - sell_fee)
+        trade.pnl = cash - spent
+        equity_times.append(trade.sell_time)
+        equity.append(cash)
+        busy_until = trade.sell_time
+
+    return BacktestResult(params, initial_cash, cash, trades, np.array(equity_times), np.array(equity),
+                          time.perf_counter() - started)
+
+
+def parse_date(value):
+    return int(datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Backtest the buy/sell rules on stored candles')
+    parser.add_argument('--root', default=DEFAULT_ROOT, help='candle storage directory')
+    parser.add_argument('--csv', help='read a historical_data.csv style file instead of the storage')
+    parser.add_argument('--products', nargs='*', help='products to include, defaults to everything stored')
+    parser.add_argument('--product-id', help='product for a csv without a product_id column')
+    parser.add_argument('--granularity', type=int, default=300)
+    parser.add_argument('--start', help='YYYY-MM-DD (UTC)')
+    parser.add_argument('--end', help='YYYY-MM-DD (UTC)')
+    parser.add_argument('--cash', type=float, default=1000.0)
+    parser.add_argument('--fee-rate', type=float, default=StrategyParams.fee_rate)
+    args = parser.parse_args(argv)
+
+    start = parse_date(args.start) if args.start else 0
+    end = parse_date(args.end) if args.end else 2 ** 40
+    if args.csv:
+        series = load_csv(args.csv, args.product_id)
+    else:
+        storage = CandleStorage(args.root)
+        product_ids = args.products or storage.product_ids()
+        series = load_storage(storage, product_ids, args.granularity, start, end)
+
+    result = run_backtest(series, args.granularity, StrategyParams(fee_rate=args.fee_rate), args.cash)
+    print(result.summary())
+    for trade in result.trades:
+        print(trade)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,292 @@
+import argparse
+import json
+import threading
+from collections import deque, namedtuple
+
+import metrics
+from candle_store import align
+from candle_storage import CandleStorage, DEFAULT_ROOT
+from market_feed import parse_time
+
+
+DEFAULT_GRANULARITIES = (60, 300, 3600)
+
+# Closed bars kept per (product, granularity) so a late trade can still correct them
+DEFAULT_CORRECTION_BARS = 5
+
+# A quiet product's bar is closed this many seconds after its bucket ends
+DEFAULT_GRACE = 2.0
+
+LATE_TRADES = metrics.counter('bar_late_trades_total', 'Trades for an already closed bar, corrected or dropped')
+
+Trade = namedtuple('Trade', 'product_id time price size trade_id')
+
+# row is [time, low, high, open, close, volume] like the candles endpoint. complete is False
+# for a bar we didn't see every trade of (the first one after startup or after a gap)
+Bar = namedtuple('Bar', 'product_id granularity row complete corrected')
+
+ROW_TIME, ROW_LOW, ROW_HIGH, ROW_OPEN, ROW_CLOSE, ROW_VOLUME, ROW_FIRST, ROW_LAST = range(8)
+
+
+def _new_row(bucket, trade_time, price, size):
+    # Two extra columns, the first and last trade time, so a late trade knows whether it
+    # changes the open or the close
+    return [bucket, price, price, price, price, size, trade_time, trade_time]
+
+
+def _apply(row, trade_time, price, size):
+    row[ROW_LOW] = min(row[ROW_LOW], price)
+    row[ROW_HIGH] = max(row[ROW_HIGH], price)
+    row[ROW_VOLUME] += size
+    if trade_time < row[ROW_FIRST]:
+        row[ROW_OPEN], row[ROW_FIRST] = price, trade_time
+    if trade_time >= row[ROW_LAST]:
+        row[ROW_CLOSE], row[ROW_LAST] = price, trade_time
+
+
+def _newest(rows):
+    # Corrections can add older buckets after newer ones, so the last row isn't always the newest
+    return max(row[ROW_TIME] for row in rows)
+
+
+class BarAggregator:
+    """
+    Builds OHLCV bars from trades at several granularities at once.
+
+    Each (product, granularity) has one open bar. It closes when a trade lands in a later
+    bucket or advance() is called after the bucket ended. The last few closed bars are
+    kept, and a late trade for one of them updates it and re-emits it with corrected=True.
+    Trades older than that are dropped. So memory is bounded by products x granularities.
+
+    Trade ids go up by one per product, a jump means trades were missed and the bars that
+    were open at that point are marked incomplete.
+    """
+
+    def __init__(self, granularities=DEFAULT_GRANULARITIES, correction_bars=DEFAULT_CORRECTION_BARS,
+                 grace=DEFAULT_GRACE):
+        self.granularities = tuple(granularities)
+        self.correction_bars = correction_bars
+        self.grace = grace
+        self._open = {}
+        self._closed = {}
+        self._live_since = {}
+        self._last_trade_id = {}
+        self._lock = threading.Lock()
+
+    def _bar(self, key, row, corrected=False):
+        return Bar(key[0], key[1], row[:ROW_FIRST], row[ROW_TIME] >= self._live_since[key], corrected)
+
+    def _close(self, key, row):
+        closed = self._closed.get(key)
+        if closed is None:
+            closed = self._closed[key] = deque(maxlen=self.correction_bars)
+        closed.append(row)
+        return self._bar(key, row)
+
+    def _add(self, key, trade_time, price, size):
+        granularity = key[1]
+        bucket = align(trade_time, granularity)
+        row = self._open.get(key)
+        if row is not None and bucket == row[ROW_TIME]:
+            _apply(row, trade_time, price, size)
+            return ()
+        if row is None or bucket > row[ROW_TIME]:
+            closed_bar = self._close(key, row) if row is not None else None
+            previous = self._closed.get(key)
+            if previous and bucket <= _newest(previous):
+                # Open bar was closed by advance() and this trade is late for an older one
+                return self._correct(key, bucket, trade_time, price, size)
+            self._open[key] = _new_row(bucket, trade_time, price, size)
+            # We started listening partway through the first bucket
+            self._live_since.setdefault(key, bucket + granularity)
+            return (closed_bar,) if closed_bar else ()
+        return self._correct(key, bucket, trade_time, price, size)
+
+    def _correct(self, key, bucket, trade_time, price, size):
+        closed = self._closed.get(key, ())
+        for row in closed:
+            if row[ROW_TIME] == bucket:
+                _apply(row, trade_time, price, size)
+                LATE_TRADES.inc(result='corrected')
+                return (self._bar(key, row, corrected=True),)
+        # A bucket nobody traded in yet, fine as long as it is inside the correction window
+        if closed and bucket > _newest(closed) - self.correction_bars * key[1]:
+            row = _new_row(bucket, trade_time, price, size)
+            closed.append(row)
+            LATE_TRADES.inc(result='corrected')
+            return (self._bar(key, row, corrected=True),)
+        LATE_TRADES.inc(result='dropped')
+        return ()
+
+    def add(self, product_id, trade_time, price, size, trade_id=None):
+        """
+        :return: the bars this trade closed or corrected
+        """
+        price, size = float(price), float(size)
+        bars = []
+        with self._lock:
+            if trade_id is not None:
+                last = self._last_trade_id.get(product_id)
+                if last is not None and trade_id > last + 1:
+                    self._gap(product_id)
+                self._last_trade_id[product_id] = trade_id if last is None else max(last, trade_id)
+            for granularity in self.granularities:
+                bars.extend(self._add((product_id, granularity), trade_time, price, size))
+        return bars
+
+    def _gap(self, product_id):
+        for granularity in self.granularities:
+            key = (product_id, granularity)
+            row = self._open.get(key)
+            if row is not None:
+                self._live_since[key] = max(self._live_since[key], row[ROW_TIME] + granularity)
+
+    def gap(self, product_id):
+        """
+        Marks trades as missed for a product, e.g. after a reconnect.
+        """
+        with self._lock:
+            self._gap(product_id)
+
+    def advance(self, now):
+        """
+        Closes every open bar whose bucket ended more than grace seconds before now.
+        """
+        bars = []
+        with self._lock:
+            for key, row in list(self._open.items()):
+                if row[ROW_TIME] + key[1] + self.grace <= now:
+                    del self._open[key]
+                    bars.append(self._close(key, row))
+        return bars
+
+    def flush(self):
+        """
+        Closes every open bar, for the end of a replay.
+        """
+        with self._lock:
+            bars = [self._close(key, row) for key, row in self._open.items()]
+            self._open.clear()
+        return bars
+
+    def open_bars(self):
+        with self._lock:
+            return [self._bar(key, row) for key, row in self._open.items()]
+
+    def live_since(self, product_id, granularity):
+        """
+        Start of the first bucket from which we have seen every trade, None if we have seen none.
+        """
+        return self._live_since.get((product_id, granularity))
+
+    def live_keys(self):
+        with self._lock:
+            return list(self._live_since.items())
+
+
+def aggregate(trades, aggregator=None, granularities=DEFAULT_GRANULARITIES):
+    """
+    Generator of bars from an iterable of Trade, closed and corrected bars as they happen and
+    whatever is still open once the trades run out.
+    """
+    aggregator = aggregator or BarAggregator(granularities)
+    for trade in trades:
+        yield from aggregator.add(trade.product_id, trade.time, trade.price, trade.size, trade.trade_id)
+    yield from aggregator.flush()
+
+
+def trades_from_messages(messages):
+    """
+    Trades out of websocket feed messages, everything that isn't a match is skipped.
+    """
+    for message in messages:
+        if message.get('type') in ('match', 'last_match') and 'product_id' in message:
+            yield Trade(message['product_id'], parse_time(message.get('time')), float(message['price']),
+                        float(message['size']), message.get('trade_id'))
+
+
+def read_messages(path):
+    """
+    Feed messages from a recording with one JSON message per line.
+    """
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def publish(store, aggregator, bars=(), sink=None):
+    """
+    Puts finished bars and the current open ones into a CandleStore and marks every bucket
+    the aggregator has all trades for as covered, so the store stops asking the exchange.
+
+    :param sink: optional callable(product_id, granularity, rows) that persists the finished
+                 bars instead of the store's own sink
+    :return: number of rows written
+    """
+    written = 0
+    # Open bars still change, they go into memory but not to the store's sink
+    for batch, persist in ((bars, True), (aggregator.open_bars(), False)):
+        rows = {}
+        for bar in batch:
+            if bar.complete:
+                rows.setdefault((bar.product_id, bar.granularity), []).append(bar.row)
+        for (product_id, granularity), key_rows in rows.items():
+            key_rows.sort(key=lambda row: row[ROW_TIME])
+            # Only closed buckets count as covered, so passing the bar range is enough
+            store.add(product_id, granularity, key_rows, key_rows[0][ROW_TIME], key_rows[-1][ROW_TIME] + granularity,
+                      persist=persist and sink is None)
+            if persist and sink is not None:
+                sink(product_id, granularity, key_rows)
+            written += len(key_rows)
+    for (product_id, granularity), since in aggregator.live_keys():
+        store.set_live(product_id, granularity, since)
+    return written
+
+
+def replay(paths, storage, granularities=DEFAULT_GRANULARITIES, batch_size=50_000):
+    """
+    Builds bars from recorded feed messages and upserts the complete ones into CandleStorage.
+
+    :return: number of bars written
+    """
+    def messages():
+        for path in paths:
+            yield from read_messages(path)
+
+    pending, written, count = {}, 0, 0
+    for bar in aggregate(trades_from_messages(messages()), BarAggregator(granularities)):
+        if not bar.complete:
+            continue
+        pending.setdefault((bar.product_id, bar.granularity), []).append(bar.row)
+        count += 1
+        if count >= batch_size:
+            written += _upsert(storage, pending)
+            pending, count = {}, 0
+    return written + _upsert(storage, pending)
+
+
+def _upsert(storage, pending):
+    for (product_id, granularity), rows in pending.items():
+        # Corrected bars come after the original, upsert keeps the last one written
+        storage.upsert(product_id, granularity, rows)
+    return sum(len(rows) for rows in pending.values())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build candles from recorded trades')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    replay_parser = subparsers.add_parser('replay', help='aggregate recorded feed messages (JSON lines) into candles')
+    replay_parser.add_argument('paths', nargs='+')
+    replay_parser.add_argument('--granularity', type=int, nargs='+', default=list(DEFAULT_GRANULARITIES))
+    replay_parser.add_argument('--root', default=DEFAULT_ROOT)
+    args = parser.parse_args(argv)
+
+    if args.command == 'replay':
+        bars = replay(args.paths, CandleStorage(args.root), args.granularity)
+        print(f"Wrote {bars} bars into {args.root}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import argparse
+import os
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import main as bot
+import metrics
+from candle_storage import CandleStorage
+from candle_store import CandleStore
+from exchange_client import ExchangeClient
+from journal import Journal
+from market_feed import MarketDataCache, MarketFeed
+from mock_exchange import MockExchange
+from portfolio import Portfolio
+from price_index import LastPriceIndex
+from product_cache import ProductCache
+from rate_limit import RateLimiter, PRIVATE, PUBLIC
+from ticker_batch import BatchPriceFetcher
+from trade_log import TradeLogWriter
+
+# Rate limits high enough that the benchmark measures the bot and not the token buckets
+UNLIMITED = {PUBLIC: (100_000, 100_000), PRIVATE: (100_000, 100_000)}
+
+
+def point_bot_at(exchange, directory, rate_limits=None):
+    """
+    Swaps main's clients, stores and files for ones that talk to the mock exchange and
+    write under directory, so scan_and_buy() and check_portfolio() run unchanged.
+    """
+    bot.API_URL = exchange.url
+    bot.API_SECRET = exchange.api_secret
+    bot.SIGNER = None
+    bot.BUY_FUNDS = '100'
+    bot.RATE_LIMITER = RateLimiter(rate_limits)
+    bot.CLIENT = ExchangeClient(exchange.url, headers_fn=bot.create_request_headers, rate_limiter=bot.RATE_LIMITER,
+                                pool_size=bot.SCAN_MAX_CONCURRENCY * 2)
+    bot.JOURNAL = Journal(os.path.join(directory, 'journal.db'))
+    bot.TRADE_LOG = TradeLogWriter(os.path.join(directory, 'trade_log.csv'))
+    bot.CANDLE_DB = CandleStorage(os.path.join(directory, 'candles'))
+    bot.CANDLE_STORE = CandleStore(sink=bot.record_candles)
+    bot.LAST_PRICES = LastPriceIndex(os.path.join(directory, 'last_prices.json'))
+    bot.PRODUCTS = ProductCache(bot.fetch_products, snapshot_path=os.path.join(directory, 'products.json'))
+    bot.PORTFOLIO = Portfolio()
+    bot.MARKET_DATA = MarketDataCache()
+    bot.MARKET_FEED = MarketFeed(bot.MARKET_DATA, url=exchange.ws_url)
+    bot.PRICE_FETCHER = BatchPriceFetcher(bot.fetch_bulk_prices, bot.fetch_ticker_price,
+                                          max_workers=bot.SCAN_MAX_CONCURRENCY)
+
+
+def run(products=200, scans=5, ticks=50, latency=0.0, error_rate=0.0, volatility=0.01, feed=True,
+        rate_limits=UNLIMITED, bulk_stats=True):
+    """
+    Runs the scan and sell paths against a local mock exchange.
+
+    :return: dict of results
+    """
+    directory = tempfile.mkdtemp()
+    tracemalloc.start()
+    exchange = MockExchange(products, volatility=volatility, latency=latency, error_rate=error_rate,
+                            bulk_stats=bulk_stats).start()
+    try:
+        point_bot_at(exchange, directory, rate_limits)
+        bot.MAX_POSITIONS = products
+        if feed:
+            bot.MARKET_FEED.start()
+
+        scan_seconds = []
+        for _ in range(scans):
+            started = time.perf_counter()
+            bot.scan_and_buy()
+            scan_seconds.append(time.perf_counter() - started)
+        bot.ORDER_PIPELINE.join()  # buys go out in the background, the sell ticks need their positions
+
+        started = time.perf_counter()
+        sold = 0
+        for _ in range(ticks):
+            sold += len(bot.check_portfolio())
+        tick_seconds = time.perf_counter() - started
+
+        bot.TRADE_LOG.flush()
+        empty = {'count': 0, 'p50': 0.0, 'p99': 0.0}
+        orders = metrics.REGISTRY.get('order_submit_seconds').merged_stats() or empty
+        queued = metrics.REGISTRY.get('order_queue_seconds').merged_stats() or empty
+        _, peak = tracemalloc.get_traced_memory()
+        return {
+            'products': products,
+            'first scan s': scan_seconds[0],
+            'warm scans/s': (len(scan_seconds) - 1) / sum(scan_seconds[1:]) if len(scan_seconds) > 1 else 0.0,
+            'positions': len(bot.PORTFOLIO) + sold,
+            'sold': sold,
+            'sell ticks/s': ticks / tick_seconds if tick_seconds else 0.0,
+            'orders': orders['count'],
+            'order p50 ms': orders['p50'] * 1000,
+            'order p99 ms': orders['p99'] * 1000,
+            'order queue p99 ms': queued['p99'] * 1000,
+            '429s': sum(count for (_, status), count in exchange.requests.items() if status == 429),
+            'requests': sum(exchange.requests.values()),
+            'price requests': sum(count for (endpoint, _), count in exchange.requests.items()
+                                  if endpoint in ('/products/{id}/ticker', '/products/stats')),
+            'python peak MB': peak / 1e6,
+            'max rss MB': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+    finally:
+        tracemalloc.stop()
+        bot.MARKET_FEED.stop()
+        bot.TRADE_LOG.close()
+        bot.JOURNAL.close()
+        bot.PRICE_FETCHER.close()
+        bot.ORDER_PIPELINE.close()
+        exchange.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drive main's scan and sell paths against a local mock exchange")
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--scans', type=int, default=5)
+    parser.add_argument('--ticks', type=int, default=50, help='check_portfolio() calls after the scans')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the exchange adds to every response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with a 429')
+    parser.add_argument('--volatility', type=float, default=0.01, help='per minute, higher means more buys')
+    parser.add_argument('--no-feed', action='store_true', help='sell path prices from REST only')
+    parser.add_argument('--bot-rate-limits', action='store_true', help="keep the bot's own rate limits")
+    parser.add_argument('--no-bulk-stats', action='store_true', help='exchange without /products/stats')
+    args = parser.parse_args(argv)
+
+    results = run(args.products, args.scans, args.ticks, args.latency, args.error_rate, args.volatility,
+                  feed=not args.no_feed, rate_limits=None if args.bot_rate_limits else UNLIMITED,
+                  bulk_stats=not args.no_bulk_stats)
+    for name, value in results.items():
+        print(f"{name:>16}: {value:.2f}" if isinstance(value, float) else f"{name:>16}: {value}")
+
+
+if __name__ == '__main__':
+    main()
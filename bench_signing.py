@@ -0,0 +1,65 @@
+import argparse
+import base64
+import hashlib
+import hmac
+import os
+import time
+import timeit
+
+from signing import RequestSigner
+
+
+def legacy_headers(api_key, api_secret, passphrase, endpoint, method='GET', body=''):
+    # What create_request_headers used to do on every call
+    timestamp = str(time.time())
+    message = timestamp + method + endpoint + (body if body else '')
+    signature = hmac.new(
+        key=base64.b64decode(api_secret),
+        msg=message.encode('utf-8'),
+        digestmod=hashlib.sha256
+    ).hexdigest()
+    return {
+        'CB-ACCESS-KEY': api_key,
+        'CB-ACCESS-SIGN': signature,
+        'CB-ACCESS-TIMESTAMP': timestamp,
+        'CB-ACCESS-PASSPHRASE': passphrase,
+        'Content-Type': 'application/json'
+    }
+
+
+def run(iterations, batch_size):
+    """
+    :return: dict of case name -> microseconds per signed request
+    """
+    secret = base64.b64encode(os.urandom(64)).decode()
+    signer = RequestSigner('key', secret, 'passphrase')
+    body = '{"size": "0.01", "price": "100.0", "side": "buy", "product_id": "BTC-USD"}'
+    burst = [(f'/orders/{i}', 'GET', '') for i in range(batch_size)]
+
+    cases = {
+        'legacy GET': lambda: legacy_headers('key', secret, 'passphrase', '/accounts'),
+        'signer GET': lambda: signer.headers('/accounts'),
+        'legacy POST': lambda: legacy_headers('key', secret, 'passphrase', '/orders', 'POST', body),
+        'signer POST': lambda: signer.headers('/orders', 'POST', body),
+    }
+    results = {}
+    for name, fn in cases.items():
+        seconds = min(timeit.repeat(fn, number=iterations, repeat=5))
+        results[name] = seconds / iterations * 1e6
+    seconds = min(timeit.repeat(lambda: signer.sign_batch(burst), number=max(1, iterations // batch_size), repeat=5))
+    results[f'signer batch of {batch_size}'] = seconds / (max(1, iterations // batch_size) * batch_size) * 1e6
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Per-request signing overhead, old create_request_headers vs RequestSigner')
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    for name, micros in run(args.iterations, args.batch_size).items():
+        print(f"{name:>22}: {micros:6.2f} us/request")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Only the standard library up here, the restarted child has to import the bot's dependencies
+# itself or the import time it reports would be too good
+
+
+def write_warm_state(directory, exchange, positions):
+    """
+    The files a bot that was running against exchange would leave in directory: the product
+    snapshot, the last price snapshot and a journal holding positions open positions.
+    """
+    from datetime import datetime
+
+    import requests
+
+    from journal import Journal, BUY, new_client_oid
+    from portfolio import Portfolio
+    from price_index import LastPriceIndex
+    from product_cache import ProductCache
+
+    def fetch_products(etag=None):
+        response = requests.get(exchange.url + '/products')
+        return response.status_code, response.headers.get('ETag'), response.json()
+
+    products = ProductCache(fetch_products, snapshot_path=os.path.join(directory, 'products.json'))
+    products.refresh()  # saves the snapshot
+    product_ids = products.tradable_ids()
+
+    last_prices = LastPriceIndex(os.path.join(directory, 'last_prices.json'))
+    portfolio = Portfolio()
+    journal = Journal(os.path.join(directory, 'bot_journal.db'))
+    try:
+        for i, product_id in enumerate(product_ids):
+            price = float(requests.get(f'{exchange.url}/products/{product_id}/ticker').json()['price'])
+            last_prices.update(product_id, price)
+            if i < positions:
+                client_oid = new_client_oid()
+                journal.record_intent(client_oid, product_id, BUY, funds='100')
+                portfolio.open(product_id, price, 100 / price, datetime.now())
+                journal.record_fill(client_oid, 100 / price, 100, position=portfolio.get(product_id))
+    finally:
+        journal.close()
+    last_prices.save()
+
+
+def restart(directory, url, ws_url, api_secret, spawned_at):
+    """
+    Runs in the child: what main() does after a restart, up to and including the first position check.
+    """
+    os.chdir(directory)  # main's files are relative to the working directory
+    started = time.perf_counter()
+    import main as bot
+    imported = time.perf_counter()
+
+    bot.API_URL = url
+    bot.API_SECRET = api_secret
+    bot.BUY_FUNDS = '100'
+    bot.SIGNER = None
+    bot.CLIENT = bot.ExchangeClient(url, headers_fn=bot.create_request_headers, rate_limiter=bot.RATE_LIMITER,
+                                    pool_size=bot.SCAN_MAX_CONCURRENCY * 2)
+    bot.MARKET_FEED.url = ws_url
+    bot.TRADE_FEED.url = ws_url
+    bot.METRICS_PORT = 0
+    bot.setup_logging()
+    bot.start()
+    recovered = time.perf_counter()
+    bot.check_portfolio()
+    checked = time.perf_counter()
+
+    print(json.dumps({
+        'restart to first check s': time.time() - spawned_at,
+        'import main s': imported - started,
+        'start s': recovered - imported,
+        'first check s': checked - recovered,
+        'positions': len(bot.PORTFOLIO),
+        'last prices': len(bot.LAST_PRICES),
+        'products': len(bot.PRODUCTS),
+        'pandas loaded': 'pandas' in sys.modules,
+        'aiohttp loaded': 'aiohttp' in sys.modules,
+    }), flush=True)
+    # No clean shutdown, a supervisor restart doesn't get one either
+    os._exit(0)
+
+
+def run(positions=20, products=200, restarts=5, latency=0.0):
+    """
+    Restarts the bot in a fresh interpreter restarts times over the same warm state.
+
+    :return: dict of results, times are the median over the restarts
+    """
+    from mock_exchange import MockExchange
+
+    directory = tempfile.mkdtemp()
+    exchange = MockExchange(products, latency=latency).start()
+    try:
+        write_warm_state(directory, exchange, positions)
+        runs = []
+        for _ in range(restarts):
+            spawned_at = time.time()
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--restart', directory, exchange.url, exchange.ws_url,
+                 exchange.api_secret, repr(spawned_at)],
+                capture_output=True, text=True, check=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        results = dict(runs[-1])
+        for name, value in results.items():
+            if isinstance(value, float):
+                results[name] = sorted(run[name] for run in runs)[len(runs) // 2]
+        results['restarts'] = restarts
+        return results
+    finally:
+        exchange.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time a restart of the bot up to its first position check')
+    parser.add_argument('--positions', type=int, default=20, help='open positions in the journal')
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--restarts', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the exchange adds to every response')
+    parser.add_argument('--restart', nargs=5, metavar=('DIR', 'URL', 'WS_URL', 'API_SECRET', 'SPAWNED_AT'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.restart:
+        directory, url, ws_url, api_secret, spawned_at = args.restart
+        restart(directory, url, ws_url, api_secret, float(spawned_at))
+        return
+
+    results = run(args.positions, args.products, args.restarts, args.latency)
+    for name, value in results.items():
+        print(f"{name:>26}: {value:.3f}" if isinstance(value, float) else f"{name:>26}: {value}")
+
+
+if __name__ == '__main__':
+    main()
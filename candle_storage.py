@@ -0,0 +1,227 @@
+import argparse
+import csv
+import logging
+import os
+import threading
+
+import numpy as np
+
+from background_writer import DEFAULT_FLUSH_INTERVAL, BackgroundWriter
+
+
+# One structured record per candle, same column order the exchange uses
+CANDLE_DTYPE = np.dtype([
+    ('time', '<i8'),
+    ('low', '<f8'),
+    ('high', '<f8'),
+    ('open', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<f8'),
+])
+
+DEFAULT_ROOT = 'candle_data'
+SECONDS_PER_DAY = 24 * 60 * 60
+PARTITION_SUFFIX = '.npy'
+
+
+def to_records(rows):
+    """
+    Candle rows ([time, low, high, open, close, volume] lists) to a structured array.
+    """
+    if isinstance(rows, np.ndarray) and rows.dtype == CANDLE_DTYPE:
+        return rows
+    return np.array([tuple(row[:6]) for row in rows], dtype=CANDLE_DTYPE)
+
+
+def dedup_sorted(records):
+    """
+    Sorts by time and keeps the last record written for each time.
+    """
+    # np.unique keeps the first occurrence, so flip first to make later rows win
+    reversed_records = records[::-1]
+    _, first_index = np.unique(reversed_records['time'], return_index=True)
+    return reversed_records[first_index]
+
+
+class CandleStorage:
+    """
+    Candles on disk, one .npy file per (product_id, granularity, UTC day).
+
+        <root>/<product_id>/<granularity>/<YYYY-MM-DD>.npy
+
+    Each file is sorted by time with no duplicates. Writes are upserts on time that only
+    rewrite the days they touch, reads memory-map just the days inside the requested range.
+    """
+
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def _partition_dir(self, product_id, granularity):
+        return os.path.join(self.root, product_id, str(granularity))
+
+    def _partition_path(self, product_id, granularity, day):
+        name = np.datetime_as_string(np.datetime64(int(day), 'D')) + PARTITION_SUFFIX
+        return os.path.join(self._partition_dir(product_id, granularity), name)
+
+    def product_ids(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)))
+
+    def partition_days(self, product_id, granularity):
+        """
+        Days (as days since epoch) that have a partition file, sorted.
+        """
+        directory = self._partition_dir(product_id, granularity)
+        if not os.path.isdir(directory):
+            return []
+        days = []
+        for name in os.listdir(directory):
+            if name.endswith(PARTITION_SUFFIX):
+                day = np.datetime64(name[:-len(PARTITION_SUFFIX)], 'D')
+                days.append(int(day.astype('int64')))
+        return sorted(days)
+
+    def upsert(self, product_id, granularity, rows):
+        """
+        Inserts or replaces candles keyed on (product_id, time).
+
+        :return: number of partitions rewritten
+        """
+        records = to_records(rows)
+        if len(records) == 0:
+            return 0
+        days = records['time'] // SECONDS_PER_DAY
+        written = 0
+        with self._lock:
+            for day in np.unique(days):
+                path = self._partition_path(product_id, granularity, day)
+                incoming = records[days == day]
+                if os.path.exists(path):
+                    incoming = np.concatenate([np.load(path), incoming])
+                self._write(path, dedup_sorted(incoming))
+                written += 1
+        return written
+
+    @staticmethod
+    def _write(path, records):
+        # Write next to the target and swap it in so a crash never leaves half a partition
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, records)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def read(self, product_id, granularity, start, end):
+        """
+        Candles with start <= time < end (epoch seconds), sorted by time.
+        """
+        first_day, last_day = int(start) // SECONDS_PER_DAY, int(end) // SECONDS_PER_DAY
+        chunks = []
+        for day in self.partition_days(product_id, granularity):
+            if day < first_day or day > last_day:
+                continue
+            records = np.load(self._partition_path(product_id, granularity, day), mmap_mode='r')
+            lo, hi = np.searchsorted(records['time'], [start, end])
+            if hi > lo:
+                chunks.append(np.array(records[lo:hi]))
+        if not chunks:
+            return np.empty(0, dtype=CANDLE_DTYPE)
+        return np.concatenate(chunks)
+
+    def last(self, product_id, granularity):
+        """
+        Newest stored candle, or None.
+        """
+        days = self.partition_days(product_id, granularity)
+        if not days:
+            return None
+        records = np.load(self._partition_path(product_id, granularity, days[-1]), mmap_mode='r')
+        return np.array(records[-1]) if len(records) else None
+
+
+class CandleWriter(BackgroundWriter):
+    """
+    Candle upserts done by a background thread.
+
+    write() only puts the rows on a queue. The writer thread takes whatever has piled up,
+    merges it per (product_id, granularity) and calls upsert_fn once per key, so a burst of
+    bars costs one partition rewrite per key and none of it happens on the caller's thread.
+
+    :param upsert_fn: callable(product_id, granularity, rows), e.g. CandleStorage.upsert
+    """
+
+    thread_name = 'candle-writer'
+
+    def __init__(self, upsert_fn, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        super().__init__(flush_interval)
+        self.upsert_fn = upsert_fn
+
+    def write(self, product_id, granularity, rows):
+        self.put((product_id, granularity, list(rows)))
+
+    def write_batch(self, items):
+        pending = {}
+        for product_id, granularity, rows in items:
+            pending.setdefault((product_id, granularity), []).extend(rows)
+        for (product_id, granularity), rows in pending.items():
+            try:
+                self.upsert_fn(product_id, granularity, rows)
+            except Exception as e:
+                logging.error(f"Error writing candles for {product_id}: {e}")
+
+
+def migrate_csv(csv_path, storage, product_id=None, granularity=300, chunk_size=100_000):
+    """
+    Imports a historical_data.csv style file into the storage.
+
+    The old file has no product_id column, so product_id has to be given unless the
+    file has one. Duplicates and ordering get sorted out by the upsert.
+
+    :return: number of rows read
+    """
+    total = 0
+    pending = {}
+
+    def flush():
+        for pid, rows in pending.items():
+            storage.upsert(pid, granularity, rows)
+        pending.clear()
+
+    with open(csv_path, newline='') as f:
+        for row in csv.DictReader(f):
+            pid = row.get('product_id') or product_id
+            if not pid:
+                raise ValueError(f"{csv_path} has no product_id column, pass product_id")
+            pending.setdefault(pid, []).append([
+                int(float(row['time'])), float(row['low']), float(row['high']),
+                float(row['open']), float(row['close']), float(row['volume'])
+            ])
+            total += 1
+            if total % chunk_size == 0:
+                flush()
+    flush()
+    logging.info(f"Migrated {total} rows from {csv_path} into {storage.root}")
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Candle storage tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate = subparsers.add_parser('migrate', help='import a historical_data.csv file')
+    migrate.add_argument('csv_path')
+    migrate.add_argument('--product-id', help='product the rows belong to if the file has no product_id column')
+    migrate.add_argument('--granularity', type=int, default=300)
+    migrate.add_argument('--root', default=DEFAULT_ROOT)
+    args = parser.parse_args(argv)
+
+    if args.command == 'migrate':
+        rows = migrate_csv(args.csv_path, CandleStorage(args.root), args.product_id, args.granularity)
+        print(f"Imported {rows} rows into {args.root}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timezone
+
+import metrics
+
+
+# The candles endpoint refuses requests that would return more than this many buckets
+MAX_CANDLES_PER_REQUEST = 300
+
+# How far back the store keeps candles in memory, the buy conditions only look 2 hours back
+DEFAULT_RETENTION = 24 * 60 * 60
+
+CANDLE_TIME = 0
+
+CANDLE_CACHE = metrics.counter('candle_cache_lookups_total', 'Candle windows served from memory (hit) or not (miss)')
+
+
+def align(timestamp, granularity):
+    """
+    Start of the bucket that timestamp falls in.
+    """
+    return int(timestamp) - int(timestamp) % granularity
+
+
+def to_epoch(value):
+    return value.timestamp() if isinstance(value, datetime) else float(value)
+
+
+def to_datetime(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc)
+
+
+def _merge(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _subtract(start, end, covered):
+    gaps = []
+    cursor = start
+    for covered_start, covered_end in covered:
+        if covered_end <= cursor:
+            continue
+        if covered_start >= end:
+            break
+        if covered_start > cursor:
+            gaps.append((cursor, covered_start))
+        cursor = max(cursor, covered_end)
+    if cursor < end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+class CandleStore:
+    """
+    In-memory candles per (product_id, granularity), keyed by bucket start time.
+
+    The store remembers which closed buckets it has already fetched, so callers only
+    go to the exchange for the ranges it is missing (normally just the newest tail).
+    The bucket that is still open is never marked as covered and gets refetched, unless
+    the key is live: something that sees every trade (bar_aggregator) keeps it up to date
+    from a given time on, and nothing after that time is fetched.
+
+    :param sink: optional callable(product_id, granularity, rows) that gets every batch of
+                 fetched rows, used to persist them
+    """
+
+    def __init__(self, max_candles_per_request=MAX_CANDLES_PER_REQUEST, retention=DEFAULT_RETENTION, clock=time.time,
+                 sink=None):
+        self.max_candles_per_request = max_candles_per_request
+        self.retention = retention
+        self.sink = sink
+        self._clock = clock
+        self._candles = {}
+        self._covered = {}
+        self._live = {}
+        self._lock = threading.Lock()
+
+    def missing_ranges(self, product_id, granularity, start, end):
+        """
+        Ranges of [start, end) that still need fetching, each small enough for a single request.
+
+        :return: list of (start, end) epoch second tuples aligned to the granularity
+        """
+        start = align(to_epoch(start), granularity)
+        end = to_epoch(end)
+        with self._lock:
+            covered = list(self._covered.get((product_id, granularity), []))
+            live_since = self._live.get((product_id, granularity))
+        if live_since is not None:
+            covered = _merge(covered + [(live_since, max(end, live_since))])
+
+        chunk = self.max_candles_per_request * granularity
+        requests = []
+        for gap_start, gap_end in _subtract(start, end, covered):
+            while gap_start < gap_end:
+                requests.append((gap_start, min(gap_start + chunk, gap_end)))
+                gap_start += chunk
+        return requests
+
+    def add(self, product_id, granularity, rows, start, end, persist=True):
+        """
+        Stores candle rows fetched for [start, end) and marks the closed part of it as covered.
+
+        :param persist: False keeps the rows out of the sink, for bars that are still changing
+        """
+        key = (product_id, granularity)
+        now = self._clock()
+        # Only buckets that have finished can be trusted not to change
+        covered_end = min(to_epoch(end), align(now, granularity))
+        with self._lock:
+            candles = self._candles.setdefault(key, {})
+            for row in rows:
+                candles[int(row[CANDLE_TIME])] = list(row)
+            if covered_end > start:
+                self._covered[key] = _merge(self._covered.get(key, []) + [(int(start), int(covered_end))])
+            self._prune(key, now)
+        if self.sink and rows and persist:
+            self.sink(product_id, granularity, rows)
+
+    def set_live(self, product_id, granularity, since):
+        """
+        Treats everything from since on as covered, None goes back to fetching.
+        """
+        with self._lock:
+            if since is None:
+                self._live.pop((product_id, granularity), None)
+            else:
+                self._live[(product_id, granularity)] = since
+
+    def _prune(self, key, now):
+        cutoff = align(now - self.retention, key[1])
+        candles = self._candles[key]
+        for bucket_time in [t for t in candles if t < cutoff]:
+            del candles[bucket_time]
+        self._covered[key] = [(max(s, cutoff), e) for s, e in self._covered.get(key, []) if e > cutoff]
+
+    def window(self, product_id, granularity, start, end):
+        """
+        Candle rows whose bucket overlaps [start, end), oldest first.
+        """
+        start, end = align(to_epoch(start), granularity), to_epoch(end)
+        with self._lock:
+            candles = self._candles.get((product_id, granularity), {})
+            return [candles[t] for t in sorted(candles) if start <= t < end]
+
+    def get_candles(self, product_id, start, end, granularity, fetch_fn):
+        """
+        Fills in whatever is missing with fetch_fn and returns the window.
+
+        :param fetch_fn: callable(product_id, start_datetime, end_datetime, granularity) returning
+                         a list of candle rows, or None if the request failed
+        """
+        missing = self.missing_ranges(product_id, granularity, start, end)
+        CANDLE_CACHE.inc(result='miss' if missing else 'hit')
+        for range_start, range_end in missing:
+            rows = fetch_fn(product_id, to_datetime(range_start), to_datetime(range_end), granularity)
+            if rows is not None:
+                self.add(product_id, granularity, rows, range_start, range_end)
+        return self.window(product_id, granularity, start, end)
+
+    async def get_candles_async(self, product_id, start, end, granularity, fetch_fn):
+        """
+        Same as get_candles for a coroutine fetch_fn.
+
+        The sink gets everything fetched for the window in one batch, on the loop's executor:
+        it writes to disk and would hold up every other coroutine of the scan meanwhile.
+        """
+        missing = self.missing_ranges(product_id, granularity, start, end)
+        CANDLE_CACHE.inc(result='miss' if missing else 'hit')
+        fetched = []
+        for range_start, range_end in missing:
+            rows = await fetch_fn(product_id, to_datetime(range_start), to_datetime(range_end), granularity)
+            if rows is not None:
+                self.add(product_id, granularity, rows, range_start, range_end, persist=False)
+                fetched.extend(rows)
+        if self.sink and fetched:
+            await asyncio.get_running_loop().run_in_executor(None, self.sink, product_id, granularity, fetched)
+        return self.window(product_id, granularity, start, end)
@@ -0,0 +1,113 @@
+import logging
+import random
+import time
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from rate_limit import PRIVATE, endpoint_class_for, endpoint_key
+
+
+DEFAULT_POOL_SIZE = 20
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 10
+DEFAULT_GET_RETRIES = 3
+BACKOFF_BASE = 0.25
+BACKOFF_CAP = 5.0
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+class ExchangeClient:
+    """
+    Shared REST client: one pooled keep-alive session, explicit timeouts, rate limiting,
+    signing of private endpoints and per-request latency.
+
+    GETs are retried with jittered exponential backoff on connection errors, timeouts, 429s
+    and 5xx. POSTs are never retried automatically, a retried order could be a double order.
+    """
+
+    def __init__(self, api_url, headers_fn=None, rate_limiter=None, pool_size=DEFAULT_POOL_SIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 get_retries=DEFAULT_GET_RETRIES, registry=metrics.REGISTRY):
+        self.api_url = api_url
+        self.headers_fn = headers_fn
+        self.rate_limiter = rate_limiter
+        self.timeout = (connect_timeout, read_timeout)
+        self.get_retries = get_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.request_seconds = registry.histogram('rest_request_seconds', 'REST round trip time')
+        self.requests = registry.counter('rest_requests_total', 'REST responses by status, or error')
+        self.retries = registry.counter('rest_retries_total', 'GETs retried after an error or retryable status')
+
+    def _send(self, method, endpoint, params=None, body='', extra_headers=None):
+        endpoint_class = endpoint_class_for(endpoint)
+        if self.rate_limiter:
+            self.rate_limiter.acquire(endpoint_class)
+        # The signature covers the query string, so the URL goes out exactly the way it was signed
+        path = endpoint + '?' + urlencode(params) if params else endpoint
+        # Public market data needs no key, only authenticated endpoints pay for a signature
+        headers = None
+        if self.headers_fn and endpoint_class == PRIVATE:
+            headers = self.headers_fn(path, method, body)
+        if extra_headers:
+            headers = dict(headers or {}, **extra_headers)
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            if method == 'GET':
+                response = self.session.get(self.api_url + path, headers=headers, timeout=self.timeout)
+            else:
+                response = self.session.post(self.api_url + endpoint, headers=headers, data=body,
+                                             timeout=self.timeout)
+            status = str(response.status_code)
+        finally:
+            key = endpoint_key(endpoint)
+            self.request_seconds.observe(time.perf_counter() - started, method=method, endpoint=key)
+            self.requests.inc(method=method, endpoint=key, status=status)
+        if self.rate_limiter:
+            self.rate_limiter.handle_response(endpoint_class, response.status_code, response.headers)
+        return response
+
+    def get(self, endpoint, params=None, headers=None):
+        """
+        GET with retries, returns the last response or raises the last connection error.
+
+        :param headers: extra request headers, e.g. If-None-Match for a conditional GET
+        """
+        for attempt in range(self.get_retries + 1):
+            last_attempt = attempt == self.get_retries
+            try:
+                response = self._send('GET', endpoint, params, extra_headers=headers)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if last_attempt:
+                    raise
+                logging.warning(f"GET {endpoint} failed ({e}), retrying")
+            else:
+                if response.status_code not in RETRY_STATUSES or last_attempt:
+                    return response
+                logging.warning(f"GET {endpoint} returned {response.status_code}, retrying")
+            self.retries.inc(endpoint=endpoint_key(endpoint))
+            # A 429 has already pushed the rate limiter back, this only spreads out the rest
+            time.sleep(random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)))
+
+    def post(self, endpoint, body):
+        """
+        Single attempt POST, whatever happens is up to the caller.
+        """
+        return self._send('POST', endpoint, body=body)
+
+    def latency_stats(self):
+        """
+        {(method, endpoint): {'count', 'mean', 'p50', 'p99', 'max'}} in seconds over the recent samples.
+        """
+        stats = {}
+        for labels in self.request_seconds.label_sets():
+            stats[(labels['method'], labels['endpoint'])] = self.request_seconds.stats(**labels)
+        return stats
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,194 @@
+import math
+import threading
+from collections import deque
+
+import numpy as np
+
+
+# Updates in the rolling window and the EMA span. The feed pushes one per minute, quiet
+# minutes included, so 60 is the last hour
+DEFAULT_WINDOW = 60
+DEFAULT_EMA_SPAN = 20
+
+# Slots the arrays start with, they double whenever they fill up
+INITIAL_CAPACITY = 16
+
+INDICATOR_NAMES = ('rolling_return', 'high', 'low', 'ema', 'vwap', 'volatility')
+
+
+class RollingIndicators:
+    """
+    Rolling-window indicators for many products, updated one price at a time.
+
+    Every product gets a slot in a set of parallel arrays: a ring of the last window + 1
+    prices, rings of the last window returns and price * volume, running sums over those
+    rings and the EMA. Rolling high and low come from monotonic deques. An update is O(1),
+    reading an indicator is a lookup, nothing ever rescans the window.
+
+    The values match pandas on the same series:
+        rolling_return   prices.pct_change(window) * 100
+        high / low       prices.rolling(window).max() / .min()
+        ema              prices.ewm(span=ema_span, adjust=False).mean()
+        vwap             (prices * volumes).rolling(window).sum() / volumes.rolling(window).sum()
+        volatility       (prices.pct_change() * 100).rolling(window).std()
+    and are NaN until there is a full window, the same as pandas.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, ema_span=DEFAULT_EMA_SPAN, capacity=INITIAL_CAPACITY):
+        if window < 2:
+            raise ValueError(f"window must be at least 2, got {window}")
+        self.window = window
+        self.alpha = 2.0 / (ema_span + 1)
+        self._index = {}
+        self._count = np.zeros(capacity, dtype=np.int64)
+        self._prices = np.empty((capacity, window + 1))
+        self._returns = np.empty((capacity, window))
+        self._pv = np.empty((capacity, window))
+        self._volumes = np.empty((capacity, window))
+        self._ema = np.empty(capacity)
+        self._sum_returns = np.zeros(capacity)
+        self._sum_squares = np.zeros(capacity)
+        self._sum_pv = np.zeros(capacity)
+        self._sum_volume = np.zeros(capacity)
+        self._highs = []
+        self._lows = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, product_id):
+        return product_id in self._index
+
+    def _grow(self):
+        for name in ('_count', '_prices', '_returns', '_pv', '_volumes', '_ema', '_sum_returns', '_sum_squares',
+                     '_sum_pv', '_sum_volume'):
+            old = getattr(self, name)
+            new = np.zeros((max(1, len(old) * 2),) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _slot(self, product_id):
+        i = self._index.get(product_id)
+        if i is None:
+            i = self._index[product_id] = len(self._index)
+            if i == len(self._count):
+                self._grow()
+            self._count[i] = 0
+            self._sum_returns[i] = self._sum_squares[i] = self._sum_pv[i] = self._sum_volume[i] = 0.0
+            self._highs.append(deque())
+            self._lows.append(deque())
+        return i
+
+    def update(self, product_id, price, volume=0.0):
+        """
+        Adds the next price (a bar close or a trade) for one product.
+        """
+        price, volume = float(price), float(volume)
+        window = self.window
+        with self._lock:
+            i = self._slot(product_id)
+            n = int(self._count[i])
+
+            if n > 0:
+                previous = self._prices[i, (n - 1) % (window + 1)]
+                change = (price / previous - 1) * 100 if previous else math.nan
+                slot = (n - 1) % window
+                if n - 1 >= window:
+                    old = self._returns[i, slot]
+                    self._sum_returns[i] -= old
+                    self._sum_squares[i] -= old * old
+                self._returns[i, slot] = change
+                self._sum_returns[i] += change
+                self._sum_squares[i] += change * change
+                self._ema[i] += self.alpha * (price - self._ema[i])
+            else:
+                self._ema[i] = price
+
+            slot = n % window
+            if n >= window:
+                self._sum_pv[i] -= self._pv[i, slot]
+                self._sum_volume[i] -= self._volumes[i, slot]
+            self._pv[i, slot] = price * volume
+            self._volumes[i, slot] = volume
+            self._sum_pv[i] += price * volume
+            self._sum_volume[i] += volume
+
+            self._prices[i, n % (window + 1)] = price
+            self._count[i] = n + 1
+
+            # Once per window the running sums are redone from the rings, so rounding error
+            # from the add/subtract pairs can't build up, that's still O(1) per update on average
+            if (n + 1) % window == 0:
+                self._sum_pv[i] = self._pv[i].sum()
+                self._sum_volume[i] = self._volumes[i].sum()
+                if n >= window:
+                    self._sum_returns[i] = self._returns[i].sum()
+                    self._sum_squares[i] = np.dot(self._returns[i], self._returns[i])
+
+            highs, lows = self._highs[i], self._lows[i]
+            while highs and highs[-1][1] <= price:
+                highs.pop()
+            highs.append((n, price))
+            if highs[0][0] <= n - window:
+                highs.popleft()
+            while lows and lows[-1][1] >= price:
+                lows.pop()
+            lows.append((n, price))
+            if lows[0][0] <= n - window:
+                lows.popleft()
+
+    def _value(self, i, name):
+        n = int(self._count[i])
+        window = self.window
+        if name == 'ema':
+            return float(self._ema[i]) if n else math.nan
+        if name == 'rolling_return':
+            if n <= window:
+                return math.nan
+            start = self._prices[i, (n - 1 - window) % (window + 1)]
+            end = self._prices[i, (n - 1) % (window + 1)]
+            return (end / start - 1) * 100 if start else math.nan
+        if name == 'volatility':
+            if n <= window:
+                return math.nan
+            total = self._sum_returns[i]
+            variance = (self._sum_squares[i] - total * total / window) / (window - 1)
+            return math.sqrt(max(0.0, variance))
+        if n < window:
+            return math.nan
+        if name == 'high':
+            return self._highs[i][0][1]
+        if name == 'low':
+            return self._lows[i][0][1]
+        if name == 'vwap':
+            return float(self._sum_pv[i] / self._sum_volume[i]) if self._sum_volume[i] else math.nan
+        raise ValueError(f"Unknown indicator {name}, expected one of {INDICATOR_NAMES}")
+
+    def get(self, product_id, name):
+        """
+        One indicator for one product, NaN if the product has no full window yet.
+        """
+        with self._lock:
+            i = self._index.get(product_id)
+            if i is None:
+                if name not in INDICATOR_NAMES:
+                    raise ValueError(f"Unknown indicator {name}, expected one of {INDICATOR_NAMES}")
+                return math.nan
+            return self._value(i, name)
+
+    def snapshot(self, product_id):
+        """
+        {indicator name: value} for one product.
+        """
+        with self._lock:
+            i = self._index.get(product_id)
+            return {name: math.nan if i is None else self._value(i, name) for name in INDICATOR_NAMES}
+
+    def vector(self, name, product_ids):
+        """
+        One indicator for a list of products as an array, NaN for products we know nothing about.
+        """
+        with self._lock:
+            return np.array([math.nan if product_id not in self._index else self._value(self._index[product_id], name)
+                             for product_id in product_ids], dtype=float)
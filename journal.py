@@ -0,0 +1,368 @@
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+
+DEFAULT_JOURNAL_PATH = 'bot_journal.db'
+
+# Trailing highs and previous prices change every second, they are written at most this often
+DEFAULT_FLUSH_INTERVAL = 5.0
+
+# Order lifecycle in the journal
+INTENT = 'intent'        # written before the POST, the exchange may or may not have it
+SUBMITTED = 'submitted'  # exchange accepted it, not filled yet
+FILLED = 'filled'
+FAILED = 'failed'        # never reached the exchange or was rejected
+PENDING_STATUSES = (INTENT, SUBMITTED)
+
+BUY = 'buy'
+SELL = 'sell'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    client_oid TEXT PRIMARY KEY,
+    product_id TEXT NOT NULL,
+    side TEXT NOT NULL,
+    status TEXT NOT NULL,
+    order_id TEXT,
+    funds TEXT,
+    size TEXT,
+    filled_size REAL,
+    executed_value REAL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orders_status ON orders (status);
+CREATE TABLE IF NOT EXISTS positions (
+    product_id TEXT PRIMARY KEY,
+    purchase_price REAL NOT NULL,
+    amount REAL NOT NULL,
+    purchase_time REAL,
+    highest_price REAL NOT NULL,
+    previous_price REAL NOT NULL
+);
+"""
+
+
+def new_client_oid():
+    # The exchange wants a UUID, it is echoed back so a lost response can still be matched up
+    return str(uuid.uuid4())
+
+
+def _epoch(value):
+    if value is None:
+        return None
+    return value.timestamp() if isinstance(value, datetime) else float(value)
+
+
+class Journal:
+    """
+    Order intents, fills and open positions in a SQLite database in WAL mode.
+
+    Order and position changes are committed before the call returns, so an order intent
+    is on disk before the order goes out. Trailing price updates are only buffered and
+    written in one transaction every flush_interval seconds.
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL_PATH, flush_interval=DEFAULT_FLUSH_INTERVAL, clock=time.time):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._clock = clock
+        self._pending_updates = {}
+        self._last_flush = clock()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        # FULL fsyncs the WAL on every commit, which is what makes an intent safe to act on
+        self._db.execute('PRAGMA synchronous=FULL')
+        self._db.executescript(SCHEMA)
+
+    def _write(self, statements, conditional=False):
+        """
+        Runs the statements in one transaction.
+
+        :param conditional: only run the rest if the first statement changes a row
+        :return: False if a conditional write changed nothing
+        """
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                for i, (sql, args) in enumerate(statements):
+                    if self._db.execute(sql, args).rowcount == 0 and conditional and i == 0:
+                        self._db.execute('ROLLBACK')
+                        return False
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+        return True
+
+    def record_intent(self, client_oid, product_id, side, funds=None, size=None):
+        now = self._clock()
+        self._write([(
+            'INSERT INTO orders (client_oid, product_id, side, status, funds, size, created, updated) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (client_oid, product_id, side, INTENT, funds, size, now, now),
+        )])
+
+    def record_submitted(self, client_oid, order_id):
+        self._write([(
+            'UPDATE orders SET status = ?, order_id = ?, updated = ? WHERE client_oid = ? AND status IN (?, ?)',
+            (SUBMITTED, order_id, self._clock(), client_oid) + PENDING_STATUSES,
+        )])
+
+    def record_failed(self, client_oid):
+        """
+        :return: False if the order was already settled, the journal is left as it was
+        """
+        return self._write([(
+            'UPDATE orders SET status = ?, updated = ? WHERE client_oid = ? AND status IN (?, ?)',
+            (FAILED, self._clock(), client_oid) + PENDING_STATUSES,
+        )], conditional=True)
+
+    def record_fill(self, client_oid, filled_size, executed_value, position=None, closed_product_id=None):
+        """
+        Marks an order filled and applies its effect on the positions in the same transaction.
+
+        :param position: Position opened (or averaged into) by a buy
+        :param closed_product_id: product whose position a sell closed
+        :return: False if the order was already settled, nothing is written then
+        """
+        statements = [(
+            'UPDATE orders SET status = ?, filled_size = ?, executed_value = ?, updated = ? '
+            'WHERE client_oid = ? AND status IN (?, ?)',
+            (FILLED, float(filled_size), float(executed_value), self._clock(), client_oid) + PENDING_STATUSES,
+        )]
+        if position is not None:
+            statements.append(self._position_statement(position))
+        if closed_product_id is not None:
+            statements.append(('DELETE FROM positions WHERE product_id = ?', (closed_product_id,)))
+        if not self._write(statements, conditional=True):
+            return False
+        if closed_product_id is not None:
+            with self._lock:
+                self._pending_updates.pop(closed_product_id, None)
+        return True
+
+    def _position_statement(self, position):
+        return (
+            'INSERT OR REPLACE INTO positions (product_id, purchase_price, amount, purchase_time, highest_price, '
+            'previous_price) VALUES (?, ?, ?, ?, ?, ?)',
+            (position.product_id, position.purchase_price, position.amount, _epoch(position.purchase_time),
+             position.highest_price, position.previous_price),
+        )
+
+    def update_positions(self, positions):
+        """
+        Buffers the latest trailing prices, flushes them if the last flush is old enough.
+        """
+        with self._lock:
+            for position in positions:
+                self._pending_updates[position.product_id] = position
+        if self._clock() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            updates, self._pending_updates = self._pending_updates, {}
+            self._last_flush = self._clock()
+        if not updates:
+            return 0
+        # UPDATE, not upsert: a position that was sold in the meantime must stay gone
+        self._write([(
+            'UPDATE positions SET highest_price = ?, previous_price = ? WHERE product_id = ?',
+            (p.highest_price, p.previous_price, p.product_id),
+        ) for p in updates.values()])
+        return len(updates)
+
+    def open_positions(self):
+        """
+        :return: list of dicts with the Portfolio.open/restore fields
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT product_id, purchase_price, amount, purchase_time, highest_price, previous_price '
+                'FROM positions ORDER BY product_id').fetchall()
+        return [_position_dict(*row) for row in rows]
+
+    def open_position(self, product_id):
+        """
+        One journaled position as a Portfolio.restore dict, None if there is none.
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT product_id, purchase_price, amount, purchase_time, highest_price, previous_price '
+                'FROM positions WHERE product_id = ?', (product_id,)).fetchone()
+        return None if row is None else _position_dict(*row)
+
+    def order_status(self, client_oid):
+        """
+        :return: the order's status, None if it isn't journaled
+        """
+        with self._lock:
+            row = self._db.execute('SELECT status FROM orders WHERE client_oid = ?', (client_oid,)).fetchone()
+        return None if row is None else row[0]
+
+    def pending_orders(self):
+        """
+        Orders whose outcome we never saw, oldest first.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT client_oid, product_id, side, status, order_id FROM orders '
+                'WHERE status IN (?, ?) ORDER BY created', PENDING_STATUSES).fetchall()
+        return [dict(zip(('client_oid', 'product_id', 'side', 'status', 'order_id'), row)) for row in rows]
+
+    def close(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logging.error(f"Error flushing journal {self.path}: {e}")
+        with self._lock:
+            self._db.close()
+
+
+def _position_dict(product_id, purchase_price, amount, purchase_time, highest_price, previous_price):
+    return {
+        'product_id': product_id,
+        'purchase_price': purchase_price,
+        'amount': amount,
+        'purchase_time': None if purchase_time is None else datetime.fromtimestamp(purchase_time),
+        'highest_price': highest_price,
+        'previous_price': previous_price,
+    }
+
+
+def fill_totals(fills):
+    """
+    Filled size, executed value and fees from /fills entries of one order.
+    """
+    size = sum(float(fill['size']) for fill in fills)
+    value = sum(float(fill['size']) * float(fill['price']) for fill in fills)
+    fees = sum(float(fill.get('fee') or 0) for fill in fills)
+    return size, value, fees
+
+
+def restore_positions(journal, portfolio):
+    """
+    Loads the journaled positions into the portfolio, returns how many there were.
+    """
+    rows = journal.open_positions()
+    for row in rows:
+        portfolio.restore(**row)
+    return len(rows)
+
+
+def order_totals(remote):
+    """
+    Filled size, executed value and fees from an exchange order, None if it doesn't have them.
+    """
+    if remote.get('filled_size') is None or remote.get('executed_value') is None:
+        return None
+    return float(remote['filled_size']), float(remote['executed_value']), float(remote.get('fill_fees') or 0)
+
+
+def restore_unsold(journal, portfolio, order):
+    """
+    Puts a position back in the portfolio after its sell failed.
+
+    An accepted sell takes the position out of the portfolio right away, so the sell rules
+    can't fire twice, but the journal keeps it until the fill. If the sell never fills, the
+    journal row is what's left of the position.
+    """
+    product_id = order['product_id']
+    if order['side'] != SELL or product_id in portfolio:
+        return False
+    row = journal.open_position(product_id)
+    if row is None:
+        return False
+    portfolio.restore(**row)
+    logging.warning(f"Sell order {order['client_oid']} for {product_id} didn't fill, position restored")
+    return True
+
+
+def _index_recent(fetch_recent):
+    # Recent orders by exchange id and by client_oid, empty if they can't be had
+    recent = {}
+    try:
+        for remote in fetch_recent():
+            recent[remote['id']] = remote
+            if remote.get('client_oid'):
+                recent['client:' + remote['client_oid']] = remote
+    except Exception as e:
+        logging.warning(f"Could not list recent orders, looking them up one at a time: {e}")
+    return recent
+
+
+def reconcile_pending(journal, portfolio, fetch_order, fetch_fills, on_fill=None, skip=(), fetch_recent=None):
+    """
+    Settles orders whose outcome we never saw, against what the exchange says happened.
+
+    :param fetch_order: callable(client_oid) -> exchange order dict, or None if the exchange never got it
+    :param fetch_fills: callable(order_id) -> list of fill dicts, only used for orders without their totals
+    :param on_fill: optional callable(order, remote, filled_size, executed_value, fees) for every settled fill
+    :param skip: client_oids to leave pending, checked as each order comes up (orders still being sent
+                 would look like they never reached the exchange)
+    :param fetch_recent: optional callable() -> list of the exchange's recent orders, called once; pending
+                         orders it has need no request of their own
+    :return: dict with counts of filled/failed/still pending orders
+    """
+    summary = {'filled': 0, 'failed': 0, 'pending': 0}
+    pending = journal.pending_orders()
+    recent = {}
+    if fetch_recent is not None and any(order['client_oid'] not in skip for order in pending):
+        recent = _index_recent(fetch_recent)
+
+    for order in pending:
+        client_oid, product_id = order['client_oid'], order['product_id']
+        if client_oid in skip:
+            summary['pending'] += 1
+            continue
+        if journal.order_status(client_oid) not in PENDING_STATUSES:
+            # Its sender settled it while we were talking to the exchange
+            continue
+        remote = recent.get(order['order_id']) or recent.get('client:' + client_oid)
+        if remote is None:
+            try:
+                remote = fetch_order(client_oid)
+            except Exception as e:
+                logging.error(f"Could not look up order {client_oid} for {product_id}: {e}")
+                summary['pending'] += 1
+                continue
+
+        if remote is None:
+            # Crashed before the POST got through, nothing to undo
+            if journal.record_failed(client_oid):
+                restore_unsold(journal, portfolio, order)
+                summary['failed'] += 1
+            continue
+        if remote.get('status') != 'done':
+            if order['status'] == INTENT:
+                journal.record_submitted(client_oid, remote.get('id'))
+            summary['pending'] += 1
+            continue
+
+        totals = order_totals(remote)
+        filled_size, executed_value, fees = totals if totals is not None else fill_totals(fetch_fills(remote['id']))
+        if not filled_size:
+            if journal.record_failed(client_oid):  # done without a fill, i.e. cancelled or rejected
+                restore_unsold(journal, portfolio, order)
+                summary['failed'] += 1
+            continue
+
+        if order['side'] == BUY:
+            portfolio.open(product_id, executed_value / filled_size, filled_size, datetime.now())
+            journal.record_fill(client_oid, filled_size, executed_value, position=portfolio.get(product_id))
+        else:
+            if not journal.record_fill(client_oid, filled_size, executed_value, closed_product_id=product_id):
+                continue
+            portfolio.close(product_id)
+        if on_fill:
+            on_fill(order, remote, filled_size, executed_value, fees)
+        summary['filled'] += 1
+        logging.info(f"Recovered {order['side']} of {filled_size} {product_id} from order {client_oid}")
+
+    return summary
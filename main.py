@@ -1,332 +1,702 @@
-import requests
-import logging
-import json
-import base64
-import hmac
-import hashlib
-import time
-from datetime import datetime, timedelta
-import pandas as pd
-import os
-
-
-
-
-def rate_limiter():
-    time.sleep(1)  # Adjust the duration based on the API's rate limit it should be 30
-    # Global variables initialization
-
-
-held_crypto = None  #  it should be None when not holding any crypto
-owned_crypto = False  #  it should be False when no crypto is owned
-
-# Configure logging to write to a file
-logging.basicConfig(filename='bot_log.txt', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Replace with  Coinbase Pro API creds when ready after mock test passes
-API_KEY = 'API_KEY'
-API_SECRET = 'API_SECRET'
-API_PASSPHRASE = 'API_PASSPHRASE'
-
-# Coinbase Pro API endpoints
-API_URL = 'https://api.pro.coinbase.com'
-
-
-def create_request_headers(endpoint, method='GET', body=''):
-    try:
-        timestamp = str(time.time())
-        message = timestamp + method + endpoint + (body if body else '')
-        signature = hmac.new(
-            key=base64.b64decode(API_SECRET),
-            msg=message.encode('utf-8'),
-            digestmod=hashlib.sha256
-        ).hexdigest()
-        headers = {
-            'CB-ACCESS-KEY': API_KEY,
-            'CB-ACCESS-SIGN': signature,
-            'CB-ACCESS-TIMESTAMP': timestamp,
-            'CB-ACCESS-PASSPHRASE': API_PASSPHRASE,
-            'Content-Type': 'application/json'
-        }
-        return headers
-    except Exception as e:
-        logging.error(f"Error creating request headers: {e}")
-        return None
-
-
-def fetch_historical_data(product_id, start_time, end_time, granularity=300):
-    try:
-        endpoint = f'/products/{product_id}/candles'
-        params = {
-            'start': start_time.isoformat(),
-            'end': end_time.isoformat(),
-            'granularity': granularity
-        }
-        headers = create_request_headers(endpoint, 'GET')
-        response = requests.get(API_URL + endpoint, headers=headers, params=params)
-
-        if response.status_code == 200:
-            data = pd.DataFrame(response.json(), columns=['time', 'low', 'high', 'open', 'close', 'volume'])
-
-            # Append data to CSV
-            append_to_csv(data, 'historical_data.csv')
-
-            return data
-        else:
-            logging.warning(f"Failed to fetch historical data for {product_id}: {response.status_code}")
-            return pd.DataFrame()
-    except Exception as e:
-        logging.error(f"Error fetching historical data for {product_id}: {e}")
-        return pd.DataFrame()
-
-def fetch_current_price_data(product_id):
-    try:
-        endpoint = f'/products/{product_id}/ticker'
-        headers = create_request_headers(endpoint, 'GET')
-        response = requests.get(API_URL + endpoint, headers=headers)
-
-        if response.status_code == 200:
-            data = response.json()
-            return float(data['price'])  # Assuming the response contains a 'price' field
-        else:
-            logging.warning(f"Failed to fetch current price for {product_id}: {response.status_code}")
-            return None
-    except Exception as e:
-        logging.error(f"Error fetching current price for {product_id}: {e}")
-        return None
-
-def fetch_last_checked_price(product_id):
-    try:
-        # Read the historical data CSV file
-        historical_data = pd.read_csv('historical_data.csv')
-
-        # Filter the data for the given product_id and get the most recent entry
-        filtered_data = historical_data[historical_data['product_id'] == product_id]
-        if not filtered_data.empty:
-            last_checked_price = filtered_data.iloc[-1]['close']  # Assuming 'close' column has the last price
-            return last_checked_price
-        else:
-            return 0  # Return a default value if no data is found for the product_id
-    except FileNotFoundError:
-        return 0  # Return a default value if the file does not exist
-    except Exception as e:
-        logging.error(f"Error fetching last checked price for {product_id}: {e}")
-        return 0
-
-
-
-def get_available_products():
-    try:
-        endpoint = '/products'
-        headers = create_request_headers(endpoint, 'GET')
-        response = requests.get(API_URL + endpoint, headers=headers)
-
-        if response.status_code == 200:
-            products = json.loads(response.text)
-            return [product['id'] for product in products if product['trading_disabled'] == False]
-        else:
-            logging.warning(f"Failed to fetch products: {response.status_code}")
-            return []
-    except Exception as e:
-        logging.error(f"Error fetching products: {e}")
-        return []
-
-def append_to_csv(data, file_name):
-    """
-    Appends a DataFrame to a CSV file. Creates the file if it does not exist.
-
-    :param data: DataFrame to append
-    :param file_name: Name of the CSV file
-    """
-    try:
-        # Check if the file exists
-        file_exists = os.path.isfile(file_name)
-
-        # Append data to the CSV file; create a new file if it doesn't exist
-        data.to_csv(file_name, mode='a', header=not file_exists, index=False)
-        logging.info(f"Data appended to {file_name}")
-    except Exception as e:
-        logging.error(f"Error appending data to CSV: {e}")
-
-
-def check_and_execute_buy(product_id, last_checked_price):
-    try:
-        now = datetime.now()
-
-        # Checking buy conditions
-        #  adjust or add more conditions here when it gets running, keep it basic for now
-        is_buy_condition_met = False
-
-        # Condition 1: 10% increase over the past 2 hours
-        start_time_2h = now - timedelta(hours=2)
-        historical_data_2h = fetch_historical_data(product_id, start_time_2h, now)
-        if not historical_data_2h.empty:
-            price_increase_2h = (historical_data_2h['close'].iloc[-1] - historical_data_2h['open'].iloc[0]) / \
-                                historical_data_2h['open'].iloc[0] * 100
-            if price_increase_2h >= 10:
-                is_buy_condition_met = True
-
-        # Condition 2: 10% increase over the past 1 hour
-        start_time_1h = now - timedelta(hours=1)
-        historical_data_1h = fetch_historical_data(product_id, start_time_1h, now)
-        if not historical_data_1h.empty:
-            price_increase_1h = (historical_data_1h['close'].iloc[-1] - historical_data_1h['open'].iloc[0]) / \
-                                historical_data_1h['open'].iloc[0] * 100
-            if price_increase_1h >= 10:
-                is_buy_condition_met = True
-
-        # Condition 3: 5% increase since the last API call
-        current_price = fetch_current_price_data(product_id)
-        if current_price is not None and last_checked_price is not None:
-            price_increase_since_last_check = (current_price - last_checked_price) / last_checked_price * 100
-            if price_increase_since_last_check >= 5:
-                is_buy_condition_met = True
-
-        # If any buy condition is met, execute buy order
-        if is_buy_condition_met:
-            global held_crypto, owned_crypto
-            # Execute buy order logic
-            # Define the amount to buy or the funds to use
-            buy_order_data = {
-                'type': 'market',
-                'product_id': product_id,
-                'funds': 'FIAT_AMOUNT_TO_SPEND'  # Replace with the fiat amount we will want to spend
-            }
-
-            endpoint = '/orders'
-            body = json.dumps(buy_order_data)
-            headers = create_request_headers(endpoint, 'POST', body)
-            response = requests.post(API_URL + endpoint, headers=headers, data=body)
-
-            if response.status_code == 200:
-                response_data = response.json()
-                # Assuming response contains the amount of crypto bought
-                amount_bought = response_data['filled_size']
-                purchase_price = response_data['executed_value'] / amount_bought
-
-                # Update held_crypto
-                held_crypto = {
-                    'product_id': product_id,
-                    'purchase_price': purchase_price,
-                    'amount': amount_bought,
-                    'time': datetime.now()
-                }
-
-                # Append order details to CSV
-                order_details_df = pd.DataFrame([{
-                    'product_id': product_id,
-                    'purchase_price': purchase_price,
-                    'amount_bought': amount_bought,
-                    'time': datetime.now()
-                }])
-                append_to_csv(order_details_df, 'buy_orders.csv')
-
-                logging.info(f"Successfully executed buy order for {product_id}: Bought {amount_bought} units at {purchase_price} each.")
-            else:
-                logging.warning(f"Failed to execute buy order for {product_id}: {response.status_code}, Response: {response.text}")
-
-    except Exception as e:
-        logging.error(f"An error occurred: {e}")
-
-    return False
-
-
-
-def check_and_execute_sell_order(product_id, purchase_price, highest_price, previous_price, purchase_time):
-    global held_crypto, owned_crypto
-
-    current_data = fetch_current_price_data(product_id)  # Ensure this function is implemented to get the current price
-    if current_data.empty or not owned_crypto or not held_crypto:
-        logging.info("No data to check sell condition or no cryptocurrency currently held to sell.")
-        return False
-
-    current_price = current_data['price']
-    price_drop_from_previous = (current_price - previous_price) / previous_price * 100
-    price_drop_from_highest = (current_price - highest_price) / highest_price * 100
-    price_gain_from_purchase = (current_price - purchase_price) / purchase_price * 100
-
-    # Check the selling conditions
-    if price_drop_from_previous <= -5 or price_drop_from_highest <= -5 or price_gain_from_purchase >= 25:
-        # Execute sell order if conditions are met
-        amount_to_sell = held_crypto['amount']  # Amount of cryptocurrency to sell
-
-        try:
-            sell_order_data = {
-                'type': 'market',
-                'product_id': product_id,
-                'size': str(amount_to_sell)
-            }
-            endpoint = '/orders'
-            body = json.dumps(sell_order_data)
-            headers = create_request_headers(endpoint, 'POST', body)
-            response = requests.post(API_URL + endpoint, headers=headers, data=body)
-
-            if response.status_code == 200:
-                response_data = response.json()
-                logging.info(f"Successfully executed sell order for {product_id}: Sold {amount_to_sell} units.")
-
-                # Append order details to CSV
-                order_details_df = pd.DataFrame([{
-                    'product_id': product_id,
-                    'amount_sold': amount_to_sell,
-                    'sell_price': current_price,  # Assuming you/me whoever(just me since Im alone on this project but hopefully someone will eventually look at it!!) want to record the sell price,which should be but not necessarily needed
-                    'time': datetime.now(),
-                    # Include other relevant details from response_data if and when needed...like anything the user wants...can think about this later
-                }])
-                append_to_csv(order_details_df, 'sell_orders.csv')
-
-                # Resetting owned_crypto and held_crypto after successful sell
-                owned_crypto = False
-                held_crypto = None
-                return True
-            else:
-                logging.warning(f"Failed to execute sell order for {product_id}: {response.status_code}, Response: {response.text}")
-                return False
-        except Exception as e:
-            logging.error(f"Error executing sell order for {product_id}: {e}")
-            return False
-    else:
-        logging.info("Sell conditions not met.")
-        return False
-
-def main():
-    global owned_crypto, held_crypto
-    highest_price = 0  # Initialize the highest price
-    previous_price = 0  # Initialize the previous price
-    while True:
-        try:
-            current_time = datetime.now()
-
-            # Check buy conditions only if no cryptocurrency is currently owned
-            if not owned_crypto and current_time.minute == 0 and current_time.second == 0:
-                available_products = get_available_products()
-                for product_id in available_products:
-                    rate_limiter()  # Apply rate limiting here
-                    last_checked_price = fetch_last_checked_price(product_id)  # I need to define this and make more efficient..
-                    if check_and_execute_buy(product_id, last_checked_price):
-                        owned_crypto = True
-                        break  # Exit the loop after buying a cryptocurrency
-
-            # Update the highest price and check sell condition for the owned cryptocurrency
-            if owned_crypto and held_crypto:
-                rate_limiter()  # Apply rate limiting here
-                current_data = fetch_current_price_data(held_crypto['product_id'])
-                if not current_data.empty:
-                    current_price = current_data['price']
-                    highest_price = max(highest_price, current_price)
-                    if check_and_execute_sell_order(held_crypto['product_id'], held_crypto['purchase_price'], highest_price, previous_price, held_crypto['time']):
-                        owned_crypto = False
-                        held_crypto = None
-                        highest_price = 0  # Reset the highest price
-                    previous_price = current_price
-
-            time.sleep(1)  # Sleep to avoid too much CPU usage and hitting rate limits, So to remind myself rate limits are easy to get around, but usage we need to figure if this was ever to get up and running, should be relatively easy to 
-            #to to bring down usuage but dont mess with this until i get the tests done...
-
-        except Exception as e:
-            logging.error(f"Error in main loop: {e}")
-
-if __name__ == "__main__":
-    main()
-
-
+import logging
+import json
+import math
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+import numpy as np
+
+import bar_aggregator
+import metrics
+import orders
+import scanner
+import signals
+from candle_store import CandleStore, align
+from candle_storage import CandleStorage, CandleWriter
+from price_index import LastPriceIndex
+from market_feed import MarketDataCache, MarketFeed, WS_URL
+from exchange_client import ExchangeClient
+from rate_limit import RateLimiter, PUBLIC
+from signing import RequestSigner
+from portfolio import Portfolio
+from trade_log import TradeLogWriter
+from scheduler import Scheduler
+from journal import Journal, BUY, SELL, reconcile_pending, restore_positions
+from product_cache import ProductCache
+from indicators import RollingIndicators
+from ticker_batch import BatchPriceFetcher
+
+
+# One token bucket per endpoint class, shared by every thread and the async scan
+RATE_LIMITER = RateLimiter()
+
+
+def rate_limiter(endpoint_class=PUBLIC):
+    # Waits only as long as the bucket for this endpoint class needs, not a fixed second
+    return RATE_LIMITER.acquire(endpoint_class)
+
+
+# Timers and counters, scraped from METRICS_PORT and summarized in the log every METRICS_SUMMARY_INTERVAL seconds
+METRICS_PORT = metrics.DEFAULT_PORT
+METRICS_SUMMARY_INTERVAL = 60
+SIGNING_SECONDS = metrics.histogram('signing_seconds', 'Building signed request headers')
+ORDER_SUBMIT_SECONDS = metrics.histogram('order_submit_seconds', 'Order POST round trip')
+ORDERS = metrics.counter('orders_total', 'Orders by side and outcome')
+PRICE_CACHE = metrics.counter('price_cache_lookups_total', 'Current prices served by the feed (hit) or REST (miss)')
+
+# Job intervals in seconds, the scan runs at the top of every hour
+POSITION_CHECK_INTERVAL = 1
+FILL_POLL_INTERVAL = 2  # only goes to the exchange while there are orders waiting for a fill
+RECENT_ORDERS_LIMIT = 100  # orders listed per fill poll, more than a scan's worth of buys
+SCAN_INTERVAL = 3600
+PRODUCT_REFRESH_INTERVAL = 300
+BAR_PUBLISH_INTERVAL = 5
+# The product list barely changes, the refresh job only goes to the API once the cache is this old
+PRODUCT_CACHE_TTL = 15 * 60
+
+# Every position we hold, ticked once a second from one batch of prices
+PORTFOLIO = Portfolio()
+MAX_POSITIONS = 20  # the hourly scan only buys while there is room
+BUY_FUNDS = 'FIAT_AMOUNT_TO_SPEND'  # Replace with the fiat amount we will want to spend on each buy
+
+# Order intents, fills and positions, so a restart picks up where the last run stopped.
+# Opened on first use (recover_state at startup), importing this module creates no files
+JOURNAL_PATH = 'bot_journal.db'
+JOURNAL = None
+
+
+def get_journal():
+    global JOURNAL
+    if JOURNAL is None:
+        JOURNAL = Journal(JOURNAL_PATH)
+    return JOURNAL
+
+
+# Every filled order, for analysis, written off the order path
+TRADE_LOG = TradeLogWriter('trade_log.csv')
+
+# Where main() sends the log, nothing is configured just by importing this module
+LOG_FILE = 'bot_log.txt'
+
+# Replace with  Coinbase Pro API creds when ready after mock test passes
+API_KEY = 'API_KEY'
+API_SECRET = 'API_SECRET'
+API_PASSPHRASE = 'API_PASSPHRASE'
+
+# Coinbase Pro API endpoints
+API_URL = 'https://api.pro.coinbase.com'
+
+# How many scan requests can be in flight at once
+SCAN_MAX_CONCURRENCY = 10
+
+CANDLE_COLUMNS = ['time', 'low', 'high', 'open', 'close', 'volume']
+
+# Every candle we fetch ends up here, partitioned by product, granularity and day
+CANDLE_DB = CandleStorage('candle_data')
+
+# Latest price per product, saved to a small snapshot so a restart still knows the last check
+LAST_PRICES = LastPriceIndex('last_prices.json')
+
+
+def record_candles(product_id, granularity, rows):
+    # Upsert into the partitioned store, duplicates of bars we already have just get replaced
+    try:
+        CANDLE_DB.upsert(product_id, granularity, rows)
+        LAST_PRICES.update_from_candles(product_id, rows, granularity)
+    except Exception as e:
+        logging.error(f"Error storing candles for {product_id}: {e}")
+
+
+# Candles already fetched, so each scan only asks the exchange for the newest buckets
+CANDLE_STORE = CandleStore(sink=record_candles)
+
+
+def write_candles(product_id, granularity, rows):
+    # Candles only: a bar built from the trade feed isn't a price check, LAST_PRICES stays as it is
+    CANDLE_DB.upsert(product_id, granularity, rows)
+
+
+# Bars from the trade feed go to disk in batches on their own thread, not the scheduler's
+CANDLE_WRITER = CandleWriter(write_candles)
+
+# Rolling return, high/low, EMA, VWAP and volatility over the last hour of 1 minute bars,
+# updated by the trade feed as each minute closes
+INDICATORS = RollingIndicators(window=60)
+
+# The scan's buy conditions, the 1h rule reads the live rolling return
+SCAN_ENGINE = signals.default_engine(indicators=INDICATORS)
+
+# Live prices from the websocket feed, REST is only used when the feed has nothing recent
+MARKET_DATA = MarketDataCache()
+MARKET_FEED = MarketFeed(MARKET_DATA, url=WS_URL)
+FEED_MAX_AGE = 5  # seconds before a feed price counts as stale
+
+# Every trade of every tradable product, built into local 1m/5m/1h candles so the scan
+# doesn't have to ask the exchange for them
+BAR_AGGREGATOR = bar_aggregator.BarAggregator()
+FINISHED_BARS = deque()
+
+
+def on_trade(product_id, trade_time, price, size, trade_id):
+    # Runs on the feed thread, the store writes happen in publish_bars
+    FINISHED_BARS.extend(BAR_AGGREGATOR.add(product_id, trade_time, price, size, trade_id))
+
+
+TRADE_DATA = MarketDataCache(indicators=INDICATORS, on_trade=on_trade)
+TRADE_FEED = MarketFeed(TRADE_DATA, url=WS_URL, channels=('matches',))
+
+
+# Built on first use, the placeholder credentials above don't decode
+SIGNER = None
+
+
+def sync_server_time():
+    # Offset to the exchange clock, signed timestamps too far off get rejected
+    try:
+        skew = SIGNER.sync_time(lambda: CLIENT.get('/time').json()['epoch'])
+        logging.info(f"Exchange clock is {skew:+.3f}s from the local clock")
+    except Exception as e:
+        logging.warning(f"Could not sync with the exchange clock, signing with the local clock: {e}")
+
+
+def get_signer():
+    global SIGNER
+    if SIGNER is None:
+        SIGNER = RequestSigner(API_KEY, API_SECRET, API_PASSPHRASE)
+        sync_server_time()
+    return SIGNER
+
+
+def create_request_headers(endpoint, method='GET', body=''):
+    """
+    Signed headers for an authenticated endpoint.
+
+    Raises ValueError if the API secret can't be used, so a request is never sent with no headers.
+    """
+    signer = get_signer()
+    with SIGNING_SECONDS.time():
+        return signer.headers(endpoint, method, body)
+
+
+# Pooled keep-alive session for every REST call, with timeouts, retries on GETs and latency tracking
+CLIENT = ExchangeClient(API_URL, headers_fn=create_request_headers, rate_limiter=RATE_LIMITER,
+                        pool_size=SCAN_MAX_CONCURRENCY * 2)
+
+
+def fetch_products(etag=None):
+    """
+    GET /products, conditional on the last ETag when we have one.
+
+    :return: (status code, ETag, product list or None)
+    """
+    response = CLIENT.get('/products', headers={'If-None-Match': etag} if etag else None)
+    products = response.json() if response.status_code == 200 else None
+    return response.status_code, response.headers.get('ETag'), products
+
+
+# Product metadata (increments, min sizes, status) by id, refreshed in the background and
+# snapshotted to disk so a restart doesn't wait on the list
+PRODUCTS = ProductCache(fetch_products, ttl=PRODUCT_CACHE_TTL, snapshot_path='products.json')
+
+
+def request_candles(product_id, start_time, end_time, granularity=300):
+    """
+    Raw candle rows from the exchange, None if the request failed (an empty list just means no trades).
+    """
+    try:
+        endpoint = f'/products/{product_id}/candles'
+        params = {
+            'start': start_time.isoformat(),
+            'end': end_time.isoformat(),
+            'granularity': granularity
+        }
+        response = CLIENT.get(endpoint, params=params)
+
+        if response.status_code == 200:
+            return response.json()
+        else:
+            logging.warning(f"Failed to fetch historical data for {product_id}: {response.status_code}")
+            return None
+    except Exception as e:
+        logging.error(f"Error fetching historical data for {product_id}: {e}")
+        return None
+
+
+def fetch_historical_data(product_id, start_time, end_time, granularity=300):
+    import pandas as pd  # only the analysis paths pay for pandas, the tick path never loads it
+
+    rows = request_candles(product_id, start_time, end_time, granularity)
+    if rows is None:
+        return pd.DataFrame()
+    record_candles(product_id, granularity, rows)
+    return pd.DataFrame(rows, columns=CANDLE_COLUMNS)
+
+
+def fetch_candle_window(product_id, start_time, end_time, granularity=300):
+    """
+    Candles for the window oldest first, only the buckets CANDLE_STORE doesn't have yet go to the exchange.
+    """
+    import pandas as pd
+
+    rows = CANDLE_STORE.get_candles(product_id, start_time, end_time, granularity, request_candles)
+    return pd.DataFrame(rows, columns=CANDLE_COLUMNS)
+
+def fetch_ticker_price(product_id):
+    try:
+        endpoint = f'/products/{product_id}/ticker'
+        response = CLIENT.get(endpoint)
+
+        if response.status_code == 200:
+            data = response.json()
+            return float(data['price'])  # Assuming the response contains a 'price' field
+        else:
+            logging.warning(f"Failed to fetch current price for {product_id}: {response.status_code}")
+            return None
+    except Exception as e:
+        logging.error(f"Error fetching current price for {product_id}: {e}")
+        return None
+
+
+def fetch_bulk_prices():
+    """
+    Last trade price of every product from one /products/stats request.
+
+    :return: dict of product_id -> price, None if the exchange doesn't have the endpoint
+    """
+    response = CLIENT.get('/products/stats')
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        raise RuntimeError(f"product stats returned {response.status_code}")
+    prices = {}
+    for product_id, stats in response.json().items():
+        last = (stats.get('stats_24hour') or {}).get('last')
+        if last:
+            prices[product_id] = float(last)
+    return prices
+
+
+# Every price the feed can't answer goes through here: one bulk request for the whole batch,
+# tickers fanned out for whatever that misses, and repeat lookups within a second coalesced
+PRICE_FETCHER = BatchPriceFetcher(fetch_bulk_prices, fetch_ticker_price, max_workers=SCAN_MAX_CONCURRENCY)
+
+
+def fetch_current_prices(product_ids):
+    """
+    Current prices for many products at once, feed caches first and one batch for the rest.
+
+    The ticker feed only covers products we hold or watch, the trade feed has every product.
+
+    :return: float array aligned with product_ids, NaN where there is no price
+    """
+    product_ids = list(product_ids)
+    prices = np.full(len(product_ids), np.nan)
+    missing = []
+    for i, product_id in enumerate(product_ids):
+        price = MARKET_DATA.last_price(product_id, max_age=FEED_MAX_AGE)
+        if price is None:
+            price = TRADE_DATA.last_price(product_id, max_age=FEED_MAX_AGE)
+        if price is None:
+            missing.append(i)
+        else:
+            prices[i] = price
+    if len(missing) < len(product_ids):
+        PRICE_CACHE.inc(len(product_ids) - len(missing), result='hit')
+    if missing:
+        PRICE_CACHE.inc(len(missing), result='miss')
+        prices[missing] = PRICE_FETCHER.fetch([product_ids[i] for i in missing])
+
+    for product_id, price in zip(product_ids, prices.tolist()):
+        if not math.isnan(price):
+            LAST_PRICES.update(product_id, price)
+    return prices
+
+
+def fetch_current_price_data(product_id):
+    price = float(fetch_current_prices([product_id])[0])
+    return None if math.isnan(price) else price
+
+def fetch_last_checked_price(product_id):
+    # Straight dict lookup in the last price index, 0 if we have never seen this product
+    return LAST_PRICES.get(product_id, 0)
+
+
+
+def get_available_products():
+    # Only goes to the API when the cached list is older than the TTL
+    PRODUCTS.refresh()
+    return PRODUCTS.tradable_ids()
+
+def check_and_execute_buy(product_id, last_checked_price, scan_result=None):
+    try:
+        now = datetime.now()
+
+        # Checking buy conditions
+        #  adjust or add more conditions here when it gets running, keep it basic for now
+        is_buy_condition_met = False
+
+        if scan_result is not None:
+            # The market scan already fetched everything for this product and evaluated the conditions
+            is_buy_condition_met = scan_result.is_buy_condition_met
+        else:
+            # Condition 1: 10% increase over the past 2 hours
+            start_time_2h = now - timedelta(hours=2)
+            historical_data_2h = fetch_candle_window(product_id, start_time_2h, now)
+            if not historical_data_2h.empty:
+                price_increase_2h = (historical_data_2h['close'].iloc[-1] - historical_data_2h['open'].iloc[0]) / \
+                                    historical_data_2h['open'].iloc[0] * 100
+                if price_increase_2h >= signals.INCREASE_2H_THRESHOLD:
+                    is_buy_condition_met = True
+
+            # Condition 2: 10% increase over the past 1 hour, sliced out of the 2 hour window
+            start_time_1h = now - timedelta(hours=1)
+            historical_data_1h = historical_data_2h[historical_data_2h['time'] >= align(start_time_1h.timestamp(), 300)]
+            if not historical_data_1h.empty:
+                price_increase_1h = (historical_data_1h['close'].iloc[-1] - historical_data_1h['open'].iloc[0]) / \
+                                    historical_data_1h['open'].iloc[0] * 100
+                if price_increase_1h >= signals.INCREASE_1H_THRESHOLD:
+                    is_buy_condition_met = True
+
+            # Condition 3: 5% increase since the last API call
+            current_price = fetch_current_price_data(product_id)
+            if current_price is not None and last_checked_price is not None:
+                price_increase_since_last_check = (current_price - last_checked_price) / last_checked_price * 100
+                if price_increase_since_last_check >= signals.INCREASE_SINCE_LAST_CHECK_THRESHOLD:
+                    is_buy_condition_met = True
+
+        # If any buy condition is met, execute buy order
+        if is_buy_condition_met:
+            # Rounded and checked against the cached product increments, before anything is journaled
+            try:
+                body = orders.market_order(product_id, BUY, PRODUCTS.get(product_id), funds=BUY_FUNDS)
+            except orders.OrderRejected as e:
+                ORDERS.inc(side=BUY, result='invalid')
+                logging.warning(f"Not buying {product_id}: {e}")
+                return False
+            # Journaled and queued, the POST and the fill happen off the scan's thread
+            ORDER_PIPELINE.submit(body)
+            return True
+
+    except Exception as e:
+        logging.error(f"An error occurred: {e}")
+
+    return False
+
+
+def record_order_intent(body):
+    # On disk before the order goes out, so a crash after this point can be reconciled
+    get_journal().record_intent(body['client_oid'], body['product_id'], body['side'], funds=body.get('funds'),
+                          size=body.get('size'))
+
+
+def send_order(body):
+    """
+    POSTs a journaled order and applies what the response says. A fill the response doesn't
+    have yet is picked up by track_fills.
+
+    :return: True if the exchange accepted the order
+    """
+    client_oid, product_id, side = body['client_oid'], body['product_id'], body['side']
+    submitted_at = time.time()
+    with ORDER_SUBMIT_SECONDS.time(side=side):
+        response = CLIENT.post('/orders', json.dumps(body))  # never retried, a retry could trade twice
+
+    if response.status_code != 200:
+        ORDERS.inc(side=side, result='rejected')
+        get_journal().record_failed(client_oid)
+        logging.warning(f"Failed to execute {side} order for {product_id}: {response.status_code}, Response: {response.text}")
+        return False
+
+    response_data = response.json()
+    get_journal().record_submitted(client_oid, response_data.get('id'))
+    if side == SELL:
+        # Out of the tick right away so the sell rules can't fire twice, the journal keeps
+        # the position until the fill is confirmed
+        PORTFOLIO.close(product_id)
+    # The exchange sends numbers as strings
+    filled_size = float(response_data.get('filled_size') or 0)
+    if not filled_size:
+        ORDERS.inc(side=side, result='accepted')
+        logging.info(f"{side.capitalize()} order for {product_id} accepted, waiting for the fill")
+        return True
+
+    executed_value = float(response_data.get('executed_value') or 0)
+    price = executed_value / filled_size
+    if side == BUY:
+        PORTFOLIO.open(product_id, price, filled_size, datetime.now())
+        get_journal().record_fill(client_oid, filled_size, executed_value, position=PORTFOLIO.get(product_id))
+    else:
+        get_journal().record_fill(client_oid, filled_size, executed_value, closed_product_id=product_id)
+    # Queued for the background writer, no file write on the order path
+    TRADE_LOG.log_trade(product_id, side, filled_size, price, fees=response_data.get('fill_fees') or 0,
+                        order_id=response_data.get('id'), client_oid=client_oid, submitted_at=submitted_at)
+    ORDERS.inc(side=side, result='filled')
+    logging.info(f"Successfully executed {side} order for {product_id}: {filled_size} units at {price} each.")
+    return True
+
+
+# Buys are journaled on the scan's thread and sent from here, so one slow POST doesn't hold up the next candidate
+ORDER_PIPELINE = orders.OrderPipeline(send_order, record_fn=record_order_intent)
+
+
+
+def execute_sell(product_id, current_price):
+    """
+    Market sells the whole position, closes it in the portfolio if the order went through.
+    """
+    position = PORTFOLIO.get(product_id)
+    if position is None:
+        logging.info(f"No {product_id} position to sell.")
+        return False
+    if product_id in pending_sells():
+        # A sell whose POST timed out may still go through, the fill tracker settles it first
+        logging.info(f"Sell of {product_id} still pending, not sending another one.")
+        return False
+    amount_to_sell = position.amount  # Amount of cryptocurrency to sell
+
+    try:
+        body = orders.market_order(product_id, SELL, PRODUCTS.get(product_id), size=amount_to_sell)
+    except orders.OrderRejected as e:
+        ORDERS.inc(side=SELL, result='invalid')
+        logging.warning(f"Can't sell {product_id} around {current_price}: {e}")
+        return False
+    try:
+        # Sent from the tick's own thread, the position has to leave the portfolio before the next tick.
+        # Through the pipeline all the same, so the fill tracker knows it's in flight
+        return ORDER_PIPELINE.send(body)
+    except Exception as e:
+        logging.error(f"Error executing sell order for {product_id}: {e}")
+        return False
+
+
+def check_and_execute_sell_order(product_id, purchase_price, highest_price, previous_price, purchase_time):
+    """
+    Sell check for a single position with explicit prices, main() ticks the whole portfolio instead.
+    """
+    current_price = fetch_current_price_data(product_id)  # Feed cache first, REST if the feed has nothing recent
+    if current_price is None or product_id not in PORTFOLIO:
+        logging.info("No data to check sell condition or no cryptocurrency currently held to sell.")
+        return False
+
+    price_drop_from_previous = (current_price - previous_price) / previous_price * 100
+    price_drop_from_highest = (current_price - highest_price) / highest_price * 100
+    price_gain_from_purchase = (current_price - purchase_price) / purchase_price * 100
+
+    # Check the selling conditions
+    if (price_drop_from_previous <= signals.DROP_FROM_PREVIOUS_THRESHOLD
+            or price_drop_from_highest <= signals.DROP_FROM_HIGHEST_THRESHOLD
+            or price_gain_from_purchase >= signals.TAKE_PROFIT_THRESHOLD):
+        # Execute sell order if conditions are met
+        return execute_sell(product_id, current_price)
+    else:
+        logging.info("Sell conditions not met.")
+        return False
+
+
+def check_portfolio():
+    """
+    One price per held product, then one tick over the whole portfolio.
+    """
+    product_ids = PORTFOLIO.product_ids()
+    if not product_ids:
+        return []
+    MARKET_FEED.subscribe(product_ids)  # no-op for products we are already subscribed to
+    # The feed answers almost all of these, REST only for products it has nothing recent for
+    prices = dict(zip(product_ids, fetch_current_prices(product_ids).tolist()))
+    sold = []
+    for sell in PORTFOLIO.tick(prices):
+        logging.info(f"Sell rule {sell.reason} fired for {sell.product_id} at {sell.price}")
+        if execute_sell(sell.product_id, sell.price):
+            sold.append(sell.product_id)
+    # Buffered, only hits the disk every few seconds
+    get_journal().update_positions(PORTFOLIO.positions())
+    return sold
+
+
+def fetch_order(client_oid):
+    response = CLIENT.get(f'/orders/client:{client_oid}')
+    if response.status_code == 404:
+        return None  # the exchange never got it
+    if response.status_code != 200:
+        raise RuntimeError(f"order lookup returned {response.status_code}")
+    return response.json()
+
+
+def fetch_recent_orders():
+    # Whatever the fill tracker could be waiting on in one request, done orders included
+    response = CLIENT.get('/orders', params={'status': 'all', 'limit': RECENT_ORDERS_LIMIT})
+    if response.status_code != 200:
+        raise RuntimeError(f"order list returned {response.status_code}")
+    return response.json()
+
+
+def fetch_fills(order_id):
+    response = CLIENT.get('/fills', params={'order_id': order_id})
+    if response.status_code != 200:
+        raise RuntimeError(f"fills lookup returned {response.status_code}")
+    return response.json()
+
+
+def log_reconciled_fill(order, remote, filled_size, executed_value, fees):
+    TRADE_LOG.log_trade(order['product_id'], order['side'], filled_size, executed_value / filled_size, fees=fees,
+                        order_id=remote.get('id'), client_oid=order['client_oid'])
+
+
+def reconcile_orders():
+    try:
+        # Orders still in the pipeline haven't reached the exchange yet, they aren't lost
+        summary = reconcile_pending(get_journal(), PORTFOLIO, fetch_order, fetch_fills, on_fill=log_reconciled_fill,
+                                    skip=ORDER_PIPELINE, fetch_recent=fetch_recent_orders)
+        if any(summary.values()):
+            logging.info(f"Reconciled orders: {summary}")
+    except Exception as e:
+        logging.error(f"Error reconciling orders: {e}")
+
+
+def recover_state():
+    """
+    Puts the snapshots and journaled positions back and settles orders whose outcome was lost in a crash.
+    """
+    started = time.perf_counter()
+    products = PRODUCTS.load()
+    prices = LAST_PRICES.load()
+    logging.info(f"Loaded {products} products and {prices} last prices from the snapshots")
+    restored = restore_positions(get_journal(), PORTFOLIO)
+    logging.info(f"Restored {restored} positions from the journal in {(time.perf_counter() - started) * 1000:.1f}ms")
+    reconcile_orders()
+
+
+def start_metrics_server():
+    try:
+        return metrics.MetricsServer(port=METRICS_PORT).start()
+    except OSError as e:
+        logging.warning(f"Metrics endpoint not available on port {METRICS_PORT}: {e}")
+        return None
+
+
+def refresh_products():
+    PRODUCTS.refresh()
+    TRADE_FEED.subscribe(PRODUCTS.tradable_ids())
+
+
+def publish_bars():
+    """
+    Moves finished bars (and a snapshot of the open ones) into CANDLE_STORE.
+    """
+    bars = BAR_AGGREGATOR.advance(time.time())
+    while FINISHED_BARS:
+        bars.append(FINISHED_BARS.popleft())
+    bar_aggregator.publish(CANDLE_STORE, BAR_AGGREGATOR, bars, sink=CANDLE_WRITER.write)
+
+
+def scan_and_buy():
+    """
+    Scans the whole market and buys the strongest candidates while there is room for more positions.
+    """
+    # Buys still waiting for their fill take up a slot too
+    pending = pending_buys()
+    if len(pending.union(PORTFOLIO.product_ids())) >= MAX_POSITIONS:
+        return
+    available_products = get_available_products()
+    last_checked_prices = {product_id: fetch_last_checked_price(product_id) for product_id in available_products}
+    # Every current price in one batch, so the scan only has candles left to fetch
+    current_prices = {product_id: price for product_id, price
+                      in zip(available_products, fetch_current_prices(available_products).tolist())
+                      if not math.isnan(price)}
+
+    # Products that went quiet still count their last pump until their indicators catch up with the clock
+    TRADE_DATA.advance_indicators()
+    # Scan every product concurrently, candidates come back strongest first
+    candidates = scanner.run_market_scan(available_products, last_checked_prices, API_URL,
+                                         headers_fn=create_request_headers,
+                                         rate_limiter=RATE_LIMITER,
+                                         candle_store=CANDLE_STORE,
+                                         price_index=LAST_PRICES,
+                                         max_concurrency=SCAN_MAX_CONCURRENCY,
+                                         current_prices=current_prices,
+                                         engine=SCAN_ENGINE)
+    LAST_PRICES.save()
+    for candidate in candidates:
+        if len(pending.union(PORTFOLIO.product_ids())) >= MAX_POSITIONS:
+            break
+        if candidate.product_id in PORTFOLIO or candidate.product_id in pending:
+            continue  # already holding it, or about to
+        if check_and_execute_buy(candidate.product_id, candidate.last_checked_price, scan_result=candidate):
+            pending.add(candidate.product_id)
+
+
+def pending_buys():
+    # Products with a buy that was decided on but hasn't filled (or failed) yet
+    return {order['product_id'] for order in get_journal().pending_orders() if order['side'] == BUY}
+
+
+def pending_sells():
+    # Products with a sell whose outcome we haven't seen, selling them again could sell twice
+    return {order['product_id'] for order in get_journal().pending_orders() if order['side'] == SELL}
+
+
+def track_fills():
+    # Orders that were accepted but not filled yet get picked up here, once they are the positions update
+    if get_journal().pending_orders():
+        reconcile_orders()
+
+
+def log_metrics_summary():
+    logging.info(f"Metrics: {metrics.REGISTRY.summary()}")
+
+
+def build_scheduler():
+    scheduler = Scheduler()
+    # Trailing highs, previous prices and sell checks for everything we hold
+    scheduler.every(POSITION_CHECK_INTERVAL, check_portfolio, name='positions')
+    # Top of every hour, on its own thread so position checks keep going during the scan
+    scheduler.every(SCAN_INTERVAL, scan_and_buy, name='scan', align=True, threaded=True)
+    scheduler.every(PRODUCT_REFRESH_INTERVAL, refresh_products, name='products', threaded=True)
+    scheduler.every(BAR_PUBLISH_INTERVAL, publish_bars, name='bars')
+    scheduler.every(FILL_POLL_INTERVAL, track_fills, name='fills', threaded=True)
+    scheduler.every(METRICS_SUMMARY_INTERVAL, log_metrics_summary, name='metrics', align=True)
+    return scheduler
+
+
+def setup_logging():
+    logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def check_buy_funds():
+    """
+    Fails at startup if BUY_FUNDS isn't an amount, instead of on every buy.
+    """
+    try:
+        funds = Decimal(str(BUY_FUNDS))
+    except InvalidOperation:
+        funds = None
+    if funds is None or not funds.is_finite() or funds <= 0:
+        raise ValueError(f"BUY_FUNDS has to be the fiat amount to spend per buy, got {BUY_FUNDS!r}")
+
+
+def start():
+    """
+    Everything before the first job runs: warm state from disk, feeds and the metrics endpoint.
+    Nothing here waits on the network unless there are orders left to reconcile.
+    """
+    check_buy_funds()
+    recover_state()
+    MARKET_FEED.start()
+    TRADE_FEED.start()
+    start_metrics_server()
+
+
+def main():
+    setup_logging()
+    start()
+    # Sleeps until the next job is due instead of waking up every second to look at the clock,
+    # the position check is due right away so it's the first thing that runs after a restart
+    build_scheduler().run_forever()
+
+
+if __name__ == "__main__":
+    main()
+
+
@@ -1,58 +1,69 @@
-import unittest
-from unittest.mock import patch, MagicMock
-
-from src.main import main
-
-class TestExitLoopException(Exception):
-    pass
-
-def exit_loop():
-    raise TestExitLoopException("Exiting loop for test")
-
-class TestMainFunction(unittest.TestCase):
-    @patch('src.main.time.sleep', side_effect=exit_loop)
-    @patch('src.main.fetch_current_price_data')
-    @patch('src.main.get_available_products')
-    @patch('src.main.fetch_last_checked_price')
-    @patch('src.main.check_and_execute_buy')
-    @patch('src.main.check_and_execute_sell_order')
-    @patch('src.main.rate_limiter')
-    def test_main(self, mock_rate_limiter, mock_sell, mock_buy, mock_last_price, mock_available_products, mock_current_price, mock_sleep):
-        # Mock the available products to control the flow in the main function, remind self to pay attention just cause it runs doesn mean it will be right...
-        mock_available_products.return_value = ['BTC-USD']#so we will use this jsut to test but remeber to maybe add a user input to test also so scraping will work when we add that..
-
-        # Mock the last checked price
-        mock_last_price.return_value = 45000.0
-
-        # Mock the buy function to simulate a buy operation
-        mock_buy.return_value = True
-
-        # Mock the sell function to simulate a sell operation
-        mock_sell.return_value = False
-
-        # Set global variables to initial state
-        global owned_crypto, held_crypto
-        owned_crypto = False
-        held_crypto = None
-
-        # Run the main function and handle the custom exception to exit the loop
-        try:
-            main()
-        except TestExitLoopException:
-            pass  # Expected exception to exit the loop
-
-        # Make sure that fetch_current_price_data was called
-        mock_current_price.assert_called()
-
-        # Make sure that the rate limiter was called,, IMPORTANT!!!!!!!!!!!!!! 
-        mock_rate_limiter.assert_called()
-
-        # Assert that check_and_execute_buy was called
-        mock_buy.assert_called_with('BTC-USD', 45000.0)
-
-        # Reset the global variables to their initial state if necessary
-        owned_crypto = False
-        held_crypto = None
-
-if __name__ == '__main__':
-    unittest.main()
+import unittest
+from datetime import datetime
+from unittest.mock import patch, ANY
+
+import numpy as np
+
+import main as bot
+from main import main
+from scanner import ScanResult
+from scheduler import Scheduler
+from test_again_api import IsolatedBotTestCase, TestExitLoopException, run_each_job_once
+
+
+class TestMainFunction(IsolatedBotTestCase):
+    @patch('main.MARKET_FEED')
+    @patch('main.TRADE_FEED')
+    @patch('main.start_metrics_server')
+    @patch('main.recover_state')
+    @patch('main.refresh_products')
+    @patch.object(Scheduler, 'run_forever', autospec=True, side_effect=run_each_job_once)
+    @patch('main.scanner.run_market_scan')
+    @patch('main.fetch_current_prices')
+    @patch('main.get_available_products')
+    @patch('main.fetch_last_checked_price')
+    @patch('main.check_and_execute_buy')
+    @patch('main.check_and_execute_sell_order')
+    @patch('main.rate_limiter')
+    def test_main(self, mock_rate_limiter, mock_sell, mock_buy, mock_last_price, mock_available_products, mock_current_price, mock_scan, mock_run_forever, mock_refresh, mock_recover, mock_metrics_server, mock_trade_feed, mock_feed):
+        # Mock the available products to control the flow in the main function, remind self to pay attention just cause it runs doesn mean it will be right...
+        mock_available_products.return_value = ['BTC-USD']#so we will use this jsut to test but remeber to maybe add a user input to test also so scraping will work when we add that..
+
+        # Mock the last checked price
+        mock_last_price.return_value = 45000.0
+
+        # Mock the market scan so BTC-USD comes back as the only buy candidate
+        candidate = ScanResult(product_id='BTC-USD', last_checked_price=45000.0, increase_1h=12.0)
+        mock_scan.return_value = [candidate]
+
+        # Mock the buy function to simulate a buy operation
+        mock_buy.return_value = True
+
+        # Mock the sell function to simulate a sell operation
+        mock_sell.return_value = False
+
+        # One position held, the portfolio replaced the owned_crypto/held_crypto globals
+        bot.PORTFOLIO.open('ETH-USD', 3000.0, 1.0, datetime.now())
+        mock_current_price.side_effect = lambda product_ids: np.full(len(product_ids), 3000.0)
+
+        # Run the main function and handle the custom exception to exit the loop
+        try:
+            main()
+        except TestExitLoopException:
+            pass  # Expected exception to exit the loop
+
+        # Make sure the held position got a price, in a batch of its own
+        mock_current_price.assert_any_call(['ETH-USD'])
+
+        # The scan goes out for every product at once, bounded by its own concurrency limit
+        mock_scan.assert_called_with(['BTC-USD'], {'BTC-USD': 45000.0}, ANY, headers_fn=ANY, rate_limiter=ANY, candle_store=ANY, price_index=ANY, max_concurrency=ANY, current_prices=ANY, engine=bot.SCAN_ENGINE)
+
+        # Assert that check_and_execute_buy was called
+        mock_buy.assert_called_with('BTC-USD', 45000.0, scan_result=candidate)
+
+        # Every job ran once, the sell check included
+        self.assertEqual(mock_run_forever.call_count, 1)
+        self.assertIn('ETH-USD', bot.PORTFOLIO)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,373 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import deque
+from datetime import datetime
+
+import websockets
+
+
+WS_URL = 'wss://ws-feed.pro.coinbase.com'
+DEFAULT_CHANNELS = ('ticker', 'matches', 'level2')
+
+# Rolling OHLCV is kept as one bar per BAR_SECONDS, BAR_COUNT of them
+BAR_SECONDS = 60
+BAR_COUNT = 60
+
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 30.0
+
+
+def parse_time(value):
+    """
+    Exchange ISO timestamp to epoch seconds, now if it is missing.
+    """
+    if not value:
+        return time.time()
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+class ProductState:
+    __slots__ = (
+        'last_price', 'last_size', 'last_trade_time', 'last_trade_id', 'sequence',
+        'best_bid', 'best_ask', 'bids', 'asks', 'bid_prices', 'ask_prices', 'book_ready', 'bars', 'updated',
+        'indicated',
+    )
+
+    def __init__(self):
+        self.last_price = None
+        self.last_size = None
+        self.last_trade_time = None
+        self.last_trade_id = None
+        self.sequence = None
+        self.best_bid = None
+        self.best_ask = None
+        self.bids = {}
+        self.asks = {}
+        # The book's price levels kept sorted, so the best ones are at the ends
+        self.bid_prices = []
+        self.ask_prices = []
+        self.book_ready = False
+        # Each bar is [bucket_start, open, high, low, close, volume]
+        self.bars = deque(maxlen=BAR_COUNT)
+        self.updated = None
+        # Start of the last minute pushed into the indicators
+        self.indicated = None
+
+
+class MarketDataCache:
+    """
+    Live per-product market data built from feed messages.
+
+    Keeps the last trade, best bid/ask from the level2 book and rolling 1 minute OHLCV
+    bars. Reads are lock-free dict lookups, writes come from the feed thread under a lock.
+    If indicators are given, every finished bar's close and volume is pushed into them, and
+    every minute without a trade as the last close with no volume, so one update is always
+    one minute of time.
+
+    :param on_trade: optional callable(product_id, trade_time, price, size, trade_id) called
+                     for every new trade, from the feed thread
+    """
+
+    def __init__(self, clock=time.monotonic, indicators=None, on_trade=None):
+        self._clock = clock
+        self.indicators = indicators
+        self.on_trade = on_trade
+        self._products = {}
+        self._lock = threading.Lock()
+        # Products whose stream had a gap and need a fresh subscription
+        self.resync_needed = set()
+
+    def _state(self, product_id):
+        state = self._products.get(product_id)
+        if state is None:
+            state = self._products[product_id] = ProductState()
+        return state
+
+    def handle_message(self, message):
+        handler = {
+            'ticker': self._on_ticker,
+            'match': self._on_match,
+            'last_match': self._on_match,
+            'snapshot': self._on_snapshot,
+            'l2update': self._on_l2update,
+        }.get(message.get('type'))
+        if handler is None or 'product_id' not in message:
+            return False
+        with self._lock:
+            state = self._state(message['product_id'])
+            handler(message['product_id'], state, message)
+            state.updated = self._clock()
+        return True
+
+    def _check_sequence(self, state, message):
+        # Sequence numbers are shared with messages we don't subscribe to, so jumps are
+        # normal; only old or repeated ones get dropped
+        sequence = message.get('sequence')
+        if sequence is None:
+            return True
+        if state.sequence is not None and sequence <= state.sequence:
+            return False
+        state.sequence = sequence
+        return True
+
+    def _on_ticker(self, product_id, state, message):
+        if not self._check_sequence(state, message):
+            return
+        state.last_price = float(message['price'])
+        if message.get('best_bid'):
+            state.best_bid = float(message['best_bid'])
+        if message.get('best_ask'):
+            state.best_ask = float(message['best_ask'])
+        state.last_trade_time = parse_time(message.get('time'))
+
+    def _on_match(self, product_id, state, message):
+        if not self._check_sequence(state, message):
+            return
+        trade_id = message.get('trade_id')
+        # Trade ids go up by one per product, so a jump means we missed trades
+        if trade_id is not None and state.last_trade_id is not None and trade_id > state.last_trade_id + 1:
+            logging.warning(f"Missed trades {state.last_trade_id + 1}-{trade_id - 1} on {product_id}, resyncing")
+            self.resync_needed.add(product_id)
+        if trade_id is not None:
+            state.last_trade_id = trade_id
+
+        price, size = float(message['price']), float(message['size'])
+        trade_time = parse_time(message.get('time'))
+        state.last_price, state.last_size, state.last_trade_time = price, size, trade_time
+        self._add_to_bar(product_id, state, trade_time, price, size)
+        if self.on_trade is not None:
+            self.on_trade(product_id, trade_time, price, size, trade_id)
+
+    def _add_to_bar(self, product_id, state, trade_time, price, size):
+        bucket = int(trade_time) - int(trade_time) % BAR_SECONDS
+        if state.bars and state.bars[-1][0] == bucket:
+            bar = state.bars[-1]
+            bar[2] = max(bar[2], price)
+            bar[3] = min(bar[3], price)
+            bar[4] = price
+            bar[5] += size
+        elif not state.bars or state.bars[-1][0] < bucket:
+            # A trade in a new bucket means the last bar is done
+            self._push_minutes(product_id, state, bucket)
+            state.bars.append([bucket, price, price, price, price, size])
+
+    def _push_minutes(self, product_id, state, until):
+        # Every finished minute before the until bucket into the indicators, the quiet ones as the last close
+        if self.indicators is None or not state.bars or until <= state.bars[-1][0]:
+            return
+        last = state.bars[-1]
+        if state.indicated is None or state.indicated < last[0]:
+            self.indicators.update(product_id, last[4], last[5])
+            state.indicated = last[0]
+        # More than a window of quiet minutes looks the same as exactly a window of them
+        quiet = min((until - state.indicated) // BAR_SECONDS - 1, self.indicators.window)
+        for _ in range(quiet):
+            self.indicators.update(product_id, last[4], 0.0)
+        state.indicated = max(state.indicated, until - BAR_SECONDS)
+
+    def advance_indicators(self, now=None):
+        """
+        Brings the indicators of products that stopped trading up to now. They only move when
+        a trade arrives, so without this a pump that went quiet keeps its rolling return.
+        Called before anything reads them.
+        """
+        now = time.time() if now is None else now
+        bucket = int(now) - int(now) % BAR_SECONDS
+        with self._lock:
+            for product_id, state in self._products.items():
+                self._push_minutes(product_id, state, bucket)
+
+    def _on_snapshot(self, product_id, state, message):
+        state.bids = {float(price): float(size) for price, size in message.get('bids', [])}
+        state.asks = {float(price): float(size) for price, size in message.get('asks', [])}
+        state.bid_prices = sorted(state.bids)
+        state.ask_prices = sorted(state.asks)
+        self._set_best(state)
+        state.book_ready = True
+        self.resync_needed.discard(product_id)
+
+    def _on_l2update(self, product_id, state, message):
+        if not state.book_ready:
+            return
+        for side, price, size in message.get('changes', []):
+            price, size = float(price), float(size)
+            book, prices = (state.bids, state.bid_prices) if side == 'buy' else (state.asks, state.ask_prices)
+            if size == 0:
+                if book.pop(price, None) is not None:
+                    del prices[bisect_left(prices, price)]
+            else:
+                if price not in book:
+                    insort(prices, price)
+                book[price] = size
+        self._set_best(state)
+
+    @staticmethod
+    def _set_best(state):
+        state.best_bid = state.bid_prices[-1] if state.bid_prices else None
+        state.best_ask = state.ask_prices[0] if state.ask_prices else None
+
+    def invalidate_books(self):
+        """
+        Called on reconnect, level2 updates are meaningless until a fresh snapshot arrives.
+        """
+        with self._lock:
+            for state in self._products.values():
+                state.book_ready = False
+                state.sequence = None
+                state.last_trade_id = None
+
+    def start_resync(self, product_ids):
+        """
+        Called when products get resubscribed. Their trade ids start over from whatever comes
+        next, or the trades missed while resubscribing would look like another gap and
+        resync them again, and their book waits for the new snapshot.
+        """
+        with self._lock:
+            for product_id in product_ids:
+                state = self._products.get(product_id)
+                if state is not None:
+                    state.book_ready = False
+                    state.last_trade_id = None
+
+    def last_price(self, product_id, max_age=None):
+        """
+        Last trade price, or None if we don't have one or it is older than max_age seconds.
+        """
+        state = self._products.get(product_id)
+        if state is None or state.last_price is None:
+            return None
+        if max_age is not None and self._clock() - state.updated > max_age:
+            return None
+        return state.last_price
+
+    def best_bid_ask(self, product_id):
+        state = self._products.get(product_id)
+        if state is None:
+            return None, None
+        return state.best_bid, state.best_ask
+
+    def ohlcv(self, product_id, seconds=BAR_SECONDS * BAR_COUNT):
+        """
+        (open, high, low, close, volume) over the last `seconds` of trades, None if no trades.
+        """
+        state = self._products.get(product_id)
+        if state is None:
+            return None
+        with self._lock:
+            if not state.bars:
+                return None
+            cutoff = state.bars[-1][0] + BAR_SECONDS - seconds
+            bars = [bar for bar in state.bars if bar[0] >= cutoff]
+        return (
+            bars[0][1],
+            max(bar[2] for bar in bars),
+            min(bar[3] for bar in bars),
+            bars[-1][4],
+            sum(bar[5] for bar in bars),
+        )
+
+
+class MarketFeed:
+    """
+    Websocket client that keeps a MarketDataCache up to date.
+
+    Reconnects with exponential backoff, resubscribes on reconnect and resubscribes a single
+    product (which brings a fresh level2 snapshot) when its trade stream has a gap.
+    """
+
+    def __init__(self, cache, product_ids=(), url=WS_URL, channels=DEFAULT_CHANNELS,
+                 reconnect_delay=RECONNECT_DELAY, max_reconnect_delay=MAX_RECONNECT_DELAY):
+        self.cache = cache
+        self.url = url
+        self.channels = list(channels)
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.product_ids = set(product_ids)
+        self.connections = 0
+        self._loop = None
+        self._thread = None
+        self._stopping = False
+        self._ws = None
+
+    def _subscription(self, kind, product_ids):
+        return json.dumps({'type': kind, 'product_ids': sorted(product_ids), 'channels': self.channels})
+
+    async def run(self):
+        delay = self.reconnect_delay
+        while not self._stopping:
+            try:
+                async with websockets.connect(self.url) as ws:
+                    self._ws = ws
+                    self.connections += 1
+                    self.cache.invalidate_books()
+                    if self.product_ids:
+                        await ws.send(self._subscription('subscribe', self.product_ids))
+                    delay = self.reconnect_delay
+                    await self._consume(ws)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logging.warning(f"Market feed disconnected: {e}")
+            finally:
+                self._ws = None
+            if self._stopping:
+                break
+            await asyncio.sleep(delay)
+            delay = min(self.max_reconnect_delay, delay * 2)
+
+    async def _consume(self, ws):
+        async for raw in ws:
+            message = json.loads(raw)
+            if message.get('type') == 'error':
+                logging.error(f"Market feed error: {message.get('message')} {message.get('reason', '')}")
+                continue
+            self.cache.handle_message(message)
+            if self.cache.resync_needed:
+                await self._resync(ws)
+
+    async def _resync(self, ws):
+        product_ids = set(self.cache.resync_needed) & self.product_ids
+        self.cache.resync_needed.clear()
+        if product_ids:
+            self.cache.start_resync(product_ids)
+            await ws.send(self._subscription('unsubscribe', product_ids))
+            await ws.send(self._subscription('subscribe', product_ids))
+
+    def subscribe(self, product_ids):
+        """
+        Adds products to the feed, safe to call from any thread.
+        """
+        new_ids = set(product_ids) - self.product_ids
+        if not new_ids:
+            return
+        self.product_ids |= new_ids
+        if self._loop is not None and self._ws is not None:
+            asyncio.run_coroutine_threadsafe(self._ws.send(self._subscription('subscribe', new_ids)), self._loop)
+
+    def start(self):
+        """
+        Runs the feed on its own event loop in a daemon thread.
+        """
+        if self._thread is not None:
+            return self._thread
+        self._loop = asyncio.new_event_loop()
+
+        def run_loop():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.run())
+
+        self._thread = threading.Thread(target=run_loop, name='market-feed', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout=5):
+        self._stopping = True
+        if self._loop is not None and self._ws is not None:
+            asyncio.run_coroutine_threadsafe(self._ws.close(), self._loop)
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
@@ -0,0 +1,297 @@
+import bisect
+import logging
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Seconds, from sub-millisecond signing up to a slow scan
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+                   5, 10, 30, 60)
+
+# Recent observations kept per label set for p50/p99
+RECENT_SAMPLES = 1000
+
+DEFAULT_PORT = 9108
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def quantile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[int(q * (len(sorted_values) - 1))]
+
+
+class Counter:
+    def __init__(self, name, help_text, lock):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = lock
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def total(self, **labels):
+        """
+        Sum over every label set that has the given labels.
+        """
+        wanted = set(labels.items())
+        with self._lock:
+            return sum(value for key, value in self._values.items() if wanted.issubset(key))
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f'{self.name}{_format_labels(key)} {value}' for key, value in items)
+        return lines
+
+
+class _Series:
+    __slots__ = ('bucket_counts', 'count', 'sum', 'recent')
+
+    def __init__(self, buckets):
+        self.bucket_counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+
+class Histogram:
+    """
+    Cumulative buckets for Prometheus plus the most recent samples for exact p50/p99.
+    """
+
+    def __init__(self, name, help_text, lock, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = lock
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series(self.buckets)
+            series.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+            series.count += 1
+            series.sum += value
+            series.recent.append(value)
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def stats(self, **labels):
+        """
+        {'count', 'sum', 'mean', 'p50', 'p99', 'max'} for one label set, None if nothing was observed.
+        count and sum cover everything, the percentiles only the recent samples.
+        """
+        with self._lock:
+            series = self._series.get(_label_key(labels))
+            if series is None:
+                return None
+            recent = sorted(series.recent)
+            count, total = series.count, series.sum
+        return {
+            'count': count,
+            'sum': total,
+            'mean': total / count,
+            'p50': quantile(recent, 0.5),
+            'p99': quantile(recent, 0.99),
+            'max': recent[-1],
+        }
+
+    def merged_stats(self):
+        """
+        Same as stats() over every label set together.
+        """
+        with self._lock:
+            recent = sorted(value for series in self._series.values() for value in series.recent)
+            count = sum(series.count for series in self._series.values())
+            total = sum(series.sum for series in self._series.values())
+        if not recent:
+            return None
+        return {'count': count, 'sum': total, 'mean': total / count, 'p50': quantile(recent, 0.5),
+                'p99': quantile(recent, 0.99), 'max': recent[-1]}
+
+    def label_sets(self):
+        with self._lock:
+            return [dict(key) for key in self._series]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((key, list(s.bucket_counts), s.count, s.sum) for key, s in self._series.items())
+        for key, bucket_counts, count, total in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + ('+Inf',), bucket_counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{_format_labels(key, [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms by name. Asking for a name twice gives back the same metric.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, threading.Lock(), **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"{name} is already registered as a {type(metric).__name__}")
+            return metric
+
+    def counter(self, name, help_text=''):
+        return self._get(Counter, name, help_text)
+
+    def histogram(self, name, help_text='', buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets=buckets)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        """
+        Everything in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        for _, metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """
+        One line with the numbers worth watching, for the log.
+        """
+        parts = []
+        for name, label in (('scan_seconds', 'scan'),
+                            ('signal_evaluation_seconds', 'signals'), ('signing_seconds', 'signing'),
+                            ('order_submit_seconds', 'orders')):
+            metric = self._metrics.get(name)
+            stats = metric.merged_stats() if metric else None
+            if stats:
+                parts.append(f"{label} n={stats['count']} p50={stats['p50'] * 1000:.2f}ms "
+                             f"p99={stats['p99'] * 1000:.2f}ms")
+        jobs = self._metrics.get('scheduler_job_seconds')
+        if jobs:
+            for labels in sorted(jobs.label_sets(), key=lambda labels: labels.get('job', '')):
+                stats = jobs.stats(**labels)
+                parts.append(f"{labels.get('job')} n={stats['count']} p99={stats['p99'] * 1000:.2f}ms")
+        rest = self._metrics.get('rest_request_seconds')
+        if rest:
+            for labels in sorted(rest.label_sets(), key=lambda labels: -rest.stats(**labels)['count'])[:3]:
+                stats = rest.stats(**labels)
+                parts.append(f"{labels.get('method')} {labels.get('endpoint')} n={stats['count']} "
+                             f"p99={stats['p99'] * 1000:.1f}ms")
+        wait = self._metrics.get('rate_limit_wait_seconds')
+        stats = wait.merged_stats() if wait else None
+        if stats:
+            parts.append(f"rate limit wait {stats['sum']:.2f}s total, p99={stats['p99'] * 1000:.1f}ms")
+        for name, label in (('price_cache_lookups_total', 'price cache'), ('candle_cache_lookups_total', 'candle cache')):
+            ratio = self.hit_ratio(name)
+            if ratio is not None:
+                parts.append(f"{label} hit {ratio * 100:.0f}%")
+        return ' | '.join(parts) or 'no metrics yet'
+
+    def hit_ratio(self, name):
+        counter = self._metrics.get(name)
+        if counter is None:
+            return None
+        hits, total = counter.total(result='hit'), counter.total()
+        return hits / total if total else None
+
+
+# Shared by every module, like the logging root logger
+REGISTRY = MetricsRegistry()
+
+
+def counter(name, help_text=''):
+    return REGISTRY.counter(name, help_text)
+
+
+def histogram(name, help_text='', buckets=DEFAULT_BUCKETS):
+    return REGISTRY.histogram(name, help_text, buckets)
+
+
+class MetricsServer:
+    """
+    Serves registry.render() on /metrics from a daemon thread.
+    """
+
+    def __init__(self, registry=REGISTRY, host='127.0.0.1', port=DEFAULT_PORT):
+        registry_ = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry_.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        logging.info(f"Serving metrics on http://{self.server.server_address[0]}:{self.port}/metrics")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,505 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal, ROUND_DOWN
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import websockets
+
+from candle_store import align
+from rate_limit import PRIVATE, endpoint_class_for, endpoint_key
+
+
+DEFAULT_PRODUCT_COUNT = 50
+DEFAULT_HISTORY = 24 * 60 * 60
+DEFAULT_VOLATILITY = 0.003  # per step, with 1 minute steps that's ~2.3% an hour
+PATH_STEP = 60
+
+GRANULARITIES = (60, 300, 900, 3600, 21600, 86400)
+MAX_CANDLES_PER_REQUEST = 300
+
+PRODUCTS_ETAG = '"mock-products-1"'
+
+# What clients of the mock sign with unless it's given another secret
+DEFAULT_API_SECRET = base64.b64encode(b'mock-exchange-secret' * 4).decode()
+
+
+def iso(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def parse_iso(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+class PricePath:
+    """
+    Geometric Brownian motion on a 1 minute grid, linear in between.
+
+    The path is generated forward from start_time as time goes on, so the same seed always
+    gives the same prices and candles for the same times.
+    """
+
+    def __init__(self, seed, start_price, start_time, volatility=DEFAULT_VOLATILITY, drift=0.0, step=PATH_STEP):
+        self.seed = seed
+        self.start_time = start_time
+        self.step = step
+        self.volatility = volatility
+        self.drift = drift
+        self._rng = np.random.default_rng(seed)
+        self._log_prices = np.array([math.log(start_price)])
+        self._lock = threading.Lock()
+
+    def _ensure(self, points):
+        with self._lock:
+            missing = points - len(self._log_prices)
+            if missing > 0:
+                steps = self._rng.normal(self.drift - self.volatility ** 2 / 2, self.volatility, max(missing, 1024))
+                self._log_prices = np.concatenate([self._log_prices, self._log_prices[-1] + np.cumsum(steps)])
+            return self._log_prices
+
+    def prices(self, times):
+        """
+        Prices at epoch times (at or after start_time).
+        """
+        offsets = (np.asarray(times, dtype=float) - self.start_time) / self.step
+        log_prices = self._ensure(int(offsets.max()) + 2)
+        return np.exp(np.interp(offsets, np.arange(len(log_prices)), log_prices))
+
+    def price_at(self, epoch):
+        return float(self.prices([epoch])[0])
+
+    def candles(self, start, end, granularity, now):
+        """
+        [time, low, high, open, close, volume] rows newest first, like the candles endpoint.
+        The bucket that is still open ends at now.
+        """
+        buckets = np.arange(align(max(start, self.start_time), granularity), min(end, now), granularity)
+        rows = []
+        for bucket in buckets[::-1]:
+            bucket_end = min(bucket + granularity, now)
+            points = np.append(np.arange(bucket, bucket_end, self.step), bucket_end)
+            prices = self.prices(points)
+            # Volume only has to look plausible and be the same on every request
+            volume = round(float(random.Random(int(bucket) * 1_000_003 + self.seed).uniform(1, 100)), 8)
+            rows.append([int(bucket), round(float(prices.min()), 8), round(float(prices.max()), 8),
+                         round(float(prices[0]), 8), round(float(prices[-1]), 8), volume])
+        return rows
+
+
+class MockExchange:
+    """
+    Local Coinbase-compatible exchange for tests and benchmarks.
+
+    REST: /time, /products, /products/stats, /products/{id}, /products/{id}/ticker, /products/{id}/candles,
+    POST /orders (market orders fill right away at the path price), /orders (newest first),
+    /orders/{id}, /orders/client:{client_oid} and /fills. WebSocket: ticker, matches and level2 snapshots
+    for whatever a connection subscribes to.
+
+    Every product follows its own PricePath. latency (+ up to jitter) is added to each REST
+    response, a fraction error_rate of requests gets a 429, and rate_limit caps requests per
+    second the way the real exchange does. bulk_stats=False answers /products/stats with a 404,
+    like an exchange that doesn't have it.
+
+    Private endpoints (orders, fills) check CB-ACCESS-SIGN against api_secret the way the
+    exchange does, over timestamp + method + path with the query string + body, and answer
+    a 401 if it doesn't match.
+    """
+
+    def __init__(self, product_count=DEFAULT_PRODUCT_COUNT, seed=0, volatility=DEFAULT_VOLATILITY, drift=0.0,
+                 history=DEFAULT_HISTORY, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=None,
+                 fee_rate=0.005, tick_interval=0.1, bulk_stats=True, host='127.0.0.1', port=0, ws_port=0,
+                 api_secret=DEFAULT_API_SECRET, clock=time.time):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.fee_rate = fee_rate
+        self.tick_interval = tick_interval
+        self.bulk_stats = bulk_stats
+        self.host = host
+        self.api_secret = api_secret
+        self._key = base64.b64decode(api_secret)
+        self._clock = clock
+        self.rate_limit = rate_limit
+        self._random = random.Random(seed)
+        self._window = None
+        self._window_requests = 0
+        self._lock = threading.Lock()
+
+        start_time = align(clock() - history, PATH_STEP)
+        rng = random.Random(seed)
+        self.products = {}
+        self.paths = {}
+        for i in range(product_count):
+            product_id = f'C{i:03d}-USD'
+            self.products[product_id] = {
+                'id': product_id, 'base_currency': f'C{i:03d}', 'quote_currency': 'USD',
+                'base_increment': '0.00000001', 'quote_increment': '0.01', 'base_min_size': '0.00001',
+                'base_max_size': '1000000', 'min_market_funds': '1', 'max_market_funds': '1000000',
+                'status': 'online', 'trading_disabled': False, 'cancel_only': False, 'limit_only': False,
+                'post_only': False,
+            }
+            self.paths[product_id] = PricePath(seed * 100_003 + i, rng.uniform(0.5, 50_000), start_time,
+                                               volatility, drift)
+        self.trade_ids = {product_id: 0 for product_id in self.products}
+        self.sequences = {product_id: 0 for product_id in self.products}
+        self.orders = {}
+        self.orders_by_client_oid = {}
+        self.fills = {}
+        self.requests = {}
+
+        self._http = ThreadingHTTPServer((host, port), self._handler_class())
+        self._http.daemon_threads = True
+        self._http_thread = threading.Thread(target=self._http.serve_forever, name='mock-exchange', daemon=True)
+        self._ws_port = ws_port
+        self._ws_server = None
+        self._ws_loop = None
+        self._ws_thread = None
+        self._ws_ready = threading.Event()
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self._http.server_address[1]}'
+
+    @property
+    def ws_url(self):
+        return f'ws://{self.host}:{self._ws_port}'
+
+    def start(self, websocket=True):
+        self._http_thread.start()
+        if websocket:
+            self._ws_thread = threading.Thread(target=self._run_ws, name='mock-exchange-ws', daemon=True)
+            self._ws_thread.start()
+            self._ws_ready.wait(5)
+        return self
+
+    def stop(self):
+        self._http.shutdown()
+        self._http.server_close()
+        if self._ws_loop is not None:
+            self._ws_loop.call_soon_threadsafe(self._ws_server.close)
+            self._ws_thread.join(5)
+
+    def count(self, endpoint, status):
+        with self._lock:
+            self.requests[(endpoint, status)] = self.requests.get((endpoint, status), 0) + 1
+
+    def allow(self):
+        """
+        False once more than rate_limit requests came in during the current second.
+        """
+        if not self.rate_limit:
+            return True
+        with self._lock:
+            window = int(self._clock())
+            if window != self._window:
+                self._window, self._window_requests = window, 0
+            self._window_requests += 1
+            return self._window_requests <= self.rate_limit
+
+    def authenticated(self, method, path, body, headers):
+        """
+        True if headers carry a valid signature for the request.
+
+        :param path: request path with the query string, as it was sent
+        """
+        timestamp, signature = headers.get('CB-ACCESS-TIMESTAMP'), headers.get('CB-ACCESS-SIGN')
+        if not timestamp or not signature:
+            return False
+        message = f'{timestamp}{method}{path}'.encode() + (body or b'')
+        expected = hmac.new(self._key, message, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, signature)
+
+    def next_trade(self, product_id):
+        with self._lock:
+            self.trade_ids[product_id] += 1
+            self.sequences[product_id] += 1
+            return self.trade_ids[product_id], self.sequences[product_id]
+
+    # REST
+
+    def _handler_class(self):
+        exchange = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out in separate writes, Nagle would hold the body for a delayed ACK
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, payload=None, headers=None):
+                exchange.count(endpoint_key(urlsplit(self.path).path), status)
+                body = b'' if payload is None else json.dumps(payload).encode()
+                delay = exchange.latency + (exchange._random.uniform(0, exchange.jitter) if exchange.jitter else 0)
+                if delay:
+                    time.sleep(delay)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def throttled(self):
+                injected = exchange.error_rate and exchange._random.random() < exchange.error_rate
+                if injected or not exchange.allow():
+                    self.reply(429, {'message': 'Rate limit exceeded'}, {'Retry-After': '1'})
+                    return True
+                return False
+
+            def do_GET(self):
+                if self.throttled():
+                    return
+                url = urlsplit(self.path)
+                if endpoint_class_for(url.path) == PRIVATE and not exchange.authenticated('GET', self.path, b'', self.headers):
+                    return self.reply(401, {'message': 'invalid signature'})
+                query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+                status, payload, headers = exchange.get(url.path, query, self.headers)
+                self.reply(status, payload, headers)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length)
+                if self.throttled():
+                    return
+                url = urlsplit(self.path)
+                if url.path != '/orders':
+                    return self.reply(404, {'message': 'NotFound'})
+                if not exchange.authenticated('POST', self.path, body, self.headers):
+                    return self.reply(401, {'message': 'invalid signature'})
+                try:
+                    order = json.loads(body or b'{}')
+                except ValueError:
+                    return self.reply(400, {'message': 'invalid json'})
+                status, payload = exchange.place_order(order)
+                self.reply(status, payload)
+
+        return Handler
+
+    def get(self, path, query, headers):
+        """
+        :return: (status, payload, extra headers)
+        """
+        now = self._clock()
+        parts = path.strip('/').split('/')
+        if path == '/time':
+            return 200, {'iso': iso(now), 'epoch': now}, None
+        if path == '/products':
+            if headers.get('If-None-Match') == PRODUCTS_ETAG:
+                return 304, None, {'ETag': PRODUCTS_ETAG}
+            return 200, list(self.products.values()), {'ETag': PRODUCTS_ETAG}
+        if path == '/products/stats' and self.bulk_stats:
+            return 200, {product_id: self.stats(product_id, now) for product_id in self.products}, None
+        if parts[0] == 'products' and len(parts) >= 2:
+            product_id = parts[1]
+            if product_id not in self.products:
+                return 404, {'message': 'NotFound'}, None
+            if len(parts) == 2:
+                return 200, self.products[product_id], None
+            if parts[2] == 'ticker':
+                return 200, self.ticker(product_id, now), None
+            if parts[2] == 'candles':
+                return self.candles(product_id, query, now) + (None,)
+        if path == '/fills':
+            if 'order_id' not in query:
+                return 400, {'message': 'order_id or product_id is required'}, None
+            return 200, self.fills.get(query['order_id'], []), None
+        if path == '/orders':
+            status = query.get('status', 'all')
+            with self._lock:
+                listed = [order for order in reversed(list(self.orders.values()))
+                          if status == 'all' or order['status'] == status]
+            return 200, listed[:int(query.get('limit', 100))], None
+        if parts[0] == 'orders' and len(parts) == 2:
+            if parts[1].startswith('client:'):
+                order_id = self.orders_by_client_oid.get(parts[1][len('client:'):])
+            else:
+                order_id = parts[1]
+            order = self.orders.get(order_id)
+            return (200, order, None) if order else (404, {'message': 'NotFound'}, None)
+        return 404, {'message': 'NotFound'}, None
+
+    def ticker(self, product_id, now):
+        price = self.paths[product_id].price_at(now)
+        trade_id, _ = self.next_trade(product_id)
+        return {'trade_id': trade_id, 'price': f'{price:.8f}', 'size': '0.01', 'bid': f'{price * 0.9995:.8f}',
+                'ask': f'{price * 1.0005:.8f}', 'volume': '1000', 'time': iso(now)}
+
+    def stats(self, product_id, now):
+        # Same shape as the exchange: 24 hour stats with the last trade price, and the 30 day volume
+        path = self.paths[product_id]
+        prices = path.prices(np.linspace(now - 86400, now, 97))
+        return {'stats_24hour': {'open': f'{prices[0]:.8f}', 'high': f'{prices.max():.8f}', 'low': f'{prices.min():.8f}',
+                                 'last': f'{prices[-1]:.8f}', 'volume': '24000'},
+                'stats_30day': {'volume': '720000'}}
+
+    def candles(self, product_id, query, now):
+        try:
+            granularity = int(query.get('granularity', 60))
+            end = parse_iso(query['end']) if 'end' in query else now
+            start = parse_iso(query['start']) if 'start' in query else end - granularity * MAX_CANDLES_PER_REQUEST
+        except ValueError:
+            return 400, {'message': 'invalid start, end or granularity'}
+        if granularity not in GRANULARITIES:
+            return 400, {'message': 'Unsupported granularity'}
+        if (end - start) / granularity > MAX_CANDLES_PER_REQUEST:
+            return 400, {'message': 'granularity too small for the requested time range'}
+        return 200, self.paths[product_id].candles(start, end, granularity, now)
+
+    def place_order(self, order):
+        """
+        Market orders only, filled in full at the current path price.
+        """
+        product_id = order.get('product_id')
+        product = self.products.get(product_id)
+        if product is None:
+            return 400, {'message': 'Invalid product_id'}
+        side = order.get('side')
+        if side not in ('buy', 'sell'):
+            return 400, {'message': 'side is required and must be buy or sell'}
+        if order.get('type', 'limit') != 'market':
+            return 400, {'message': 'only market orders are supported'}
+        client_oid = order.get('client_oid')
+        if client_oid and client_oid in self.orders_by_client_oid:
+            return 400, {'message': 'duplicate client_oid'}
+
+        now = self._clock()
+        price = Decimal(str(self.paths[product_id].price_at(now)))
+        increment = Decimal(product['base_increment'])
+        try:
+            if side == 'buy' and order.get('funds') is not None:
+                funds = Decimal(str(order['funds']))
+                size = (funds / (1 + Decimal(str(self.fee_rate))) / price / increment).to_integral_value(ROUND_DOWN) * increment
+            else:
+                size = Decimal(str(order['size']))
+        except Exception:
+            return 400, {'message': 'funds or size is invalid'}
+        if size < Decimal(product['base_min_size']):
+            return 400, {'message': 'size is too small'}
+
+        executed_value = (size * price).quantize(Decimal('0.00000001'))
+        fees = (executed_value * Decimal(str(self.fee_rate))).quantize(Decimal('0.00000001'))
+        order_id = str(uuid.uuid4())
+        record = {
+            'id': order_id, 'client_oid': client_oid or '', 'product_id': product_id, 'side': side, 'type': 'market',
+            'size': str(size), 'filled_size': str(size), 'executed_value': str(executed_value),
+            'fill_fees': str(fees), 'status': 'done', 'done_reason': 'filled', 'settled': True,
+            'created_at': iso(now), 'done_at': iso(now),
+        }
+        trade_id, _ = self.next_trade(product_id)
+        with self._lock:
+            self.orders[order_id] = record
+            if client_oid:
+                self.orders_by_client_oid[client_oid] = order_id
+            self.fills[order_id] = [{'trade_id': trade_id, 'product_id': product_id, 'order_id': order_id,
+                                     'price': str(price), 'size': str(size), 'fee': str(fees), 'side': side,
+                                     'created_at': iso(now), 'liquidity': 'T', 'settled': True}]
+        return 200, record
+
+    # WebSocket
+
+    def _run_ws(self):
+        self._ws_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._ws_loop)
+
+        async def serve():
+            self._ws_server = await websockets.serve(self._ws_handler, self.host, self._ws_port)
+            self._ws_port = self._ws_server.sockets[0].getsockname()[1]
+            self._ws_ready.set()
+            await self._ws_server.wait_closed()
+
+        self._ws_loop.run_until_complete(serve())
+
+    async def _ws_handler(self, ws):
+        subscribed = set()
+        channels = set()
+        sender = asyncio.ensure_future(self._ws_send(ws, subscribed, channels))
+        try:
+            async for raw in ws:
+                message = json.loads(raw)
+                product_ids = set(message.get('product_ids', ())) & set(self.products)
+                names = {channel if isinstance(channel, str) else channel['name'] for channel in message.get('channels', ())}
+                if message.get('type') == 'subscribe':
+                    subscribed |= product_ids
+                    channels |= names
+                    if 'level2' in names:
+                        for product_id in sorted(product_ids):
+                            await ws.send(json.dumps(self._snapshot(product_id)))
+                elif message.get('type') == 'unsubscribe':
+                    subscribed -= product_ids
+                await ws.send(json.dumps({'type': 'subscriptions', 'channels': [
+                    {'name': name, 'product_ids': sorted(subscribed)} for name in sorted(channels)]}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            sender.cancel()
+
+    def _snapshot(self, product_id):
+        price = self.paths[product_id].price_at(self._clock())
+        return {'type': 'snapshot', 'product_id': product_id,
+                'bids': [[f'{price * (1 - 0.0005 * i):.8f}', '1.0'] for i in range(1, 6)],
+                'asks': [[f'{price * (1 + 0.0005 * i):.8f}', '1.0'] for i in range(1, 6)]}
+
+    async def _ws_send(self, ws, subscribed, channels):
+        while True:
+            await asyncio.sleep(self.tick_interval)
+            now = self._clock()
+            for product_id in sorted(subscribed):
+                price = self.paths[product_id].price_at(now)
+                size = f'{self._random.uniform(0.001, 1):.8f}'
+                trade_id, sequence = self.next_trade(product_id)
+                if 'matches' in channels:
+                    await ws.send(json.dumps({'type': 'match', 'product_id': product_id, 'trade_id': trade_id,
+                                              'sequence': sequence, 'price': f'{price:.8f}', 'size': size,
+                                              'side': 'buy', 'time': iso(now)}))
+                if 'ticker' in channels:
+                    await ws.send(json.dumps({'type': 'ticker', 'product_id': product_id, 'trade_id': trade_id,
+                                              'sequence': sequence, 'price': f'{price:.8f}', 'last_size': size,
+                                              'best_bid': f'{price * 0.9995:.8f}',
+                                              'best_ask': f'{price * 1.0005:.8f}', 'time': iso(now)}))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a local mock exchange')
+    parser.add_argument('--products', type=int, default=DEFAULT_PRODUCT_COUNT)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--ws-port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every REST response')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with a 429')
+    parser.add_argument('--rate-limit', type=float, help='requests per second before 429s')
+    parser.add_argument('--volatility', type=float, default=DEFAULT_VOLATILITY)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-bulk-stats', action='store_true', help='answer /products/stats with a 404')
+    args = parser.parse_args(argv)
+
+    exchange = MockExchange(args.products, seed=args.seed, volatility=args.volatility, latency=args.latency,
+                            jitter=args.jitter, error_rate=args.error_rate, rate_limit=args.rate_limit,
+                            bulk_stats=not args.no_bulk_stats, port=args.port, ws_port=args.ws_port).start()
+    print(f"Mock exchange on {exchange.url} and {exchange.ws_url} with {len(exchange.products)} products")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        exchange.stop()
+
+
+if __name__ == '__main__':
+    main()
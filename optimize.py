@@ -0,0 +1,195 @@
+import argparse
+import hashlib
+import itertools
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, fields
+
+import numpy as np
+
+from backtest import ProductSeries, StrategyParams, load_csv, load_storage, parse_date, run_backtest
+from candle_storage import CandleStorage, DEFAULT_ROOT
+
+
+DEFAULT_CACHE_DIR = 'sweep_cache'
+
+# Columns of the ranked table, in order
+TABLE_METRICS = ('return_pct', 'max_drawdown', 'trades', 'win_rate')
+
+# Candle arrays the worker processes share, set up once per worker by _init_worker
+_SERIES = None
+
+
+def data_fingerprint(series):
+    """
+    Hash of the candle data, results are only reused for exactly the same data.
+    """
+    digest = hashlib.sha1()
+    for product_id in sorted(series):
+        s = series[product_id]
+        digest.update(product_id.encode())
+        for array in (s.times, s.opens, s.closes):
+            digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def pack_series(series, directory):
+    """
+    Writes all products into three flat .npy files plus an index, so workers can memory-map
+    one shared copy instead of each loading their own.
+    """
+    os.makedirs(directory, exist_ok=True)
+    product_ids = sorted(series)
+    offsets = np.cumsum([0] + [len(series[p].times) for p in product_ids]).tolist()
+    for name in ('times', 'opens', 'closes'):
+        arrays = [getattr(series[p], name) for p in product_ids]
+        packed = np.concatenate(arrays) if arrays else np.empty(0)
+        np.save(os.path.join(directory, name + '.npy'), packed)
+    with open(os.path.join(directory, 'index.json'), 'w') as f:
+        json.dump({'product_ids': product_ids, 'offsets': offsets}, f)
+
+
+def load_packed(directory):
+    with open(os.path.join(directory, 'index.json')) as f:
+        index = json.load(f)
+    arrays = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+              for name in ('times', 'opens', 'closes')}
+    series = {}
+    offsets = index['offsets']
+    for i, product_id in enumerate(index['product_ids']):
+        lo, hi = offsets[i], offsets[i + 1]
+        series[product_id] = ProductSeries.from_arrays(
+            product_id, arrays['times'][lo:hi], arrays['opens'][lo:hi], arrays['closes'][lo:hi])
+    return series
+
+
+def _init_worker(directory):
+    global _SERIES
+    _SERIES = load_packed(directory)
+
+
+def _run_one(params, granularity, initial_cash):
+    result = run_backtest(_SERIES, granularity, params, initial_cash)
+    return {
+        'return_pct': result.return_pct,
+        'pnl': result.pnl,
+        'max_drawdown': result.max_drawdown,
+        'trades': len(result.trades),
+        'win_rate': result.win_rate,
+    }
+
+
+def param_grid(**values):
+    """
+    Every combination of the given StrategyParams field values, e.g. param_grid(increase_2h=[5, 10]).
+    """
+    names = list(values)
+    return [StrategyParams(**dict(zip(names, combo))) for combo in itertools.product(*(values[n] for n in names))]
+
+
+def params_key(params, granularity, initial_cash):
+    # 10 and 10.0 are the same threshold
+    values = {name: float(value) for name, value in asdict(params).items()}
+    payload = json.dumps({'params': values, 'granularity': granularity, 'cash': float(initial_cash)}, sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Append-only JSON lines file of finished runs for one data fingerprint.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.results = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.results[entry['key']] = entry['metrics']
+
+    def add(self, key, params, metrics):
+        self.results[key] = metrics
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'key': key, 'params': asdict(params), 'metrics': metrics}) + '\n')
+
+
+def sweep(series, granularity, grid, initial_cash=1000.0, workers=None, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Backtests every parameter set across a process pool, skipping ones already in the cache.
+
+    :return: list of row dicts (params + metrics + cached flag), best return first
+    """
+    fingerprint = data_fingerprint(series)
+    data_dir = os.path.join(cache_dir, f'data-{fingerprint}')
+    if not os.path.exists(os.path.join(data_dir, 'index.json')):
+        pack_series(series, data_dir)
+    cache = ResultCache(os.path.join(cache_dir, f'results-{fingerprint}.jsonl'))
+
+    keys = [params_key(params, granularity, initial_cash) for params in grid]
+    todo = [(key, params) for key, params in zip(keys, grid) if key not in cache.results]
+    logging.info(f"Sweep of {len(grid)} parameter sets, {len(grid) - len(todo)} cached, {len(todo)} to run")
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker,
+                                 initargs=(data_dir,)) as pool:
+            futures = [(key, params, pool.submit(_run_one, params, granularity, initial_cash)) for key, params in todo]
+            for key, params, future in futures:
+                cache.add(key, params, future.result())
+
+    fresh = {key for key, _ in todo}
+    rows = [dict(asdict(params), **cache.results[key], cached=key not in fresh) for key, params in zip(keys, grid)]
+    rows.sort(key=lambda row: row['return_pct'], reverse=True)
+    return rows
+
+
+def format_table(rows, columns, limit=None):
+    def fmt(value):
+        return f"{value:.2f}" if isinstance(value, float) else str(value)
+
+    cells = [[fmt(row[column]) for column in columns] for row in rows[:limit]]
+    widths = [max([len(column)] + [len(line[i]) for line in cells]) for i, column in enumerate(columns)]
+    lines = ['  '.join(column.rjust(width) for column, width in zip(columns, widths))]
+    lines.extend('  '.join(cell.rjust(width) for cell, width in zip(line, widths)) for line in cells)
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sweep buy/sell thresholds over stored candles')
+    parser.add_argument('--root', default=DEFAULT_ROOT)
+    parser.add_argument('--csv')
+    parser.add_argument('--products', nargs='*')
+    parser.add_argument('--product-id')
+    parser.add_argument('--granularity', type=int, default=300)
+    parser.add_argument('--start')
+    parser.add_argument('--end')
+    parser.add_argument('--cash', type=float, default=1000.0)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--top', type=int, default=20)
+    # One option per threshold, e.g. --increase-2h 5 10 15
+    for f in fields(StrategyParams):
+        parser.add_argument('--' + f.name.replace('_', '-'), dest=f.name, nargs='+',
+                            type=int if f.name == 'scan_interval' else float, default=[f.default])
+    args = parser.parse_args(argv)
+
+    start = parse_date(args.start) if args.start else 0
+    end = parse_date(args.end) if args.end else 2 ** 40
+    if args.csv:
+        series = load_csv(args.csv, args.product_id)
+    else:
+        storage = CandleStorage(args.root)
+        series = load_storage(storage, args.products or storage.product_ids(), args.granularity, start, end)
+
+    grid = param_grid(**{f.name: getattr(args, f.name) for f in fields(StrategyParams)})
+    rows = sweep(series, args.granularity, grid, args.cash, args.workers, args.cache_dir)
+    varied = [f.name for f in fields(StrategyParams) if len(getattr(args, f.name)) > 1]
+    print(format_table(rows, varied + list(TABLE_METRICS), args.top))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
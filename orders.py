@@ -0,0 +1,174 @@
+import logging
+import queue
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+
+import metrics
+from journal import new_client_oid
+
+
+DEFAULT_WORKERS = 4  # a scan's worth of buys clears in a few round trips, the rate limiter caps the rest
+
+ORDER_QUEUE_SECONDS = metrics.histogram('order_queue_seconds', 'Order decision to POST, time waiting in the pipeline')
+
+
+class OrderRejected(ValueError):
+    """
+    An order that failed the pre-trade checks, it never goes out.
+    """
+
+
+def _decimal(value, name):
+    if value is None:
+        return None
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise OrderRejected(f"{name} {value!r} is not a number") from None
+
+
+def market_order(product_id, side, product=None, funds=None, size=None, client_oid=None):
+    """
+    Body of a market order, rounded down to the product's increments and checked against its limits.
+
+    Everything comes from the cached product metadata, nothing here waits on the exchange.
+    Without product info the order goes out as given and the exchange does the checking.
+
+    :param product: ProductInfo from the ProductCache, or None
+    :param funds: quote currency to spend, for buys
+    :param size: base currency amount, for sells
+    :raises OrderRejected: if the product can't be traded or the order is outside its limits
+    """
+    funds, size = _decimal(funds, 'funds'), _decimal(size, 'size')
+    if (funds is None) == (size is None):
+        raise OrderRejected("a market order takes either funds or size")
+    if product is not None:
+        if not product.tradable:
+            raise OrderRejected(f"{product_id} is not tradable right now")
+        if funds is not None:
+            funds = product.round_funds(funds)
+            if product.min_market_funds and funds < product.min_market_funds:
+                raise OrderRejected(f"funds {funds} under the {product.min_market_funds} minimum for {product_id}")
+            if product.max_market_funds and funds > product.max_market_funds:
+                raise OrderRejected(f"funds {funds} over the {product.max_market_funds} maximum for {product_id}")
+        else:
+            size = product.round_size(size)
+            if product.base_min_size and size < product.base_min_size:
+                raise OrderRejected(f"size {size} under the {product.base_min_size} minimum for {product_id}")
+            if product.base_max_size and size > product.base_max_size:
+                raise OrderRejected(f"size {size} over the {product.base_max_size} maximum for {product_id}")
+    if (funds if funds is not None else size) <= 0:
+        raise OrderRejected(f"nothing to {side} for {product_id}")
+
+    body = {'type': 'market', 'side': side, 'product_id': product_id, 'client_oid': client_oid or new_client_oid()}
+    if funds is not None:
+        body['funds'] = str(funds)
+    else:
+        body['size'] = str(size)
+    return body
+
+
+class OrderPipeline:
+    """
+    Sends orders from a queue on worker threads, so whatever decided to trade doesn't wait on the POST.
+
+    submit() records the order with record_fn (the journal intent) on the caller's thread and
+    queues it. A worker then calls send_fn(body), which does the POST and applies whatever the
+    response says. Fills that aren't in the response are left to the fill tracker, which has
+    to skip the client_oids still in the pipeline (`client_oid in pipeline`): an order that
+    hasn't been sent yet looks the same as one that never reached the exchange.
+    """
+
+    def __init__(self, send_fn, record_fn=None, workers=DEFAULT_WORKERS, clock=time.perf_counter):
+        self.send_fn = send_fn
+        self.record_fn = record_fn
+        self.workers = workers
+        self._clock = clock
+        self._queue = queue.Queue()
+        self._in_flight = set()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def __contains__(self, client_oid):
+        with self._lock:
+            return client_oid in self._in_flight
+
+    def __len__(self):
+        with self._lock:
+            return len(self._in_flight)
+
+    def submit(self, body):
+        """
+        Queues an order, returns as soon as record_fn has it on disk.
+        """
+        client_oid = body['client_oid']
+        # In flight before the intent exists, so the fill tracker can't catch it in between
+        with self._lock:
+            self._in_flight.add(client_oid)
+            if not self._threads:
+                self._start()
+        try:
+            if self.record_fn:
+                self.record_fn(body)
+        except Exception:
+            with self._lock:
+                self._in_flight.discard(client_oid)
+            raise
+        self._queue.put((body, self._clock()))
+
+    def send(self, body):
+        """
+        Records and sends an order on the caller's thread, for orders that can't wait behind
+        the queue (sells). It counts as in flight until send_fn returns, same as a queued one.
+
+        :return: whatever send_fn returns
+        """
+        client_oid = body['client_oid']
+        with self._lock:
+            self._in_flight.add(client_oid)
+        try:
+            if self.record_fn:
+                self.record_fn(body)
+            return self.send_fn(body)
+        finally:
+            with self._lock:
+                self._in_flight.discard(client_oid)
+
+    def _start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'orders-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                body, queued_at = item
+                ORDER_QUEUE_SECONDS.observe(self._clock() - queued_at, side=body['side'])
+                try:
+                    self.send_fn(body)
+                except Exception as e:
+                    logging.error(f"Error sending {body['side']} order {body['client_oid']} for {body['product_id']}: {e}")
+                finally:
+                    with self._lock:
+                        self._in_flight.discard(body['client_oid'])
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        """
+        Waits until every queued order has been sent.
+        """
+        self._queue.join()
+
+    def close(self, timeout=5):
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join(timeout)
@@ -0,0 +1,216 @@
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+
+from signals import (
+    DROP_FROM_PREVIOUS_THRESHOLD,
+    DROP_FROM_HIGHEST_THRESHOLD,
+    TAKE_PROFIT_THRESHOLD,
+    percent_change,
+)
+
+# Slots the arrays start with, they double whenever they fill up
+INITIAL_CAPACITY = 16
+
+DROP_FROM_PREVIOUS = 'drop_from_previous'
+DROP_FROM_HIGHEST = 'drop_from_highest'
+TAKE_PROFIT = 'take_profit'
+
+
+@dataclass
+class Position:
+    """
+    Copy of one held position, changing it does not change the portfolio.
+    """
+    product_id: str
+    purchase_price: float
+    amount: float
+    purchase_time: object
+    highest_price: float
+    previous_price: float
+    last_price: float
+
+    @property
+    def pnl(self):
+        return self.amount * (self.last_price - self.purchase_price)
+
+
+@dataclass
+class SellSignal:
+    product_id: str
+    price: float
+    reason: str
+
+
+class Portfolio:
+    """
+    Every open position in a handful of parallel arrays, one slot per product.
+
+    tick() takes one price per held product and updates trailing highs, previous prices and
+    PnL for all of them at once, returning the positions whose sell rules fired. Positions
+    are closed by the caller once the sell order went through.
+
+    All methods take the same lock and only hold it for the array work, so the portfolio
+    can be shared between threads and called from an event loop.
+    """
+
+    def __init__(self, capacity=INITIAL_CAPACITY, drop_from_previous=DROP_FROM_PREVIOUS_THRESHOLD,
+                 drop_from_highest=DROP_FROM_HIGHEST_THRESHOLD, take_profit=TAKE_PROFIT_THRESHOLD):
+        self.drop_from_previous = drop_from_previous
+        self.drop_from_highest = drop_from_highest
+        self.take_profit = take_profit
+        self._product_ids = []
+        self._slots = {}
+        self._times = []
+        self._purchase = np.empty(capacity)
+        self._amount = np.empty(capacity)
+        self._highest = np.empty(capacity)
+        self._previous = np.empty(capacity)
+        self._last = np.empty(capacity)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._product_ids)
+
+    def __contains__(self, product_id):
+        return product_id in self._slots
+
+    def product_ids(self):
+        """
+        Held products in slot order, the order tick() expects an array of prices in.
+        """
+        with self._lock:
+            return list(self._product_ids)
+
+    def _grow(self):
+        for name in ('_purchase', '_amount', '_highest', '_previous', '_last'):
+            old = getattr(self, name)
+            new = np.empty(max(1, len(old) * 2))
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def open(self, product_id, purchase_price, amount, purchase_time=None):
+        """
+        Starts tracking a position, buying more of a held product averages it in.
+        """
+        purchase_price, amount = float(purchase_price), float(amount)
+        with self._lock:
+            i = self._slots.get(product_id)
+            if i is not None:
+                total = self._amount[i] + amount
+                self._purchase[i] = (self._purchase[i] * self._amount[i] + purchase_price * amount) / total
+                self._amount[i] = total
+                return
+            i = len(self._product_ids)
+            if i == len(self._purchase):
+                self._grow()
+            self._product_ids.append(product_id)
+            self._times.append(purchase_time)
+            self._slots[product_id] = i
+            # The first tick compares against the purchase price, not against nothing
+            self._purchase[i] = self._highest[i] = self._previous[i] = self._last[i] = purchase_price
+            self._amount[i] = amount
+
+    def restore(self, product_id, purchase_price, amount, purchase_time=None, highest_price=None,
+                previous_price=None):
+        """
+        Puts back a position saved before a restart, trailing prices included.
+        """
+        with self._lock:
+            self.close(product_id)
+            self.open(product_id, purchase_price, amount, purchase_time)
+            i = self._slots[product_id]
+            if highest_price is not None:
+                self._highest[i] = highest_price
+            if previous_price is not None:
+                self._previous[i] = self._last[i] = previous_price
+
+    def close(self, product_id):
+        """
+        Stops tracking a position, returns what it looked like or None if it wasn't held.
+        """
+        with self._lock:
+            i = self._slots.pop(product_id, None)
+            if i is None:
+                return None
+            position = self._position(i)
+            # The last slot moves into the hole so the arrays stay packed
+            last = len(self._product_ids) - 1
+            if i != last:
+                moved = self._product_ids[last]
+                self._product_ids[i] = moved
+                self._times[i] = self._times[last]
+                self._slots[moved] = i
+                for array in (self._purchase, self._amount, self._highest, self._previous, self._last):
+                    array[i] = array[last]
+            self._product_ids.pop()
+            self._times.pop()
+            return position
+
+    def _position(self, i):
+        return Position(self._product_ids[i], float(self._purchase[i]), float(self._amount[i]), self._times[i],
+                        float(self._highest[i]), float(self._previous[i]), float(self._last[i]))
+
+    def get(self, product_id):
+        with self._lock:
+            i = self._slots.get(product_id)
+            return None if i is None else self._position(i)
+
+    def positions(self):
+        with self._lock:
+            return [self._position(i) for i in range(len(self._product_ids))]
+
+    def _price_vector(self, prices):
+        if isinstance(prices, dict):
+            return np.array([np.nan if prices.get(p) is None else float(prices[p]) for p in self._product_ids])
+        prices = np.asarray(prices, dtype=float)
+        if prices.shape != (len(self._product_ids),):
+            raise ValueError(f"Expected {len(self._product_ids)} prices, got {prices.shape}")
+        return prices
+
+    def tick(self, prices):
+        """
+        Applies one round of prices to every position and checks the sell rules.
+
+        Same order as the old single-position loop: the highest price is bumped before the
+        drop from it is checked, the previous price is replaced after.
+
+        :param prices: dict of product_id -> price, or an array in product_ids() order, NaN/None to skip a product
+        :return: list of SellSignal for the positions that should be sold
+        """
+        with self._lock:
+            n = len(self._product_ids)
+            if not n:
+                return []
+            prices = self._price_vector(prices)
+            seen = ~np.isnan(prices)
+            purchase = self._purchase[:n]
+            highest = np.fmax(self._highest[:n], prices)  # fmax keeps the old high where the price is NaN
+            rules = (
+                (DROP_FROM_PREVIOUS, percent_change(self._previous[:n], prices) <= self.drop_from_previous),
+                (DROP_FROM_HIGHEST, percent_change(highest, prices) <= self.drop_from_highest),
+                (TAKE_PROFIT, percent_change(purchase, prices) >= self.take_profit),
+            )
+            self._highest[:n] = highest
+            self._previous[:n] = np.where(seen, prices, self._previous[:n])
+            self._last[:n] = self._previous[:n]
+
+            fired = seen & (rules[0][1] | rules[1][1] | rules[2][1])
+            sells = []
+            for i in np.flatnonzero(fired):
+                reason = next(name for name, hits in rules if hits[i])
+                sells.append(SellSignal(self._product_ids[i], float(prices[i]), reason))
+            return sells
+
+    def unrealized_pnl(self):
+        """
+        :return: dict of product_id -> PnL at the last ticked price, before fees
+        """
+        with self._lock:
+            n = len(self._product_ids)
+            pnl = self._amount[:n] * (self._last[:n] - self._purchase[:n])
+            return dict(zip(self._product_ids, pnl.tolist()))
+
+    def total_pnl(self):
+        return sum(self.unrealized_pnl().values())
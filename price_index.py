@@ -0,0 +1,101 @@
+import json
+import logging
+import os
+import threading
+import time
+
+
+DEFAULT_SNAPSHOT_PATH = 'last_prices.json'
+
+
+class LastPriceIndex:
+    """
+    Latest known price and its timestamp per product, with O(1) lookups.
+
+    Anything that sees a price (candle fetches, tickers) calls update(). The index only
+    moves forward in time, so an older candle close can't overwrite a newer ticker price.
+    It is persisted as a small JSON snapshot that gets loaded at startup.
+    """
+
+    def __init__(self, path=DEFAULT_SNAPSHOT_PATH):
+        self.path = path
+        self._prices = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._prices)
+
+    def __contains__(self, product_id):
+        return product_id in self._prices
+
+    def update(self, product_id, price, timestamp=None):
+        """
+        Records a price if it is newer than what we already have, returns True if it was used.
+        """
+        if price is None:
+            return False
+        timestamp = time.time() if timestamp is None else float(timestamp)
+        with self._lock:
+            current = self._prices.get(product_id)
+            if current is not None and current[1] > timestamp:
+                return False
+            self._prices[product_id] = (float(price), timestamp)
+            self._dirty = True
+            return True
+
+    def update_from_candles(self, product_id, rows, granularity=300):
+        """
+        Takes the close of the newest candle, stamped with the end of its bucket.
+        """
+        if not len(rows):
+            return False
+        newest = max(rows, key=lambda row: row[0])
+        return self.update(product_id, newest[4], newest[0] + granularity)
+
+    def get(self, product_id, default=None):
+        entry = self._prices.get(product_id)
+        return entry[0] if entry is not None else default
+
+    def get_entry(self, product_id):
+        """
+        (price, timestamp) or None.
+        """
+        return self._prices.get(product_id)
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        try:
+            with open(self.path) as f:
+                snapshot = json.load(f)
+            with self._lock:
+                self._prices = {product_id: (float(price), float(ts)) for product_id, (price, ts) in snapshot.items()}
+                self._dirty = False
+            return len(self._prices)
+        except Exception as e:
+            logging.error(f"Error loading last price snapshot {self.path}: {e}")
+            return 0
+
+    def save(self, force=False):
+        """
+        Writes the snapshot if anything changed since the last save.
+        """
+        if not self.path:
+            return False
+        with self._lock:
+            if not self._dirty and not force:
+                return False
+            snapshot = {product_id: list(entry) for product_id, entry in self._prices.items()}
+            self._dirty = False
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+            return True
+        except Exception as e:
+            logging.error(f"Error saving last price snapshot {self.path}: {e}")
+            with self._lock:
+                self._dirty = True
+            return False
@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import threading
+import time
+from decimal import Decimal, ROUND_DOWN
+
+
+DEFAULT_SNAPSHOT_PATH = 'products.json'
+DEFAULT_TTL = 15 * 60
+
+
+class ProductInfo:
+    """
+    The parts of a /products entry that decide whether and how a product can be traded.
+
+    Increments and sizes are Decimals so order sizes and prices can be rounded exactly.
+    """
+    __slots__ = ('product_id', 'base_currency', 'quote_currency', 'base_increment', 'quote_increment',
+                 'base_min_size', 'base_max_size', 'min_market_funds', 'max_market_funds', 'status',
+                 'trading_disabled', 'cancel_only', 'limit_only', 'post_only')
+
+    def __init__(self, product):
+        def decimal(name):
+            value = product.get(name)
+            return Decimal(str(value)) if value not in (None, '') else None
+
+        self.product_id = product['id']
+        self.base_currency = product.get('base_currency')
+        self.quote_currency = product.get('quote_currency')
+        self.base_increment = decimal('base_increment')
+        self.quote_increment = decimal('quote_increment')
+        self.base_min_size = decimal('base_min_size')
+        self.base_max_size = decimal('base_max_size')
+        self.min_market_funds = decimal('min_market_funds')
+        self.max_market_funds = decimal('max_market_funds')
+        self.status = product.get('status')
+        self.trading_disabled = bool(product.get('trading_disabled', False))
+        self.cancel_only = bool(product.get('cancel_only', False))
+        self.limit_only = bool(product.get('limit_only', False))
+        self.post_only = bool(product.get('post_only', False))
+
+    @property
+    def tick_size(self):
+        # Prices move in steps of the quote increment
+        return self.quote_increment
+
+    @property
+    def tradable(self):
+        return (not self.trading_disabled and not self.cancel_only and not self.post_only
+                and self.status in (None, 'online'))
+
+    def round_size(self, size):
+        """
+        Rounds a base currency size down to the base increment.
+        """
+        return _round_down(size, self.base_increment)
+
+    def round_price(self, price):
+        return _round_down(price, self.quote_increment)
+
+    def round_funds(self, funds):
+        return _round_down(funds, self.quote_increment)
+
+
+def _round_down(value, increment):
+    value = Decimal(str(value))
+    if not increment:
+        return value
+    return (value / increment).to_integral_value(rounding=ROUND_DOWN) * increment
+
+
+class ProductCache:
+    """
+    Product metadata keyed by product id, refreshed from /products once it is older than ttl.
+
+    Refreshes send the last ETag so an unchanged list costs a 304 instead of the whole
+    response. The last good list is kept in a JSON snapshot that load() reads at startup,
+    so the first scan doesn't wait for /products.
+    """
+
+    def __init__(self, fetch_fn, ttl=DEFAULT_TTL, snapshot_path=DEFAULT_SNAPSHOT_PATH, clock=time.time):
+        """
+        :param fetch_fn: callable(etag) -> (status_code, etag, products), products is the parsed
+                         /products list or None on a 304
+        """
+        self.fetch_fn = fetch_fn
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self._clock = clock
+        self._products = {}
+        self._tradable = []
+        self._raw = []
+        self.etag = None
+        self.fetched_at = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._products)
+
+    def __contains__(self, product_id):
+        return product_id in self._products
+
+    def _set(self, products, etag, fetched_at):
+        infos = {}
+        for product in products:
+            try:
+                infos[product['id']] = ProductInfo(product)
+            except Exception as e:
+                logging.warning(f"Skipping product entry {product!r}: {e}")
+        tradable = [product_id for product_id, info in infos.items() if info.tradable]
+        with self._lock:
+            self._products, self._tradable, self._raw = infos, tradable, products
+            self.etag, self.fetched_at = etag, fetched_at
+
+    def get(self, product_id):
+        """
+        ProductInfo or None if the product isn't listed.
+        """
+        return self._products.get(product_id)
+
+    def tradable_ids(self):
+        return list(self._tradable)
+
+    def is_stale(self):
+        return self.fetched_at is None or self._clock() - self.fetched_at >= self.ttl
+
+    def refresh(self, force=False):
+        """
+        Fetches /products if the cached list is older than ttl.
+
+        :return: True if the cache is usable afterwards (fresh, revalidated or a stale fallback)
+        """
+        if not force and not self.is_stale():
+            return True
+        try:
+            status, etag, products = self.fetch_fn(self.etag if self._products else None)
+        except Exception as e:
+            logging.error(f"Error refreshing products: {e}")
+            return bool(self._products)
+
+        if status == 304 and self._products:
+            with self._lock:
+                self.fetched_at = self._clock()
+                self.etag = etag or self.etag
+            return True
+        if status != 200 or products is None:
+            logging.warning(f"Failed to refresh products: {status}, keeping {len(self._products)} cached")
+            return bool(self._products)
+
+        self._set(products, etag, self._clock())
+        self.save()
+        return True
+
+    def load(self):
+        """
+        Reads the snapshot, returns how many products it had.
+        """
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return 0
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            self._set(snapshot['products'], snapshot.get('etag'), snapshot.get('fetched_at'))
+            return len(self._products)
+        except Exception as e:
+            logging.error(f"Error loading product snapshot {self.snapshot_path}: {e}")
+            return 0
+
+    def save(self):
+        if not self.snapshot_path:
+            return False
+        with self._lock:
+            snapshot = {'etag': self.etag, 'fetched_at': self.fetched_at, 'products': self._raw}
+        tmp_path = self.snapshot_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f, separators=(',', ':'))
+            os.replace(tmp_path, self.snapshot_path)
+            return True
+        except Exception as e:
+            logging.error(f"Error saving product snapshot {self.snapshot_path}: {e}")
+            return False
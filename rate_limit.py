@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import metrics
+
+
+# Coinbase Pro limits per endpoint class: (requests per second, burst)
+PUBLIC = 'public'
+PRIVATE = 'private'
+DEFAULT_LIMITS = {
+    PUBLIC: (10, 15),
+    PRIVATE: (15, 30),
+}
+
+# Endpoints that need an authenticated key, everything else is public market data
+PRIVATE_PREFIXES = ('/orders', '/fills', '/accounts')
+
+# Backoff used when a 429 comes back without a usable Retry-After header
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+
+RATE_LIMIT_WAIT = metrics.histogram('rate_limit_wait_seconds', 'Time spent waiting for a rate limit token')
+RATE_LIMITED = metrics.counter('rate_limited_total', '429 responses from the exchange')
+
+
+def endpoint_class_for(endpoint):
+    return PRIVATE if endpoint.startswith(PRIVATE_PREFIXES) else PUBLIC
+
+
+def endpoint_key(endpoint):
+    """
+    Groups /products/BTC-USD/candles and /products/ETH-USD/candles under one metrics label.
+    """
+    parts = endpoint.split('?')[0].strip('/').split('/')
+    if len(parts) >= 2 and parts[0] == 'products' and parts[1] != 'stats':
+        parts[1] = '{id}'
+    elif len(parts) >= 2 and parts[0] == 'orders':
+        parts[1] = '{id}'
+    return '/' + '/'.join(parts)
+
+
+def parse_retry_after(value):
+    """
+    Retry-After can be a number of seconds or an HTTP date, returns seconds or None.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Token bucket that refills at `rate` tokens per second up to `capacity`.
+
+    Callers reserve tokens under a lock and do the waiting outside of it, so the
+    same bucket can be shared by threads and by coroutines on an event loop.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._blocked_until = 0.0
+        self._backoff = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, tokens=1):
+        """
+        Takes the tokens right away and returns how many seconds to wait before using them.
+        """
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self._tokens -= tokens
+            # A negative balance is a debt that gets paid back by the refill
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._blocked_until - now)
+
+    def acquire(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def penalize(self, retry_after=None):
+        """
+        Blocks the bucket after a 429. Uses Retry-After when given, otherwise doubles the backoff.
+        """
+        with self._lock:
+            now = self._clock()
+            if retry_after is None:
+                self._backoff = min(MAX_BACKOFF, self._backoff * 2 if self._backoff else BASE_BACKOFF)
+                retry_after = self._backoff
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+            # Whatever was left in the bucket was clearly too much for the exchange
+            self._refill(now)
+            self._tokens = min(self._tokens, 0.0)
+            return retry_after
+
+    def reset_backoff(self):
+        with self._lock:
+            self._backoff = 0.0
+
+
+class RateLimiter:
+    """
+    One token bucket per endpoint class.
+    """
+
+    def __init__(self, limits=None, clock=time.monotonic):
+        limits = limits or DEFAULT_LIMITS
+        self.buckets = {name: TokenBucket(rate, burst, clock) for name, (rate, burst) in limits.items()}
+
+    def acquire(self, endpoint_class=PUBLIC, tokens=1):
+        waited = self.buckets[endpoint_class].acquire(tokens)
+        RATE_LIMIT_WAIT.observe(waited, endpoint_class=endpoint_class)
+        return waited
+
+    async def acquire_async(self, endpoint_class=PUBLIC, tokens=1):
+        waited = await self.buckets[endpoint_class].acquire_async(tokens)
+        RATE_LIMIT_WAIT.observe(waited, endpoint_class=endpoint_class)
+        return waited
+
+    def handle_response(self, endpoint_class, status_code, headers=None):
+        """
+        Feeds a response status back into the limiter, returns True if we got rate limited.
+        """
+        bucket = self.buckets[endpoint_class]
+        if status_code != 429:
+            bucket.reset_backoff()
+            return False
+        RATE_LIMITED.inc(endpoint_class=endpoint_class)
+        retry_after = parse_retry_after((headers or {}).get('Retry-After'))
+        waited = bucket.penalize(retry_after)
+        logging.warning(f"Rate limited on {endpoint_class} endpoints, backing off for {waited:.2f}s")
+        return True
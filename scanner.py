@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+import metrics
+import signals
+from candle_store import align
+from rate_limit import PRIVATE, PUBLIC, endpoint_class_for, endpoint_key
+from signals import INCREASE_2H_THRESHOLD, INCREASE_1H_THRESHOLD, INCREASE_SINCE_LAST_CHECK_THRESHOLD
+
+# Candle rows come back from the exchange as [time, low, high, open, close, volume]
+CANDLE_TIME, CANDLE_LOW, CANDLE_HIGH, CANDLE_OPEN, CANDLE_CLOSE, CANDLE_VOLUME = range(6)
+
+DEFAULT_MAX_CONCURRENCY = 10
+DEFAULT_TIMEOUT = 15  # seconds per request, 5 of them for the connect
+CONNECT_TIMEOUT = 5
+MAX_RATE_LIMIT_RETRIES = 3
+
+SCAN_SECONDS = metrics.histogram('scan_seconds', 'Whole market scan, fetches and evaluation')
+SIGNAL_SECONDS = metrics.histogram('signal_evaluation_seconds', 'Vectorized buy condition evaluation')
+SCAN_REQUEST_SECONDS = metrics.histogram('scan_request_seconds', 'Scan request round trip time, semaphore wait excluded')
+
+
+def percent_change(start_price, end_price):
+    """
+    Percentage change from start_price to end_price, None if it can't be computed.
+
+    This and window_increase are the one-product versions of what signals.py does for the
+    whole universe at once, ScanResult falls back on them when no signal was evaluated.
+    """
+    if start_price is None or end_price is None or start_price == 0:
+        return None
+    return (end_price - start_price) / start_price * 100
+
+
+def window_increase(candles):
+    """
+    Percentage change from the open of the oldest candle to the close of the newest one.
+
+    :param candles: list of candle rows sorted oldest first
+    """
+    if not candles:
+        return None
+    return percent_change(candles[0][CANDLE_OPEN], candles[-1][CANDLE_CLOSE])
+
+
+def candles_since(candles, start_time, granularity=300):
+    """
+    Tail of an oldest-first candle list starting at the bucket that start_time falls in.
+    """
+    cutoff = align(start_time.timestamp(), granularity)
+    return [row for row in candles if row[CANDLE_TIME] >= cutoff]
+
+
+@dataclass
+class ScanResult:
+    product_id: str
+    last_checked_price: float = None
+    current_price: float = None
+    increase_2h: float = None
+    increase_1h: float = None
+    increase_since_last_check: float = None
+    candles: list = field(default_factory=list, repr=False)
+    # Filled in by evaluate_results from the vectorized signal engine
+    signal_met: bool = None
+    signal_score: float = None
+
+    @property
+    def is_buy_condition_met(self):
+        if self.signal_met is not None:
+            return self.signal_met
+        # Any one of the conditions is enough, same as the serial scan
+        return (
+            (self.increase_2h is not None and self.increase_2h >= INCREASE_2H_THRESHOLD)
+            or (self.increase_1h is not None and self.increase_1h >= INCREASE_1H_THRESHOLD)
+            or (self.increase_since_last_check is not None
+                and self.increase_since_last_check >= INCREASE_SINCE_LAST_CHECK_THRESHOLD)
+        )
+
+    @property
+    def score(self):
+        # Used for ranking candidates, the strongest move wins
+        if self.signal_score is not None:
+            return self.signal_score
+        increases = [x for x in (self.increase_2h, self.increase_1h, self.increase_since_last_check) if x is not None]
+        return max(increases) if increases else float('-inf')
+
+
+@dataclass
+class ScanContext:
+    """
+    Everything a single scan shares between its requests.
+    """
+    session: object  # aiohttp.ClientSession
+    semaphore: asyncio.Semaphore
+    api_url: str
+    headers_fn: object = None
+    rate_limiter: object = None
+    candle_store: object = None
+    price_index: object = None
+    current_prices: dict = None
+
+
+async def _get_json(ctx, endpoint, params=None):
+    async with ctx.semaphore:
+        for _ in range(MAX_RATE_LIMIT_RETRIES + 1):
+            if ctx.rate_limiter:
+                await ctx.rate_limiter.acquire_async(PUBLIC)
+            headers = None
+            if ctx.headers_fn and endpoint_class_for(endpoint) == PRIVATE:
+                headers = ctx.headers_fn(endpoint, 'GET')
+            started = time.perf_counter()
+            async with ctx.session.get(ctx.api_url + endpoint, params=params, headers=headers) as response:
+                SCAN_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint_key(endpoint))
+                # On a 429 the limiter backs off the whole bucket, so the retry waits its turn
+                if ctx.rate_limiter and ctx.rate_limiter.handle_response(PUBLIC, response.status, response.headers):
+                    continue
+                if response.status != 200:
+                    logging.warning(f"Scan request to {endpoint} failed: {response.status}")
+                    return None
+                return await response.json()
+        logging.warning(f"Scan request to {endpoint} gave up after repeated rate limiting")
+        return None
+
+
+async def fetch_candles(ctx, product_id, start_time, end_time, granularity=300):
+    endpoint = f'/products/{product_id}/candles'
+    params = {
+        'start': start_time.isoformat(),
+        'end': end_time.isoformat(),
+        'granularity': str(granularity)
+    }
+    rows = await _get_json(ctx, endpoint, params)
+    if rows is None:
+        return None
+    # The exchange returns newest first, conditions want oldest first
+    return sorted(rows, key=lambda row: row[CANDLE_TIME])
+
+
+async def fetch_candle_window(ctx, product_id, start_time, end_time, granularity=300):
+    if ctx.candle_store is None:
+        return await fetch_candles(ctx, product_id, start_time, end_time, granularity) or []
+
+    async def fetch_missing(product_id, range_start, range_end, granularity):
+        return await fetch_candles(ctx, product_id, range_start, range_end, granularity)
+
+    return await ctx.candle_store.get_candles_async(product_id, start_time, end_time, granularity, fetch_missing)
+
+
+async def fetch_ticker_price(ctx, product_id):
+    data = await _get_json(ctx, f'/products/{product_id}/ticker')
+    if not data or 'price' not in data:
+        return None
+    return float(data['price'])
+
+
+async def scan_product(ctx, product_id, last_checked_price, now):
+    result = ScanResult(product_id=product_id, last_checked_price=last_checked_price)
+    try:
+        current_price = (ctx.current_prices or {}).get(product_id)
+        if current_price is None:
+            candles_2h, current_price = await asyncio.gather(
+                fetch_candle_window(ctx, product_id, now - timedelta(hours=2), now),
+                fetch_ticker_price(ctx, product_id),
+            )
+        else:
+            # Already fetched with everything else in one batch, only the candles go out
+            candles_2h = await fetch_candle_window(ctx, product_id, now - timedelta(hours=2), now)
+        # Conditions get evaluated for every product at once in evaluate_results, the
+        # 1 hour window is sliced out of these same candles there
+        result.candles = candles_2h
+        result.current_price = current_price
+        # This price is the "last checked" one for the next scan
+        if ctx.price_index is not None:
+            ctx.price_index.update(product_id, current_price)
+    except Exception as e:
+        logging.error(f"Error scanning {product_id}: {e}")
+    return result
+
+
+def evaluate_results(results, now, engine=None):
+    """
+    Evaluates the buy conditions for every scanned product in one vectorized pass.
+
+    :return: the results that met a condition, strongest first
+    """
+    engine = engine or signals.default_engine()
+    matrix = signals.build_matrix(
+        [result.product_id for result in results],
+        {result.product_id: result.candles for result in results},
+        {result.product_id: result.current_price for result in results},
+        {result.product_id: result.last_checked_price for result in results},
+        now.timestamp(),
+    )
+    with SIGNAL_SECONDS.time():
+        signal = engine.evaluate(matrix)
+    for i, result in enumerate(results):
+        for name, values in signal.scores.items():
+            if hasattr(result, name):
+                setattr(result, name, None if values[i] != values[i] else float(values[i]))
+        result.signal_met = bool(signal.met[i])
+        result.signal_score = float(signal.score[i])
+    return [results[i] for i in signal.ranked()]
+
+
+async def scan_market(product_ids, last_checked_prices, api_url, headers_fn=None, rate_limiter=None, candle_store=None,
+                      price_index=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, timeout=DEFAULT_TIMEOUT, engine=None,
+                      current_prices=None):
+    """
+    Scans every product concurrently and returns the buy candidates, best score first.
+
+    :param product_ids: products to scan
+    :param last_checked_prices: dict of product_id -> last checked price
+    :param api_url: base URL of the exchange
+    :param headers_fn: optional callable(endpoint, method) returning signed headers, only used for private endpoints
+    :param rate_limiter: optional RateLimiter, every request takes a token from its public bucket
+    :param candle_store: optional CandleStore, only the candles it is missing get fetched
+    :param price_index: optional LastPriceIndex that gets every ticker price the scan sees
+    :param max_concurrency: upper bound on requests in flight at once
+    :param timeout: seconds per request, or an aiohttp.ClientTimeout
+    :param engine: optional signals.SignalEngine, defaults to the standard buy conditions
+    :param current_prices: optional dict of product_id -> price already fetched, those products skip their ticker
+    """
+    # Only the hourly scan needs aiohttp, importing it here keeps it off the bot's startup
+    import aiohttp
+
+    if not isinstance(timeout, aiohttp.ClientTimeout):
+        timeout = aiohttp.ClientTimeout(total=timeout, connect=min(CONNECT_TIMEOUT, timeout))
+    now = datetime.now()
+    started = time.perf_counter()
+    connector = aiohttp.TCPConnector(limit=max_concurrency, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        ctx = ScanContext(session, asyncio.Semaphore(max_concurrency), api_url, headers_fn, rate_limiter, candle_store,
+                          price_index, current_prices)
+        results = await asyncio.gather(*(
+            scan_product(ctx, product_id, last_checked_prices.get(product_id), now)
+            for product_id in product_ids
+        ))
+
+    candidates = evaluate_results(results, now, engine)
+    SCAN_SECONDS.observe(time.perf_counter() - started)
+    logging.info(f"Scanned {len(results)} products, {len(candidates)} buy candidates")
+    return candidates
+
+
+def run_market_scan(product_ids, last_checked_prices, api_url, headers_fn=None, rate_limiter=None, candle_store=None,
+                    price_index=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, current_prices=None, engine=None):
+    """
+    Blocking wrapper around scan_market for the synchronous main loop.
+    """
+    return asyncio.run(scan_market(product_ids, last_checked_prices, api_url, headers_fn, rate_limiter, candle_store,
+                                   price_index, max_concurrency, engine=engine, current_prices=current_prices))
@@ -0,0 +1,140 @@
+import logging
+import threading
+import time
+
+import metrics
+
+
+JOB_SECONDS = metrics.histogram('scheduler_job_seconds', 'Scheduled job run time')
+MISSED_RUNS = metrics.counter('scheduler_missed_runs_total', 'Runs folded into a late catch-up run')
+OVERLAPS = metrics.counter('scheduler_overlaps_total', 'Runs skipped because the previous one was still going')
+
+
+class Job:
+    """
+    Something the scheduler runs every interval seconds.
+
+    due is a deadline on the monotonic clock. Aligned jobs start on a wall clock multiple of
+    the interval plus offset (interval=3600, offset=0 is "at the top of every hour") and then
+    keep counting on the monotonic clock.
+    """
+    __slots__ = ('name', 'fn', 'interval', 'align', 'offset', 'threaded', 'due', 'thread', 'runs', 'missed',
+                 'overlaps', 'last_started', 'last_finished')
+
+    def __init__(self, name, fn, interval, align=False, offset=0.0, threaded=False):
+        if interval <= 0:
+            raise ValueError(f"{name}: interval must be positive, got {interval}")
+        self.name = name
+        self.fn = fn
+        self.interval = float(interval)
+        self.align = align
+        self.offset = float(offset)
+        self.threaded = threaded
+        self.due = None
+        self.thread = None
+        self.runs = 0
+        self.missed = 0
+        self.overlaps = 0
+        self.last_started = None
+        self.last_finished = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+
+class Scheduler:
+    """
+    Runs jobs at their deadlines and sleeps in between.
+
+    A job that comes due late runs once as soon as possible, any whole periods it missed are
+    counted and folded into that one run, so a slow iteration delays the hourly scan instead
+    of losing it. Threaded jobs run on their own thread so a long scan doesn't hold up the
+    per-second jobs, and a threaded job that is still running when it comes due again is
+    skipped rather than started twice.
+    """
+
+    def __init__(self, clock=time.monotonic, wall_clock=time.time):
+        self.jobs = []
+        self._clock = clock
+        self._wall_clock = wall_clock
+        self._wake = threading.Event()
+        self._stopped = False
+
+    def every(self, interval, fn, name=None, align=False, offset=0.0, threaded=False):
+        """
+        Adds a job, the first run is right away unless it is aligned to the wall clock.
+
+        :return: the Job
+        """
+        job = Job(name or getattr(fn, '__name__', 'job'), fn, interval, align, offset, threaded)
+        now = self._clock()
+        if align:
+            wall = self._wall_clock()
+            job.due = now + (job.offset - wall) % job.interval
+        else:
+            job.due = now
+        self.jobs.append(job)
+        self._wake.set()
+        return job
+
+    def _run(self, job):
+        job.last_started = self._clock()
+        started = time.perf_counter()
+        try:
+            job.fn()
+        except Exception as e:
+            logging.error(f"Scheduled job {job.name} failed: {e}")
+        finally:
+            JOB_SECONDS.observe(time.perf_counter() - started, job=job.name)
+            job.runs += 1
+            job.last_finished = self._clock()
+
+    def run_pending(self):
+        """
+        Runs every job that is due, earliest deadline first.
+
+        :return: seconds until the next deadline
+        """
+        for job in sorted((job for job in self.jobs if job.due <= self._clock()), key=lambda job: job.due):
+            now = self._clock()
+            missed = int((now - job.due) // job.interval)
+            if missed:
+                job.missed += missed
+                MISSED_RUNS.inc(missed, job=job.name)
+                logging.warning(f"Job {job.name} is {now - job.due:.1f}s late, catching up {missed} missed runs with one")
+            # Stay on the original grid, an hourly job keeps running at the top of the hour
+            job.due += (missed + 1) * job.interval
+
+            if job.running:
+                job.overlaps += 1
+                OVERLAPS.inc(job=job.name)
+                logging.warning(f"Job {job.name} is still running, skipping this run")
+                continue
+            if job.threaded:
+                job.thread = threading.Thread(target=self._run, args=(job,), name=f'job-{job.name}', daemon=True)
+                job.thread.start()
+            else:
+                self._run(job)
+
+        if not self.jobs:
+            return None
+        return max(0.0, min(job.due for job in self.jobs) - self._clock())
+
+    def run_forever(self):
+        """
+        Runs jobs until stop() is called, sleeping until the next deadline in between.
+        """
+        self._stopped = False
+        while not self._stopped:
+            delay = self.run_pending()
+            # Wakes up early when a job gets added or stop() is called
+            if self._wake.wait(delay):
+                self._wake.clear()
+
+    def stop(self, timeout=None):
+        self._stopped = True
+        self._wake.set()
+        for job in self.jobs:
+            if job.running:
+                job.thread.join(timeout)
@@ -0,0 +1,169 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+
+# Buy thresholds (percent), same numbers check_and_execute_buy has always used
+INCREASE_2H_THRESHOLD = 10
+INCREASE_1H_THRESHOLD = 10
+INCREASE_SINCE_LAST_CHECK_THRESHOLD = 5
+
+# Sell thresholds (percent) used by check_and_execute_sell_order
+DROP_FROM_PREVIOUS_THRESHOLD = -5
+DROP_FROM_HIGHEST_THRESHOLD = -5
+TAKE_PROFIT_THRESHOLD = 25
+
+CANDLE_TIME, CANDLE_OPEN, CANDLE_CLOSE = 0, 3, 4
+
+
+@dataclass
+class MarketMatrix:
+    """
+    Candles for a whole universe lined up on one time axis.
+
+    opens/closes are (products x buckets) with NaN where a product had no candle.
+    """
+    product_ids: list
+    times: np.ndarray
+    opens: np.ndarray
+    closes: np.ndarray
+    current_prices: np.ndarray
+    last_checked_prices: np.ndarray
+    now: float
+
+
+def build_matrix(product_ids, candles, current_prices, last_checked_prices, now, granularity=300):
+    """
+    :param candles: dict of product_id -> candle rows (any order)
+    :param current_prices: dict of product_id -> current price or None
+    :param last_checked_prices: dict of product_id -> last checked price or None
+    """
+    bucket_times = sorted({int(row[CANDLE_TIME]) for product_id in product_ids for row in candles.get(product_id, ())})
+    times = np.array(bucket_times, dtype=np.int64)
+    opens = np.full((len(product_ids), len(times)), np.nan)
+    closes = np.full((len(product_ids), len(times)), np.nan)
+    for i, product_id in enumerate(product_ids):
+        rows = candles.get(product_id)
+        if not rows:
+            continue
+        columns = np.searchsorted(times, [int(row[CANDLE_TIME]) for row in rows])
+        opens[i, columns] = [row[CANDLE_OPEN] for row in rows]
+        closes[i, columns] = [row[CANDLE_CLOSE] for row in rows]
+
+    def as_vector(values):
+        return np.array([np.nan if values.get(p) is None else float(values[p]) for p in product_ids], dtype=float)
+
+    return MarketMatrix(list(product_ids), times, opens, closes, as_vector(current_prices),
+                        as_vector(last_checked_prices), float(now))
+
+
+def percent_change(start, end):
+    """
+    Elementwise percent change, NaN wherever start is missing or zero.
+    """
+    start = np.asarray(start, dtype=float)
+    end = np.asarray(end, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = (end - start) / start * 100
+    return np.where((start == 0) | np.isnan(start), np.nan, change)
+
+
+def window_increase(matrix, lookback_seconds, granularity=300):
+    """
+    Change from the open of each product's oldest candle in the window to the close of its newest.
+    """
+    n_products, n_times = matrix.opens.shape
+    if n_times == 0:
+        return np.full(n_products, np.nan)
+    cutoff = matrix.now - lookback_seconds
+    start_column = np.searchsorted(matrix.times, int(cutoff) - int(cutoff) % granularity)
+    rows = np.arange(n_products)
+
+    opens = matrix.opens[:, start_column:]
+    has_open = ~np.isnan(opens)
+    first_open = opens[rows, has_open.argmax(axis=1)] if opens.shape[1] else np.full(n_products, np.nan)
+
+    has_close = ~np.isnan(matrix.closes)
+    last_close = matrix.closes[rows, n_times - 1 - has_close[:, ::-1].argmax(axis=1)]
+
+    increase = percent_change(first_open, last_close)
+    return np.where(has_open.any(axis=1) & has_close.any(axis=1), increase, np.nan)
+
+
+def increase_since_last_check(matrix):
+    return percent_change(matrix.last_checked_prices, matrix.current_prices)
+
+
+@dataclass
+class SignalResult:
+    product_ids: list
+    scores: dict
+    met: np.ndarray
+    score: np.ndarray
+
+    def ranked(self):
+        """
+        Indices of the products that met a condition, strongest score first.
+        """
+        candidates = np.flatnonzero(self.met)
+        return candidates[np.argsort(-self.score[candidates], kind='stable')]
+
+
+class SignalEngine:
+    """
+    Evaluates every registered buy condition for the whole universe at once.
+
+    A condition is a function(MarketMatrix) -> array of scores (NaN when it can't be
+    computed) and a threshold; a product is a buy if any score reaches its threshold.
+    """
+
+    def __init__(self):
+        self.conditions = []
+
+    def register(self, name, fn, threshold):
+        self.conditions.append((name, fn, threshold))
+        return self
+
+    def evaluate(self, matrix):
+        n_products = len(matrix.product_ids)
+        met = np.zeros(n_products, dtype=bool)
+        best = np.full(n_products, -np.inf)
+        scores = {}
+        for name, fn, threshold in self.conditions:
+            values = np.asarray(fn(matrix), dtype=float)
+            scores[name] = values
+            available = ~np.isnan(values)
+            met |= available & (values >= threshold)
+            best = np.where(available, np.maximum(best, values), best)
+        return SignalResult(matrix.product_ids, scores, met, best)
+
+
+def indicator_condition(indicators, name, fallback=None):
+    """
+    A condition that reads one live indicator (see indicators.RollingIndicators) for every
+    product in the matrix, so it costs a lookup per product instead of a pass over candles.
+
+    :param fallback: optional condition for the products that have no full window yet
+    """
+    def condition(matrix):
+        values = indicators.vector(name, matrix.product_ids)
+        if fallback is not None and np.isnan(values).any():
+            values = np.where(np.isnan(values), fallback(matrix), values)
+        return values
+    return condition
+
+
+def default_engine(granularity=300, indicators=None):
+    """
+    The three buy conditions check_and_execute_buy has always used.
+
+    :param indicators: optional RollingIndicators with a one hour window, the 1h rule then
+                       uses their rolling return and the candles only for products without one
+    """
+    increase_1h = lambda m: window_increase(m, 3600, granularity)
+    if indicators is not None:
+        increase_1h = indicator_condition(indicators, 'rolling_return', fallback=increase_1h)
+    return (SignalEngine()
+            .register('increase_2h', lambda m: window_increase(m, 2 * 3600, granularity), INCREASE_2H_THRESHOLD)
+            .register('increase_1h', increase_1h, INCREASE_1H_THRESHOLD)
+            .register('increase_since_last_check', increase_since_last_check, INCREASE_SINCE_LAST_CHECK_THRESHOLD))
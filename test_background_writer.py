@@ -0,0 +1,60 @@
+import threading
+import unittest
+
+from background_writer import BackgroundWriter
+
+
+class RecordingWriter(BackgroundWriter):
+
+    def __init__(self):
+        super().__init__(flush_interval=0.05)
+        self.started, self.release = threading.Event(), threading.Event()
+        self.batches = []
+        self.events = []
+
+    def opened(self):
+        self.events.append('opened')
+
+    def write_batch(self, items):
+        self.started.set()
+        self.release.wait(5)
+        self.batches.append(items)
+        if 'boom' in items:
+            raise ValueError('boom')
+
+    def closed(self):
+        self.events.append('closed')
+
+
+class TestBackgroundWriter(unittest.TestCase):
+
+    def test_items_that_pile_up_are_written_as_one_batch(self):
+        writer = RecordingWriter()
+        self.addCleanup(writer.close)
+        writer.put(1)
+        writer.started.wait(5)
+        for i in range(2, 5):
+            writer.put(i)
+        writer.release.set()
+        writer.flush()
+        self.assertEqual(writer.batches, [[1], [2, 3, 4]])
+
+    def test_close_writes_the_rest_and_stops_after_errors(self):
+        writer = RecordingWriter()
+        writer.release.set()
+        writer.put('boom')
+        writer.flush()
+        writer.put('after')
+        writer.close()
+        self.assertEqual(writer.batches, [['boom'], ['after']])
+        self.assertEqual(writer.events, ['opened', 'closed'])
+
+    def test_flush_and_close_without_writes_dont_block(self):
+        writer = RecordingWriter()
+        writer.flush()
+        writer.close()
+        self.assertEqual(writer.events, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
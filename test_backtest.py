@@ -0,0 +1,82 @@
+import os
+import unittest
+
+import numpy as np
+
+from backtest import ProductSeries, StrategyParams, load_csv, run_backtest
+
+
+GRANULARITY = 300
+T0 = 1_700_000_000 - 1_700_000_000 % 3600  # top of an hour
+
+
+def series_from_closes(product_id, closes, granularity=GRANULARITY, start=T0):
+    closes = np.asarray(closes, dtype=float)
+    opens = np.concatenate(([closes[0]], closes[:-1]))
+    rows = [[start + i * granularity, min(o, c), max(o, c), o, c, 1.0] for i, (o, c) in enumerate(zip(opens, closes))]
+    return ProductSeries(product_id, rows)
+
+
+def pump_then_dump():
+    # Flat for 3 hours, +15% over the 4th hour, flat, then a 6% drop one hour after that
+    closes = [100.0] * 36 + list(np.linspace(100, 115, 13)[1:]) + [115.0] * 12 + [108.0] * 60
+    return series_from_closes('BTC-USD', closes)
+
+
+class TestBacktest(unittest.TestCase):
+
+    def test_buy_on_pump_and_sell_on_drop(self):
+        series = {'BTC-USD': pump_then_dump(), 'ETH-USD': series_from_closes('ETH-USD', [50.0] * 120)}
+        result = run_backtest(series, GRANULARITY, StrategyParams(fee_rate=0.0), initial_cash=1000.0)
+
+        self.assertEqual(len(result.trades), 1)
+        trade = result.trades[0]
+        self.assertEqual(trade.product_id, 'BTC-USD')
+        self.assertEqual(trade.buy_time, T0 + 4 * 3600)  # first bar after the 4h scan
+        self.assertEqual(trade.buy_price, 115.0)
+        self.assertEqual(trade.sell_price, 108.0)
+        self.assertEqual(trade.reason, 'drop_from_previous')
+        self.assertAlmostEqual(result.final_equity, 1000 * 108 / 115)
+        self.assertAlmostEqual(result.max_drawdown, (1 - 108 / 115) * 100)
+        self.assertEqual(result.win_rate, 0.0)
+
+    def test_fees(self):
+        result = run_backtest({'BTC-USD': pump_then_dump()}, GRANULARITY, StrategyParams(fee_rate=0.005), 1000.0)
+        expected = 995 / 115 * 108 * 0.995
+        self.assertAlmostEqual(result.final_equity, expected)
+        self.assertAlmostEqual(result.trades[0].pnl, expected - 1000)
+
+    def test_take_profit_and_open_position(self):
+        closes = [100.0] * 36 + list(np.linspace(100, 115, 13)[1:]) + list(np.linspace(115, 150, 40))
+        result = run_backtest({'BTC-USD': series_from_closes('BTC-USD', closes)}, GRANULARITY,
+                              StrategyParams(fee_rate=0.0, drop_from_previous=-50, drop_from_highest=-50))
+        self.assertEqual(result.trades[0].reason, 'take_profit')
+        self.assertGreaterEqual(result.trades[0].sell_price / 115, 1.25)
+
+        result = run_backtest({'BTC-USD': series_from_closes('BTC-USD', closes)}, GRANULARITY,
+                              StrategyParams(fee_rate=0.0, take_profit=1000, drop_from_previous=-50,
+                                             drop_from_highest=-50))
+        self.assertIsNone(result.trades[0].sell_time)
+        self.assertAlmostEqual(result.final_equity, 1000 * 150 / 115)
+
+    def test_historical_data_csv(self):
+        csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'historical_data.csv')
+        series = load_csv(csv_path, product_id='BTC-USD')
+        # The three copies of the same bar collapse into one
+        self.assertEqual(len(series['BTC-USD'].times), 1)
+        self.assertEqual(run_backtest(series, GRANULARITY).trades, [])
+
+    def test_month_of_minute_bars(self):
+        rng = np.random.default_rng(7)
+        bars = 30 * 24 * 60
+        series = {}
+        for i in range(50):
+            closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.004, bars)))
+            series[f'P{i}-USD'] = series_from_closes(f'P{i}-USD', closes, granularity=60)
+        result = run_backtest(series, 60)
+        self.assertLess(result.elapsed, 10)
+        self.assertEqual(len(result.equity), len(result.equity_times))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from bar_aggregator import BarAggregator, Trade, aggregate, publish, replay
+from candle_storage import CandleStorage
+from candle_store import CandleStore
+from market_feed import MarketDataCache
+
+START = 1_700_000_040  # a minute boundary, one minute before a 5 minute one
+
+
+def random_trades(n, seed=1):
+    rng = np.random.default_rng(seed)
+    times = START + np.sort(rng.uniform(0, 3600, n))
+    prices = 100 * np.exp(np.cumsum(rng.normal(0, 0.001, n)))
+    sizes = rng.uniform(0.01, 2, n)
+    return [Trade('BTC-USD', float(t), float(p), float(s), i + 1) for i, (t, p, s) in enumerate(zip(times, prices, sizes))]
+
+
+def pandas_bars(trades, granularity):
+    frame = pd.DataFrame(trades, columns=Trade._fields)
+    frame['bucket'] = frame['time'].astype(int) // granularity * granularity
+    grouped = frame.groupby('bucket')['price']
+    return pd.DataFrame({'low': grouped.min(), 'high': grouped.max(), 'open': grouped.first(),
+                         'close': grouped.last(), 'volume': frame.groupby('bucket')['size'].sum()})
+
+
+class TestBarAggregator(unittest.TestCase):
+
+    def test_bars_match_pandas(self):
+        trades = random_trades(5000)
+        bars = list(aggregate(trades, BarAggregator(granularities=(60, 300))))
+        for granularity in (60, 300):
+            got = [bar.row for bar in bars if bar.granularity == granularity]
+            expected = pandas_bars(trades, granularity)
+            self.assertEqual([row[0] for row in got], list(expected.index))
+            np.testing.assert_allclose([row[1:] for row in got], expected.to_numpy())
+            # Only the bar we joined partway through is incomplete
+            complete = [bar.complete for bar in bars if bar.granularity == granularity]
+            self.assertEqual(complete, [False] + [True] * (len(complete) - 1))
+
+    def test_late_trade_corrects_a_closed_bar(self):
+        aggregator = BarAggregator(granularities=(60,))
+        aggregator.add('BTC-USD', START + 10, 100, 1)
+        aggregator.add('BTC-USD', START + 50, 101, 1)
+        closed = aggregator.add('BTC-USD', START + 70, 102, 1)
+        self.assertEqual(closed[0].row, [START, 100, 101, 100, 101, 2])
+
+        corrected = aggregator.add('BTC-USD', START + 55, 99, 3)
+        self.assertEqual(len(corrected), 1)
+        self.assertTrue(corrected[0].corrected)
+        # Latest trade in the bucket, so it is the new close
+        self.assertEqual(corrected[0].row, [START, 99, 101, 100, 99, 5])
+        early = aggregator.add('BTC-USD', START + 1, 98, 1)
+        self.assertEqual(early[0].row, [START, 98, 101, 98, 99, 6])
+
+    def test_trades_past_the_correction_window_are_dropped(self):
+        aggregator = BarAggregator(granularities=(60,), correction_bars=2)
+        for minute in range(5):
+            aggregator.add('BTC-USD', START + minute * 60, 100 + minute, 1)
+        self.assertEqual(aggregator.add('BTC-USD', START + 5, 50, 1), [])
+        # Inside the window but a bucket nobody traded in is fine too
+        aggregator.add('BTC-USD', START + 10 * 60, 110, 1)
+        filled = aggregator.add('BTC-USD', START + 9 * 60, 109, 1)
+        self.assertEqual(filled[0].row[0], START + 9 * 60)
+
+    def test_trade_id_gap_marks_the_open_bar_incomplete(self):
+        aggregator = BarAggregator(granularities=(60,))
+        aggregator.add('BTC-USD', START - 30, 100, 1, trade_id=1)
+        aggregator.add('BTC-USD', START + 10, 100, 1, trade_id=2)
+        aggregator.add('BTC-USD', START + 20, 100, 1, trade_id=7)
+        closed = aggregator.add('BTC-USD', START + 70, 100, 1, trade_id=8)
+        self.assertFalse(closed[0].complete)
+        self.assertEqual(aggregator.live_since('BTC-USD', 60), START + 60)
+        closed = aggregator.add('BTC-USD', START + 130, 100, 1, trade_id=9)
+        self.assertTrue(closed[0].complete)
+
+    def test_advance_closes_quiet_bars(self):
+        aggregator = BarAggregator(granularities=(60, 3600), grace=2)
+        aggregator.add('BTC-USD', START + 10, 100, 1)
+        self.assertEqual(aggregator.advance(START + 61), [])
+        bars = aggregator.advance(START + 62)
+        self.assertEqual([(bar.granularity, bar.row[0]) for bar in bars], [(60, START)])
+        self.assertEqual(len(aggregator.open_bars()), 1)
+        # A trade for the bar advance() closed is a correction, not a new bar
+        self.assertTrue(aggregator.add('BTC-USD', START + 59, 101, 1)[0].corrected)
+
+
+class TestPublish(unittest.TestCase):
+
+    def test_live_products_need_no_candle_requests(self):
+        now = [START + 5 * 60 + 30]
+        store = CandleStore(clock=lambda: now[0])
+        aggregator = BarAggregator(granularities=(60,))
+        bars = []
+        for second in range(0, 5 * 60 + 30, 15):
+            bars.extend(aggregator.add('BTC-USD', START + second, 100 + second, 1))
+
+        publish(store, aggregator, bars)
+        # The first minute was joined partway, only that one still has to come from the exchange
+        self.assertEqual(store.missing_ranges('BTC-USD', 60, START, now[0]), [(START, START + 60)])
+        self.assertEqual(store.missing_ranges('BTC-USD', 60, START + 60, now[0] + 600), [])
+        window = store.window('BTC-USD', 60, START + 60, now[0])
+        self.assertEqual([row[0] for row in window], [START + 60 * i for i in range(1, 6)])
+        self.assertEqual(window[-1][4], 100 + 5 * 60 + 15)  # the open bar, as of the last trade
+
+    def test_open_bars_are_not_persisted(self):
+        persisted = []
+        store = CandleStore(clock=lambda: START + 130, sink=lambda *args: persisted.append(args))
+        aggregator = BarAggregator(granularities=(60,))
+        bars = []
+        for second in (10, 70, 125):
+            bars.extend(aggregator.add('BTC-USD', START + second, 100, 1))
+        publish(store, aggregator, bars)
+        self.assertEqual([row[0] for _, _, rows in persisted for row in rows], [START + 60])
+
+    def test_finished_bars_can_go_to_their_own_sink(self):
+        stored, sunk = [], []
+        store = CandleStore(clock=lambda: START + 130, sink=lambda *args: stored.append(args))
+        aggregator = BarAggregator(granularities=(60,))
+        bars = []
+        for second in (10, 70, 125):
+            bars.extend(aggregator.add('BTC-USD', START + second, 100, 1))
+        publish(store, aggregator, bars, sink=lambda *args: sunk.append(args))
+        self.assertEqual(stored, [])
+        self.assertEqual([(product_id, granularity, [row[0] for row in rows]) for product_id, granularity, rows in sunk],
+                         [('BTC-USD', 60, [START + 60])])
+        self.assertEqual(len(store.window('BTC-USD', 60, START + 60, START + 180)), 2)
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_replay_recorded_messages_into_storage(self):
+        trades = random_trades(2000, seed=3)
+        path = os.path.join(self.directory, 'feed.jsonl')
+        with open(path, 'w') as f:
+            f.write(json.dumps({'type': 'subscriptions'}) + '\n')
+            for trade in trades:
+                f.write(json.dumps({'type': 'match', 'product_id': trade.product_id, 'price': str(trade.price),
+                                    'size': str(trade.size), 'trade_id': trade.trade_id,
+                                    'time': pd.Timestamp(trade.time, unit='s', tz='UTC').isoformat()}) + '\n')
+        storage = CandleStorage(os.path.join(self.directory, 'candles'))
+        written = replay([path], storage, granularities=(300,))
+        records = storage.read('BTC-USD', 300, START, START + 7200)
+        expected = pandas_bars(trades, 300).iloc[1:]  # the first bucket was joined partway
+        self.assertEqual(written, len(expected))
+        np.testing.assert_array_equal(records['time'], expected.index)
+        np.testing.assert_allclose(records['close'], expected['close'])
+
+
+class TestFeedTrades(unittest.TestCase):
+
+    def test_on_trade_gets_every_new_match(self):
+        trades = []
+        cache = MarketDataCache(on_trade=lambda *trade: trades.append(trade))
+        message = {'type': 'match', 'product_id': 'BTC-USD', 'price': '100', 'size': '2', 'trade_id': 5,
+                   'sequence': 10, 'time': '2024-01-01T00:00:05Z'}
+        cache.handle_message(message)
+        cache.handle_message(message)  # repeated sequence, dropped
+        self.assertEqual(trades, [('BTC-USD', 1704067205.0, 100.0, 2.0, 5)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import os
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from candle_storage import CandleStorage, CandleWriter, SECONDS_PER_DAY, migrate_csv
+
+
+DAY = 19_000 * SECONDS_PER_DAY  # some midnight UTC
+
+
+def bar(t, close):
+    return [t, close - 1, close + 1, close, close, 1.0]
+
+
+class TestCandleStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = CandleStorage(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_upsert_dedups_and_sorts(self):
+        self.storage.upsert('BTC-USD', 300, [bar(DAY + 600, 3.0), bar(DAY, 1.0), bar(DAY + 300, 2.0)])
+        self.storage.upsert('BTC-USD', 300, [bar(DAY + 300, 20.0), bar(DAY + 900, 4.0)])
+
+        records = self.storage.read('BTC-USD', 300, DAY, DAY + SECONDS_PER_DAY)
+        self.assertEqual(list(records['time']), [DAY, DAY + 300, DAY + 600, DAY + 900])
+        # The later write wins
+        self.assertEqual(list(records['close']), [1.0, 20.0, 3.0, 4.0])
+
+    def test_partitions_by_product_granularity_and_day(self):
+        self.storage.upsert('BTC-USD', 300, [bar(DAY, 1.0), bar(DAY + SECONDS_PER_DAY, 2.0)])
+        self.storage.upsert('ETH-USD', 300, [bar(DAY, 5.0)])
+        self.storage.upsert('BTC-USD', 60, [bar(DAY, 7.0)])
+
+        self.assertEqual(self.storage.partition_days('BTC-USD', 300), [19_000, 19_001])
+        self.assertEqual(self.storage.partition_days('ETH-USD', 300), [19_000])
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, 'BTC-USD', '300', '2022-01-08.npy')))
+
+    def test_read_only_returns_requested_range(self):
+        rows = [bar(DAY + i * 300, float(i)) for i in range(3 * 288)]
+        self.storage.upsert('BTC-USD', 300, rows)
+
+        records = self.storage.read('BTC-USD', 300, DAY + SECONDS_PER_DAY - 600, DAY + SECONDS_PER_DAY + 600)
+        self.assertEqual(list(records['time']), [DAY + SECONDS_PER_DAY + d for d in (-600, -300, 0, 300)])
+        self.assertEqual(len(self.storage.read('BTC-USD', 300, 0, DAY)), 0)
+        self.assertEqual(self.storage.last('BTC-USD', 300)['time'], rows[-1][0])
+
+    def test_migrate_csv(self):
+        csv_path = os.path.join(self.tmp.name, 'historical_data.csv')
+        with open(csv_path, 'w') as f:
+            f.write('time,low,high,open,close,volume\n')
+            for _ in range(3):
+                f.write('1609459200,29000,29500,29300,29400,100.0\n')
+
+        self.assertEqual(migrate_csv(csv_path, self.storage, product_id='BTC-USD'), 3)
+        records = self.storage.read('BTC-USD', 300, 0, 2 ** 40)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records['close'][0], 29400.0)
+
+        with self.assertRaises(ValueError):
+            migrate_csv(csv_path, self.storage)
+
+    def test_large_history(self):
+        times = DAY + np.arange(200_000, dtype=np.int64) * 60
+        records = np.zeros(len(times), dtype=[('time', '<i8'), ('low', '<f8'), ('high', '<f8'),
+                                              ('open', '<f8'), ('close', '<f8'), ('volume', '<f8')])
+        records['time'] = times
+        records['close'] = np.arange(len(times))
+        self.storage.upsert('BTC-USD', 60, records)
+
+        one_hour = self.storage.read('BTC-USD', 60, int(times[100_000]), int(times[100_000]) + 3600)
+        self.assertEqual(len(one_hour), 60)
+        self.assertEqual(one_hour['close'][0], 100_000)
+
+
+
+class TestCandleWriter(unittest.TestCase):
+
+    def test_writes_are_batched_per_key_off_the_callers_thread(self):
+        started, release = threading.Event(), threading.Event()
+        upserts = []
+
+        def upsert(product_id, granularity, rows):
+            started.set()
+            release.wait(5)
+            upserts.append((product_id, granularity, [row[0] for row in rows], threading.current_thread()))
+
+        writer = CandleWriter(upsert)
+        self.addCleanup(writer.close)
+        writer.write('BTC-USD', 60, [bar(DAY, 1.0)])
+        started.wait(5)
+        # The first write holds the thread up while the rest pile up behind it
+        for i in range(1, 4):
+            writer.write('BTC-USD', 60, [bar(DAY + 60 * i, 1.0)])
+        writer.write('ETH-USD', 60, [bar(DAY, 2.0)])
+        release.set()
+        writer.flush()
+
+        self.assertEqual([upsert[:3] for upsert in upserts], [
+            ('BTC-USD', 60, [DAY]),
+            ('BTC-USD', 60, [DAY + 60, DAY + 120, DAY + 180]),
+            ('ETH-USD', 60, [DAY]),
+        ])
+        self.assertNotIn(threading.current_thread(), [upsert[3] for upsert in upserts])
+
+    def test_errors_dont_stop_the_writer(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        storage = CandleStorage(tmp.name)
+        writer = CandleWriter(storage.upsert)
+        writer.write('ETH-USD', 60, [['not a time']])
+        writer.write('BTC-USD', 60, [bar(DAY, 1.0)])
+        writer.close()
+        self.assertEqual(len(storage.read('BTC-USD', 60, DAY, DAY + 60)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
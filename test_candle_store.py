@@ -0,0 +1,117 @@
+import asyncio
+import math
+import threading
+import unittest
+
+from candle_store import CandleStore, align
+from testutils import FakeClock
+
+
+GRANULARITY = 300
+
+
+class FakeExchange:
+    """
+    Hands out one candle per bucket and remembers what it was asked for.
+    """
+
+    def __init__(self, max_candles=300):
+        self.max_candles = max_candles
+        self.requests = []
+
+    def __call__(self, product_id, start, end, granularity):
+        start, end = start.timestamp(), end.timestamp()
+        self.requests.append((product_id, start, end))
+        assert (end - start) / granularity <= self.max_candles, 'too many candles for one request'
+        rows = []
+        bucket = align(start, granularity)
+        while bucket < end:
+            rows.append([bucket, 1.0, 2.0, 1.5, 1.6, 10.0])
+            bucket += granularity
+        # Newest first like the real endpoint
+        return list(reversed(rows))
+
+
+class TestCandleStore(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(1_700_000_000 + 123)
+        self.store = CandleStore(clock=self.clock)
+        self.exchange = FakeExchange()
+
+    def get(self, hours):
+        now = self.clock.now
+        return self.store.get_candles('BTC-USD', now - hours * 3600, now, GRANULARITY, self.exchange)
+
+    def test_first_fetch_returns_window_oldest_first(self):
+        rows = self.get(2)
+        times = [row[0] for row in rows]
+        self.assertEqual(times, sorted(times))
+        self.assertEqual(times[0], align(self.clock.now - 7200, GRANULARITY))
+        self.assertEqual(times[-1], align(self.clock.now, GRANULARITY))
+        self.assertEqual(len(self.exchange.requests), 1)
+
+    def test_next_scan_only_fetches_the_tail(self):
+        self.get(2)
+        self.clock.now += 3600
+        self.exchange.requests.clear()
+        rows = self.get(2)
+
+        self.assertEqual(len(rows), 25)
+        self.assertEqual(len(self.exchange.requests), 1)
+        _, start, end = self.exchange.requests[0]
+        # Only the hour that passed plus the bucket that was still open last time
+        self.assertEqual(math.ceil((end - start) / GRANULARITY), 13)
+
+    def test_nested_window_needs_no_fetch_except_open_bucket(self):
+        self.get(2)
+        self.exchange.requests.clear()
+        self.get(1)
+        self.assertEqual(len(self.exchange.requests), 1)
+        _, start, _ = self.exchange.requests[0]
+        self.assertEqual(start, align(self.clock.now, GRANULARITY))
+
+    def test_long_ranges_are_split(self):
+        self.get(48)
+        self.assertEqual(len(self.exchange.requests), 2)
+        self.assertLessEqual(len(self.store.window('BTC-USD', GRANULARITY, 0, self.clock.now + 1)), 24 * 12 + 1)
+
+    def test_failed_fetch_is_not_marked_covered(self):
+        now = self.clock.now
+        self.store.get_candles('BTC-USD', now - 3600, now, GRANULARITY, lambda *args: None)
+        self.assertEqual(len(self.store.missing_ranges('BTC-USD', GRANULARITY, now - 3600, now)), 1)
+
+    def test_async(self):
+        async def fetch(*args):
+            return self.exchange(*args)
+
+        now = self.clock.now
+        rows = asyncio.run(self.store.get_candles_async('ETH-USD', now - 3600, now, GRANULARITY, fetch))
+        self.assertEqual(len(rows), 13)
+
+    def test_async_sink_runs_off_the_event_loop(self):
+        sunk = []
+
+        def sink(product_id, granularity, rows):
+            sunk.append((product_id, len(rows), threading.current_thread()))
+
+        async def fetch(*args):
+            return self.exchange(*args)
+
+        async def scan():
+            now = self.clock.now
+            await self.store.get_candles_async('ETH-USD', now - 48 * 3600, now, GRANULARITY, fetch)
+            return threading.current_thread()
+
+        self.store.sink = sink
+        loop_thread = asyncio.run(scan())
+        # Both requests' rows in one write, not on the loop's thread
+        self.assertEqual(len(self.exchange.requests), 2)
+        self.assertEqual(len(sunk), 1)
+        self.assertEqual(sunk[0][0], 'ETH-USD')
+        self.assertGreater(sunk[0][1], 24 * 12)
+        self.assertIsNot(sunk[0][2], loop_thread)
+
+
+if __name__ == '__main__':
+    unittest.main()
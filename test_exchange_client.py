@@ -0,0 +1,130 @@
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from exchange_client import ExchangeClient
+from metrics import MetricsRegistry
+from rate_limit import endpoint_key
+from rate_limit import RateLimiter
+
+
+class FakeExchangeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def reply(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except BrokenPipeError:
+            pass  # the client gave up waiting
+
+    def do_GET(self):
+        self.server.requests.append(('GET', self.path))
+        if self.path.startswith('/flaky'):
+            self.server.flaky_calls += 1
+            if self.server.flaky_calls < 3:
+                return self.reply(503, {'message': 'try again'})
+        if self.path.startswith('/slow'):
+            time.sleep(0.5)
+        self.reply(200, {'price': '100.0'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.server.requests.append(('POST', self.path, self.rfile.read(length)))
+        self.reply(500, {'message': 'boom'})
+
+
+class TestExchangeClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('localhost', 0), FakeExchangeHandler)
+        self.server.connections = 0
+        self.server.requests = []
+        self.server.flaky_calls = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.api_url = f'http://localhost:{self.server.server_address[1]}'
+        self.client = ExchangeClient(self.api_url, rate_limiter=RateLimiter(), read_timeout=0.2)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_are_reused(self):
+        for _ in range(10):
+            self.assertEqual(self.client.get('/products/BTC-USD/ticker').json(), {'price': '100.0'})
+        self.assertEqual(self.server.connections, 1)
+
+    def test_get_retries_on_5xx(self):
+        response = self.client.get('/flaky')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.flaky_calls, 3)
+
+    def test_post_is_never_retried(self):
+        response = self.client.post('/orders', json.dumps({'type': 'market'}))
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(sum(1 for r in self.server.requests if r[0] == 'POST'), 1)
+
+    def test_read_timeout(self):
+        client = ExchangeClient(self.api_url, read_timeout=0.1, get_retries=1)
+        with self.assertRaises(requests.Timeout):
+            client.get('/slow')
+        client.close()
+
+    def test_latency_stats(self):
+        registry = MetricsRegistry()
+        client = ExchangeClient(self.api_url, registry=registry)
+        for product_id in ('BTC-USD', 'ETH-USD'):
+            client.get(f'/products/{product_id}/ticker')
+        client.get('/flaky')
+        stats = client.latency_stats()[('GET', '/products/{id}/ticker')]
+        self.assertEqual(stats['count'], 2)
+        self.assertLessEqual(stats['p50'], stats['max'])
+        requests_total = registry.get('rest_requests_total')
+        self.assertEqual(requests_total.value(method='GET', endpoint='/flaky', status='503'), 2)
+        self.assertEqual(requests_total.value(method='GET', endpoint='/flaky', status='200'), 1)
+        self.assertEqual(registry.get('rest_retries_total').value(endpoint='/flaky'), 2)
+        client.close()
+
+    def test_only_private_endpoints_are_signed(self):
+        signed = []
+        client = ExchangeClient(self.api_url, headers_fn=lambda *args: signed.append(args) or {'X-Signed': '1'})
+        client.get('/products/BTC-USD/ticker')
+        client.post('/orders', '{}')
+        self.assertEqual(signed, [('/orders', 'POST', '{}')])
+        client.close()
+
+    def test_query_string_is_signed(self):
+        signed = []
+        client = ExchangeClient(self.api_url, headers_fn=lambda *args: signed.append(args) or {'X-Signed': '1'})
+        client.get('/fills', params={'order_id': 'abc', 'limit': 100})
+        self.assertEqual(signed, [('/fills?order_id=abc&limit=100', 'GET', '')])
+        self.assertEqual(self.server.requests[-1], ('GET', '/fills?order_id=abc&limit=100'))
+        client.close()
+
+    def test_endpoint_key(self):
+        self.assertEqual(endpoint_key('/products/BTC-USD/candles'), '/products/{id}/candles')
+        self.assertEqual(endpoint_key('/products'), '/products')
+        self.assertEqual(endpoint_key('/orders'), '/orders')
+        self.assertEqual(endpoint_key('/orders/client:abc'), '/orders/{id}')
+
+
+if __name__ == '__main__':
+    unittest.main()
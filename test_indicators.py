@@ -0,0 +1,167 @@
+import math
+import unittest
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from indicators import RollingIndicators
+from market_feed import MarketDataCache
+from signals import MarketMatrix, SignalEngine, default_engine, indicator_condition
+
+
+def random_walk(n, seed):
+    rng = np.random.default_rng(seed)
+    prices = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    volumes = rng.uniform(0.1, 5, n)
+    return prices, volumes
+
+
+class TestRollingIndicators(unittest.TestCase):
+
+    def setUp(self):
+        self.window = 20
+        self.ema_span = 10
+        self.prices, self.volumes = random_walk(500, seed=1)
+        s, v = pd.Series(self.prices), pd.Series(self.volumes)
+        self.expected = {
+            'rolling_return': s.pct_change(self.window) * 100,
+            'high': s.rolling(self.window).max(),
+            'low': s.rolling(self.window).min(),
+            'ema': s.ewm(span=self.ema_span, adjust=False).mean(),
+            'vwap': (s * v).rolling(self.window).sum() / v.rolling(self.window).sum(),
+            'volatility': (s.pct_change() * 100).rolling(self.window).std(),
+        }
+
+    def run_series(self, indicators, product_id='BTC-USD'):
+        got = {name: [] for name in self.expected}
+        for price, volume in zip(self.prices, self.volumes):
+            indicators.update(product_id, price, volume)
+            for name, value in indicators.snapshot(product_id).items():
+                got[name].append(value)
+        return got
+
+    def test_matches_pandas_after_every_update(self):
+        got = self.run_series(RollingIndicators(self.window, self.ema_span))
+        for name, expected in self.expected.items():
+            np.testing.assert_allclose(got[name], expected.to_numpy(), rtol=1e-9, atol=1e-12, equal_nan=True,
+                                       err_msg=name)
+
+    def test_nan_until_the_window_is_full(self):
+        indicators = RollingIndicators(window=3)
+        for price in (1, 2, 3):
+            indicators.update('BTC-USD', price)
+        self.assertEqual(indicators.get('BTC-USD', 'high'), 3)
+        self.assertTrue(math.isnan(indicators.get('BTC-USD', 'rolling_return')))
+        self.assertTrue(math.isnan(indicators.get('BTC-USD', 'volatility')))
+        indicators.update('BTC-USD', 4)
+        self.assertAlmostEqual(indicators.get('BTC-USD', 'rolling_return'), 300.0)
+
+    def test_products_are_independent_and_arrays_grow(self):
+        indicators = RollingIndicators(self.window, self.ema_span, capacity=1)
+        other, _ = random_walk(500, seed=2)
+        for i in range(len(self.prices)):
+            indicators.update('BTC-USD', self.prices[i], self.volumes[i])
+            indicators.update('ETH-USD', other[i])
+            indicators.update(f'X{i % 5}-USD', 1.0)
+        self.assertEqual(len(indicators), 7)
+        self.assertAlmostEqual(indicators.get('BTC-USD', 'high'), self.expected['high'].iloc[-1])
+        self.assertAlmostEqual(indicators.get('ETH-USD', 'low'), pd.Series(other).rolling(self.window).min().iloc[-1])
+
+    def test_vector_and_unknown_products(self):
+        indicators = RollingIndicators(window=2)
+        for price in (10, 11, 12):
+            indicators.update('BTC-USD', price)
+        vector = indicators.vector('high', ['BTC-USD', 'DOGE-USD'])
+        self.assertEqual(vector[0], 12)
+        self.assertTrue(math.isnan(vector[1]))
+        self.assertTrue(math.isnan(indicators.get('DOGE-USD', 'ema')))
+        with self.assertRaises(ValueError):
+            indicators.get('BTC-USD', 'rsi')
+
+    def test_signal_condition_reads_live_values(self):
+        indicators = RollingIndicators(window=2)
+        for price in (100, 105, 120):
+            indicators.update('BTC-USD', price)
+        for price in (100, 100, 101):
+            indicators.update('ETH-USD', price)
+        matrix = MarketMatrix(['BTC-USD', 'ETH-USD'], np.array([]), np.empty((2, 0)), np.empty((2, 0)),
+                              np.full(2, np.nan), np.full(2, np.nan), 0.0)
+        engine = SignalEngine().register('momentum', indicator_condition(indicators, 'rolling_return'), 10)
+        self.assertEqual(list(engine.evaluate(matrix).met), [True, False])
+
+
+class TestFeedIndicators(unittest.TestCase):
+
+    def test_finished_bars_are_pushed(self):
+        indicators = RollingIndicators(window=2)
+        cache = MarketDataCache(indicators=indicators)
+        for trade_id, (price, size, time) in enumerate([(100, 1, '00:00:05'), (102, 3, '00:00:30'),
+                                                        (110, 1, '00:01:10'), (120, 1, '00:02:10')], start=1):
+            cache.handle_message({'type': 'match', 'product_id': 'BTC-USD', 'price': str(price), 'size': str(size),
+                                  'trade_id': trade_id, 'sequence': trade_id, 'time': f'2024-01-01T{time}Z'})
+        # Two bars are done (closes 102 and 110), the 120 bar is still open
+        self.assertEqual(indicators.get('BTC-USD', 'high'), 110)
+        self.assertAlmostEqual(indicators.get('BTC-USD', 'vwap'), (102 * 4 + 110) / 5)
+
+    def test_quiet_minutes_count_as_time(self):
+        indicators = RollingIndicators(window=4)
+        cache = MarketDataCache(indicators=indicators)
+        for trade_id, (price, time) in enumerate([(100, '00:00:05'), (110, '00:01:05'), (120, '00:05:05')], start=1):
+            cache.handle_message({'type': 'match', 'product_id': 'BTC-USD', 'price': str(price), 'size': '1',
+                                  'trade_id': trade_id, 'sequence': trade_id, 'time': f'2024-01-01T{time}Z'})
+        # Minutes 0 and 1 traded, 2-4 had nothing and carry 110 over, minute 5 is still open
+        self.assertAlmostEqual(indicators.get('BTC-USD', 'rolling_return'), 10.0)
+        self.assertEqual(indicators.get('BTC-USD', 'low'), 110)
+        self.assertEqual(indicators.get('BTC-USD', 'vwap'), 110)
+
+    def trade(self, cache, product_id, trade_id, price, epoch):
+        cache.handle_message({'type': 'match', 'product_id': product_id, 'price': str(price), 'size': '1',
+                              'trade_id': trade_id, 'sequence': trade_id,
+                              'time': datetime.fromtimestamp(epoch, timezone.utc).isoformat()})
+
+    def test_a_pump_that_went_quiet_stops_counting(self):
+        indicators = RollingIndicators(window=60)
+        cache = MarketDataCache(indicators=indicators)
+        start = 1_704_067_200  # midnight
+        for minute in range(62):
+            self.trade(cache, 'PUMP-USD', minute + 1, 100 + 0.25 * min(minute, 59), start + minute * 60 + 5)
+        self.assertAlmostEqual(indicators.get('PUMP-USD', 'rolling_return'), 14.75)
+
+        # Three hours without a trade, the candles are flat
+        cache.advance_indicators(start + 3 * 3600 + 62 * 60)
+        self.assertEqual(indicators.get('PUMP-USD', 'rolling_return'), 0.0)
+        flat = np.full((1, 12), 114.75)
+        matrix = MarketMatrix(['PUMP-USD'], np.arange(12) * 300, flat, flat, np.full(1, np.nan), np.full(1, np.nan),
+                              3600.0)
+        signal = default_engine(indicators=indicators).evaluate(matrix)
+        self.assertEqual(list(signal.met), [False])
+
+    def test_advancing_doesnt_count_a_minute_twice(self):
+        indicators = RollingIndicators(window=4)
+        cache = MarketDataCache(indicators=indicators)
+        start = 1_704_067_200
+        self.trade(cache, 'BTC-USD', 1, 100, start + 5)
+        self.trade(cache, 'BTC-USD', 2, 110, start + 65)
+        cache.advance_indicators(start + 210)  # minutes 1 and 2 are done
+        cache.advance_indicators(start + 215)  # nothing new
+        self.trade(cache, 'BTC-USD', 3, 120, start + 245)
+        self.trade(cache, 'BTC-USD', 4, 130, start + 305)
+        # 100, 110, 110, 110, 120: each minute once
+        self.assertAlmostEqual(indicators.get('BTC-USD', 'rolling_return'), 20.0)
+
+    def test_scan_engine_falls_back_to_candles(self):
+        indicators = RollingIndicators(window=2)
+        for price in (100, 105, 125):
+            indicators.update('BTC-USD', price)
+        # ETH has no full window, its 1h rule comes from the candles
+        matrix = MarketMatrix(['BTC-USD', 'ETH-USD'], np.array([0, 300]), np.array([[100.0, 100.0], [10.0, 10.0]]),
+                              np.array([[100.0, 100.0], [10.0, 12.5]]), np.full(2, np.nan), np.full(2, np.nan), 600.0)
+        signal = default_engine(indicators=indicators).evaluate(matrix)
+        self.assertEqual(signal.scores['increase_1h'].tolist(), [25.0, 25.0])
+        self.assertEqual(signal.scores['increase_2h'].tolist(), [0.0, 25.0])
+        self.assertEqual(list(signal.met), [True, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,239 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import datetime
+
+from journal import (
+    Journal,
+    BUY,
+    SELL,
+    FAILED,
+    FILLED,
+    INTENT,
+    SUBMITTED,
+    new_client_oid,
+    reconcile_pending,
+    restore_positions,
+)
+from portfolio import Portfolio
+from testutils import FakeClock
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'journal.db')
+        self.clock = FakeClock()
+        self.journal = Journal(self.path, flush_interval=5, clock=self.clock)
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.directory)
+
+    def reopen(self):
+        # What a restart sees, anything not committed is gone
+        self.journal._db.close()
+        self.journal = Journal(self.path, clock=self.clock)
+
+    def status(self, client_oid):
+        return self.journal._db.execute('SELECT status FROM orders WHERE client_oid = ?', (client_oid,)).fetchone()[0]
+
+    def buy(self, portfolio, product_id, price, amount):
+        client_oid = new_client_oid()
+        self.journal.record_intent(client_oid, product_id, BUY, funds='100')
+        self.journal.record_submitted(client_oid, 'order-' + client_oid)
+        portfolio.open(product_id, price, amount, datetime(2024, 1, 1))
+        self.journal.record_fill(client_oid, amount, price * amount, position=portfolio.get(product_id))
+        return client_oid
+
+    def test_positions_survive_a_restart(self):
+        portfolio = Portfolio()
+        client_oid = self.buy(portfolio, 'BTC-USD', 100.0, 2.0)
+        self.buy(portfolio, 'ETH-USD', 10.0, 5.0)
+        portfolio.tick({'BTC-USD': 104.0, 'ETH-USD': 10.2})
+        self.journal.update_positions(portfolio.positions())  # buffered, not written yet
+        self.clock.now += 5
+        portfolio.tick({'BTC-USD': 103.0})
+        self.journal.update_positions(portfolio.positions())  # flushes both ticks
+
+        self.reopen()
+        restored = Portfolio()
+        self.assertEqual(restore_positions(self.journal, restored), 2)
+        btc = restored.get('BTC-USD')
+        self.assertEqual((btc.purchase_price, btc.amount, btc.highest_price, btc.previous_price),
+                         (100.0, 2.0, 104.0, 103.0))
+        self.assertEqual(btc.purchase_time, datetime(2024, 1, 1))
+        self.assertEqual(self.status(client_oid), FILLED)
+        self.assertEqual(self.journal.pending_orders(), [])
+
+    def test_sell_removes_position_and_stale_updates_dont_bring_it_back(self):
+        portfolio = Portfolio()
+        self.buy(portfolio, 'BTC-USD', 100.0, 2.0)
+        self.journal.update_positions(portfolio.positions())
+        sell_oid = new_client_oid()
+        self.journal.record_intent(sell_oid, 'BTC-USD', SELL, size='2.0')
+        self.journal.record_fill(sell_oid, 2.0, 210.0, closed_product_id='BTC-USD')
+        self.journal.flush()
+        self.reopen()
+        self.assertEqual(self.journal.open_positions(), [])
+
+    def test_reconcile_orders_lost_in_a_crash(self):
+        portfolio = Portfolio()
+        self.buy(portfolio, 'SOL-USD', 20.0, 1.0)
+        never_sent, filled_buy, open_buy, filled_sell, cancelled = (new_client_oid() for _ in range(5))
+        self.journal.record_intent(never_sent, 'BTC-USD', BUY, funds='100')
+        self.journal.record_intent(filled_buy, 'ETH-USD', BUY, funds='100')
+        self.journal.record_intent(open_buy, 'ADA-USD', BUY, funds='100')
+        self.journal.record_intent(filled_sell, 'SOL-USD', SELL, size='1.0')
+        self.journal.record_intent(cancelled, 'XRP-USD', BUY, funds='100')
+        self.reopen()
+
+        orders = {
+            filled_buy: {'id': 'e1', 'status': 'done'},
+            open_buy: {'id': 'a1', 'status': 'pending'},
+            filled_sell: {'id': 's1', 'status': 'done'},
+            cancelled: {'id': 'x1', 'status': 'done'},
+        }
+        fills = {
+            'e1': [{'size': '1.0', 'price': '10.0'}, {'size': '3.0', 'price': '12.0'}],
+            's1': [{'size': '1.0', 'price': '25.0'}],
+            'x1': [],
+        }
+        restored = Portfolio()
+        restore_positions(self.journal, restored)
+        summary = reconcile_pending(self.journal, restored, orders.get, fills.__getitem__)
+
+        self.assertEqual(summary, {'filled': 2, 'failed': 2, 'pending': 1})
+        self.assertEqual(restored.product_ids(), ['ETH-USD'])
+        eth = restored.get('ETH-USD')
+        self.assertEqual((eth.amount, eth.purchase_price), (4.0, 11.5))
+        self.assertEqual(self.status(never_sent), FAILED)
+        self.assertEqual(self.status(cancelled), FAILED)
+        self.assertEqual(self.status(open_buy), SUBMITTED)
+        self.assertEqual([o['client_oid'] for o in self.journal.pending_orders()], [open_buy])
+
+        # A restart after reconciling ends up in the same place
+        self.reopen()
+        again = Portfolio()
+        restore_positions(self.journal, again)
+        self.assertEqual(again.product_ids(), ['ETH-USD'])
+
+    def test_a_sell_that_never_fills_gives_the_position_back(self):
+        portfolio = Portfolio()
+        self.buy(portfolio, 'BTC-USD', 100.0, 2.0)
+        self.buy(portfolio, 'ETH-USD', 10.0, 5.0)
+        portfolio.tick({'BTC-USD': 120.0, 'ETH-USD': 11.0})
+        self.clock.now += 5
+        self.journal.update_positions(portfolio.positions())
+        cancelled, lost = new_client_oid(), new_client_oid()
+        for client_oid, product_id in ((cancelled, 'BTC-USD'), (lost, 'ETH-USD')):
+            self.journal.record_intent(client_oid, product_id, SELL, size='1.0')
+            # Accepted, out of the tick until the fill shows up
+            portfolio.close(product_id)
+        self.journal.record_submitted(cancelled, 'c1')
+
+        summary = reconcile_pending(self.journal, portfolio, {cancelled: {'id': 'c1', 'status': 'done'}}.get,
+                                    {'c1': []}.__getitem__)
+        self.assertEqual(summary, {'filled': 0, 'failed': 2, 'pending': 0})
+        self.assertEqual(sorted(portfolio.product_ids()), ['BTC-USD', 'ETH-USD'])
+        btc = portfolio.get('BTC-USD')
+        self.assertEqual((btc.amount, btc.purchase_price, btc.highest_price), (2.0, 100.0, 120.0))
+
+    def test_one_order_list_answers_every_order_on_it(self):
+        portfolio = Portfolio()
+        listed, unlisted = new_client_oid(), new_client_oid()
+        self.journal.record_intent(listed, 'BTC-USD', BUY, funds='100')
+        self.journal.record_submitted(listed, 'b1')
+        self.journal.record_intent(unlisted, 'ETH-USD', BUY, funds='100')
+        self.journal.record_submitted(unlisted, 'e1')
+        recent = [{'id': 'b1', 'status': 'done', 'filled_size': '2.0', 'executed_value': '100', 'fill_fees': '0.5'}]
+        looked_up = []
+
+        def fetch_order(client_oid):
+            looked_up.append(client_oid)
+            return {'id': 'e1', 'status': 'pending'}
+
+        filled = []
+        summary = reconcile_pending(self.journal, portfolio, fetch_order, None, fetch_recent=lambda: recent,
+                                    on_fill=lambda order, remote, *totals: filled.append(totals))
+        self.assertEqual(summary, {'filled': 1, 'failed': 0, 'pending': 1})
+        self.assertEqual(looked_up, [unlisted])
+        self.assertEqual(filled, [(2.0, 100.0, 0.5)])
+        self.assertEqual(portfolio.get('BTC-USD').purchase_price, 50.0)
+
+        # The list being unavailable only means one lookup per order
+        def broken():
+            raise ConnectionError('reset')
+
+        summary = reconcile_pending(self.journal, portfolio, fetch_order, None, fetch_recent=broken)
+        self.assertEqual(summary, {'filled': 0, 'failed': 0, 'pending': 1})
+        self.assertEqual(looked_up, [unlisted, unlisted])
+
+    def test_lookup_errors_leave_orders_pending(self):
+        client_oid = new_client_oid()
+        self.journal.record_intent(client_oid, 'BTC-USD', BUY, funds='100')
+
+        def unreachable(client_oid):
+            raise ConnectionError('exchange down')
+
+        summary = reconcile_pending(self.journal, Portfolio(), unreachable, None)
+        self.assertEqual(summary['pending'], 1)
+        self.assertEqual(len(self.journal.pending_orders()), 1)
+
+    def test_orders_still_being_sent_are_skipped(self):
+        client_oid = new_client_oid()
+        self.journal.record_intent(client_oid, 'BTC-USD', BUY, funds='100')
+        # Not at the exchange yet, a lookup would say it never got there
+        summary = reconcile_pending(self.journal, Portfolio(), lambda client_oid: None, None, skip={client_oid})
+        self.assertEqual(summary, {'filled': 0, 'failed': 0, 'pending': 1})
+        self.assertEqual(self.status(client_oid), INTENT)
+
+    def test_an_order_settled_by_its_sender_during_reconcile_is_applied_once(self):
+        portfolio = Portfolio()
+        client_oid = new_client_oid()
+        self.journal.record_intent(client_oid, 'BTC-USD', BUY, funds='100')
+        self.journal.record_submitted(client_oid, 'e1')
+        # Another order is what makes the order list worth fetching
+        self.journal.record_intent(new_client_oid(), 'ETH-USD', BUY, funds='100')
+        in_flight = {client_oid}
+        remote = {'id': 'e1', 'client_oid': client_oid, 'status': 'done', 'filled_size': '1.0',
+                  'executed_value': '100.0'}
+
+        def fetch_recent():
+            # The pipeline worker sees the fill and lets go of the order while the list is on its way
+            portfolio.open('BTC-USD', 100.0, 1.0)
+            self.journal.record_fill(client_oid, 1.0, 100.0, position=portfolio.get('BTC-USD'))
+            in_flight.discard(client_oid)
+            return [remote]
+
+        summary = reconcile_pending(self.journal, portfolio, lambda client_oid: None, None, skip=in_flight,
+                                    fetch_recent=fetch_recent)
+        self.assertEqual(summary, {'filled': 0, 'failed': 1, 'pending': 0})
+        self.assertEqual(portfolio.get('BTC-USD').amount, 1.0)
+        self.assertEqual(self.journal.open_position('BTC-USD')['amount'], 1.0)
+
+    def test_settled_orders_stay_settled(self):
+        portfolio = Portfolio()
+        client_oid = self.buy(portfolio, 'BTC-USD', 100.0, 1.0)
+        self.assertFalse(self.journal.record_fill(client_oid, 1.0, 100.0, position=portfolio.get('BTC-USD')))
+        self.assertFalse(self.journal.record_failed(client_oid))
+        self.journal.record_submitted(client_oid, 'late')
+        self.assertEqual(self.status(client_oid), FILLED)
+
+    def test_recovery_is_fast(self):
+        portfolio = Portfolio()
+        for i in range(500):
+            self.buy(portfolio, f'P{i}-USD', 100.0, 1.0)
+        self.reopen()
+        started = time.perf_counter()
+        restored = Portfolio()
+        restore_positions(self.journal, restored)
+        self.assertEqual(len(restored), 500)
+        self.assertLess(time.perf_counter() - started, 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import unittest
+
+import websockets
+
+from market_feed import MarketDataCache, MarketFeed
+
+
+def ticker(product_id, price, sequence, time='2024-01-01T00:00:01.000000Z'):
+    return {'type': 'ticker', 'product_id': product_id, 'price': str(price), 'sequence': sequence,
+            'best_bid': str(price - 1), 'best_ask': str(price + 1), 'time': time}
+
+
+def match(product_id, price, size, trade_id, sequence, time):
+    return {'type': 'match', 'product_id': product_id, 'price': str(price), 'size': str(size),
+            'trade_id': trade_id, 'sequence': sequence, 'time': time}
+
+
+class TestMarketDataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = MarketDataCache()
+
+    def test_ticker_and_stale_sequence(self):
+        self.cache.handle_message(ticker('BTC-USD', 100.0, sequence=10))
+        self.cache.handle_message(ticker('BTC-USD', 90.0, sequence=9))  # arrived late, dropped
+        self.assertEqual(self.cache.last_price('BTC-USD'), 100.0)
+        self.assertEqual(self.cache.best_bid_ask('BTC-USD'), (99.0, 101.0))
+        self.assertIsNone(self.cache.last_price('ETH-USD'))
+
+    def test_max_age(self):
+        now = [0.0]
+        cache = MarketDataCache(clock=lambda: now[0])
+        cache.handle_message(ticker('BTC-USD', 100.0, sequence=1))
+        now[0] = 10.0
+        self.assertEqual(cache.last_price('BTC-USD', max_age=20), 100.0)
+        self.assertIsNone(cache.last_price('BTC-USD', max_age=5))
+
+    def test_matches_build_rolling_bars(self):
+        self.cache.handle_message(match('BTC-USD', 100, 1, 1, 1, '2024-01-01T00:00:05Z'))
+        self.cache.handle_message(match('BTC-USD', 105, 2, 2, 2, '2024-01-01T00:00:30Z'))
+        self.cache.handle_message(match('BTC-USD', 95, 1, 3, 3, '2024-01-01T00:01:10Z'))
+        self.cache.handle_message(match('BTC-USD', 98, 1, 4, 4, '2024-01-01T00:01:20Z'))
+
+        self.assertEqual(self.cache.ohlcv('BTC-USD'), (100.0, 105.0, 95.0, 98.0, 5.0))
+        self.assertEqual(self.cache.ohlcv('BTC-USD', seconds=60), (95.0, 98.0, 95.0, 98.0, 2.0))
+        self.assertEqual(self.cache.last_price('BTC-USD'), 98.0)
+
+    def test_trade_gap_asks_for_resync(self):
+        self.cache.handle_message(match('BTC-USD', 100, 1, 1, 1, '2024-01-01T00:00:05Z'))
+        self.cache.handle_message(match('BTC-USD', 100, 1, 5, 9, '2024-01-01T00:00:06Z'))
+        self.assertEqual(self.cache.resync_needed, {'BTC-USD'})
+        self.cache.handle_message({'type': 'snapshot', 'product_id': 'BTC-USD', 'bids': [], 'asks': []})
+        self.assertEqual(self.cache.resync_needed, set())
+
+    def test_resync_starts_the_trade_ids_over(self):
+        self.cache.handle_message(match('BTC-USD', 100, 1, 1, 1, '2024-01-01T00:00:05Z'))
+        self.cache.handle_message(match('BTC-USD', 100, 1, 5, 9, '2024-01-01T00:00:06Z'))
+        self.cache.resync_needed.clear()
+        self.cache.start_resync({'BTC-USD'})
+        # Trades missed while resubscribing aren't another gap
+        self.cache.handle_message(match('BTC-USD', 100, 1, 50, 90, '2024-01-01T00:00:09Z'))
+        self.assertEqual(self.cache.resync_needed, set())
+        self.cache.handle_message(match('BTC-USD', 100, 1, 52, 92, '2024-01-01T00:00:10Z'))
+        self.assertEqual(self.cache.resync_needed, {'BTC-USD'})
+
+    def test_level2_book(self):
+        self.cache.handle_message({'type': 'l2update', 'product_id': 'BTC-USD', 'changes': [['buy', '1', '1']]})
+        self.assertEqual(self.cache.best_bid_ask('BTC-USD'), (None, None))  # no snapshot yet
+
+        self.cache.handle_message({'type': 'snapshot', 'product_id': 'BTC-USD',
+                                   'bids': [['99', '1'], ['98', '2']], 'asks': [['101', '1'], ['102', '3']]})
+        self.cache.handle_message({'type': 'l2update', 'product_id': 'BTC-USD',
+                                   'changes': [['buy', '99', '0'], ['sell', '100.5', '1']]})
+        self.assertEqual(self.cache.best_bid_ask('BTC-USD'), (98.0, 100.5))
+
+        self.cache.handle_message({'type': 'l2update', 'product_id': 'BTC-USD',
+                                   'changes': [['buy', '98', '5'], ['buy', '97', '1'], ['sell', '100.5', '0'],
+                                               ['sell', '100.7', '0']]})
+        self.assertEqual(self.cache.best_bid_ask('BTC-USD'), (98.0, 101.0))
+        self.cache.handle_message({'type': 'l2update', 'product_id': 'BTC-USD',
+                                   'changes': [['buy', '98', '0'], ['sell', '101', '0'], ['sell', '102', '0']]})
+        self.assertEqual(self.cache.best_bid_ask('BTC-USD'), (97.0, None))
+
+
+class ReplayServer:
+    """
+    Local websocket server that replays one list of messages per connection.
+    """
+
+    def __init__(self, sessions):
+        self.sessions = list(sessions)
+        self.subscriptions = []
+        self.server = None
+
+    async def handler(self, ws):
+        self.subscriptions.append(json.loads(await ws.recv()))
+        messages = self.sessions.pop(0) if self.sessions else []
+        for message in messages:
+            await ws.send(json.dumps(message))
+        if self.sessions:
+            return  # drop the connection so the client has to reconnect
+        await ws.wait_closed()
+
+    async def start(self):
+        self.server = await websockets.serve(self.handler, 'localhost', 0)
+        return f"ws://localhost:{self.server.sockets[0].getsockname()[1]}"
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+class TestMarketFeed(unittest.IsolatedAsyncioTestCase):
+
+    async def wait_for(self, condition, timeout=5):
+        for _ in range(int(timeout / 0.01)):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        self.fail('condition never became true')
+
+    async def test_replay_and_reconnect(self):
+        replay = ReplayServer([
+            [ticker('BTC-USD', 100.0, 1), ticker('ETH-USD', 10.0, 1)],
+            [ticker('BTC-USD', 110.0, 2)],
+        ])
+        url = await replay.start()
+        cache = MarketDataCache()
+        feed = MarketFeed(cache, ['BTC-USD', 'ETH-USD'], url=url, reconnect_delay=0.01)
+        task = asyncio.create_task(feed.run())
+        try:
+            await self.wait_for(lambda: cache.last_price('BTC-USD') == 110.0)
+            self.assertEqual(feed.connections, 2)
+            self.assertEqual(cache.last_price('ETH-USD'), 10.0)
+            # Every connection subscribes again to everything
+            self.assertEqual(replay.subscriptions[1]['product_ids'], ['BTC-USD', 'ETH-USD'])
+        finally:
+            feed._stopping = True
+            task.cancel()
+            await replay.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import threading
+import unittest
+import urllib.request
+
+from metrics import MetricsRegistry, MetricsServer
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter_labels_and_totals(self):
+        lookups = self.registry.counter('price_cache_lookups_total', 'lookups')
+        self.assertIs(self.registry.counter('price_cache_lookups_total'), lookups)
+        for _ in range(3):
+            lookups.inc(result='hit')
+        lookups.inc(result='miss')
+        self.assertEqual(lookups.value(result='hit'), 3)
+        self.assertEqual(lookups.total(), 4)
+        self.assertEqual(self.registry.hit_ratio('price_cache_lookups_total'), 0.75)
+        with self.assertRaises(ValueError):
+            self.registry.histogram('price_cache_lookups_total')
+
+    def test_histogram_percentiles(self):
+        latency = self.registry.histogram('rest_request_seconds', 'latency', buckets=(0.01, 0.1, 1))
+        for i in range(1, 101):
+            latency.observe(i / 1000, method='GET', endpoint='/products')
+        latency.observe(5.0, method='POST', endpoint='/orders')
+
+        stats = latency.stats(method='GET', endpoint='/products')
+        self.assertEqual(stats['count'], 100)
+        self.assertAlmostEqual(stats['p50'], 0.050)
+        self.assertAlmostEqual(stats['p99'], 0.099)
+        self.assertAlmostEqual(stats['max'], 0.1)
+        self.assertEqual(latency.merged_stats()['count'], 101)
+        self.assertIsNone(latency.stats(method='GET', endpoint='/nothing'))
+
+    def test_timer(self):
+        signing = self.registry.histogram('signing_seconds')
+        with signing.time():
+            pass
+        self.assertEqual(signing.stats()['count'], 1)
+
+    def test_prometheus_text(self):
+        latency = self.registry.histogram('rest_request_seconds', 'REST latency', buckets=(0.1, 1))
+        latency.observe(0.05, endpoint='/products/{id}/ticker')
+        latency.observe(0.5, endpoint='/products/{id}/ticker')
+        latency.observe(3, endpoint='/products/{id}/ticker')
+        self.registry.counter('orders_total', 'Orders').inc(side='buy', result='filled')
+
+        text = self.registry.render()
+        self.assertIn('# TYPE rest_request_seconds histogram', text)
+        self.assertIn('rest_request_seconds_bucket{endpoint="/products/{id}/ticker",le="0.1"} 1', text)
+        self.assertIn('rest_request_seconds_bucket{endpoint="/products/{id}/ticker",le="1"} 2', text)
+        self.assertIn('rest_request_seconds_bucket{endpoint="/products/{id}/ticker",le="+Inf"} 3', text)
+        self.assertIn('rest_request_seconds_count{endpoint="/products/{id}/ticker"} 3', text)
+        self.assertIn('orders_total{result="filled",side="buy"} 1', text)
+
+    def test_summary_line(self):
+        self.assertEqual(self.registry.summary(), 'no metrics yet')
+        self.registry.histogram('scan_seconds').observe(0.002)
+        self.registry.histogram('scheduler_job_seconds').observe(0.001, job='positions')
+        self.registry.histogram('rest_request_seconds').observe(0.1, method='GET', endpoint='/products')
+        self.registry.histogram('rate_limit_wait_seconds').observe(0.25, endpoint_class='public')
+        self.registry.counter('candle_cache_lookups_total').inc(result='hit')
+        summary = self.registry.summary()
+        self.assertIn('scan n=1 p50=2.00ms', summary)
+        self.assertIn('positions n=1 p99=1.00ms', summary)
+        self.assertIn('GET /products n=1', summary)
+        self.assertIn('rate limit wait 0.25s', summary)
+        self.assertIn('candle cache hit 100%', summary)
+
+    def test_concurrent_observations(self):
+        latency = self.registry.histogram('scheduler_job_seconds')
+
+        def observe():
+            for _ in range(1000):
+                latency.observe(0.001)
+
+        threads = [threading.Thread(target=observe) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(latency.stats()['count'], 8000)
+
+    def test_http_endpoint(self):
+        self.registry.counter('orders_total').inc(side='sell', result='rejected')
+        server = MetricsServer(self.registry, port=0).start()
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{server.port}/metrics') as response:
+                body = response.read().decode()
+            self.assertIn('orders_total{result="rejected",side="sell"} 1', body)
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(f'http://127.0.0.1:{server.port}/other')
+        finally:
+            server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
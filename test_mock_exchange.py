@@ -0,0 +1,150 @@
+import base64
+import json
+import time
+import unittest
+from datetime import datetime, timezone
+
+import requests
+
+from exchange_client import ExchangeClient
+from market_feed import MarketDataCache, MarketFeed
+from metrics import MetricsRegistry
+from mock_exchange import MockExchange, PricePath
+from rate_limit import RateLimiter
+from signing import RequestSigner
+
+
+class TestPricePath(unittest.TestCase):
+
+    def test_same_seed_same_prices(self):
+        a = PricePath(7, 100.0, 1_700_000_000)
+        b = PricePath(7, 100.0, 1_700_000_000)
+        self.assertEqual(a.price_at(1_700_000_000 + 7200), b.price_at(1_700_000_000 + 7200))
+        self.assertAlmostEqual(a.price_at(1_700_000_000), 100.0)
+
+    def test_candles_are_consistent(self):
+        path = PricePath(1, 100.0, 1_700_000_000 - 1_700_000_000 % 300)
+        now = path.start_time + 3600 + 42
+        rows = path.candles(path.start_time, now, 300, now)
+        self.assertEqual(len(rows), 13)  # 12 closed buckets and the open one
+        self.assertGreater(rows[0][0], rows[-1][0])  # newest first
+        for bucket, low, high, open_, close, volume in rows:
+            self.assertLessEqual(low, min(open_, close))
+            self.assertGreaterEqual(high, max(open_, close))
+        self.assertEqual(rows, path.candles(path.start_time, now, 300, now))
+
+
+class TestMockExchange(unittest.TestCase):
+
+    def setUp(self):
+        self.exchange = MockExchange(product_count=3, seed=1, tick_interval=0.02).start()
+        self.signer = RequestSigner('key', self.exchange.api_secret, 'passphrase')
+        self.client = ExchangeClient(self.exchange.url, headers_fn=self.signer.headers, registry=MetricsRegistry())
+
+    def tearDown(self):
+        self.client.close()
+        self.exchange.stop()
+
+    def test_products_with_etag(self):
+        response = self.client.get('/products')
+        self.assertEqual([product['id'] for product in response.json()], ['C000-USD', 'C001-USD', 'C002-USD'])
+        etag = response.headers['ETag']
+        self.assertEqual(self.client.get('/products', headers={'If-None-Match': etag}).status_code, 304)
+
+    def test_ticker_and_candles(self):
+        price = float(self.client.get('/products/C000-USD/ticker').json()['price'])
+        self.assertGreater(price, 0)
+        end = datetime.now(timezone.utc)
+        start = datetime.fromtimestamp(end.timestamp() - 7200, timezone.utc)
+        params = {'start': start.isoformat(), 'end': end.isoformat(), 'granularity': '300'}
+        rows = self.client.get('/products/C000-USD/candles', params=params).json()
+        self.assertIn(len(rows), (24, 25))
+        params['granularity'] = '60'
+        params['start'] = datetime.fromtimestamp(end.timestamp() - 86400, timezone.utc).isoformat()
+        self.assertEqual(self.client.get('/products/C000-USD/candles', params=params).status_code, 400)
+        self.assertEqual(self.client.get('/products/NOPE-USD/ticker').status_code, 404)
+
+    def test_bulk_stats(self):
+        stats = self.client.get('/products/stats').json()
+        self.assertEqual(sorted(stats), ['C000-USD', 'C001-USD', 'C002-USD'])
+        last = float(stats['C001-USD']['stats_24hour']['last'])
+        price = float(self.client.get('/products/C001-USD/ticker').json()['price'])
+        self.assertAlmostEqual(last, price, delta=price * 0.01)
+        self.exchange.bulk_stats = False
+        self.assertEqual(self.client.get('/products/stats').status_code, 404)
+
+    def test_market_orders_fill_and_can_be_looked_up(self):
+        body = json.dumps({'type': 'market', 'side': 'buy', 'product_id': 'C001-USD', 'funds': '100',
+                           'client_oid': 'oid-1'})
+        order = self.client.post('/orders', body).json()
+        self.assertEqual(order['status'], 'done')
+        self.assertAlmostEqual(float(order['executed_value']) + float(order['fill_fees']), 100, delta=0.01)
+        self.assertEqual(self.client.get('/orders/client:oid-1').json()['id'], order['id'])
+        listed = self.client.get('/orders', params={'status': 'all', 'limit': 10}).json()
+        self.assertEqual([o['id'] for o in listed], [order['id']])
+        fills = self.client.get('/fills', params={'order_id': order['id']}).json()
+        self.assertEqual(fills[0]['size'], order['filled_size'])
+        # Same client_oid twice is refused, a missing side too
+        self.assertEqual(self.client.post('/orders', body).status_code, 400)
+        self.assertEqual(self.client.post('/orders', json.dumps({'type': 'market', 'product_id': 'C001-USD',
+                                                                 'funds': '100'})).status_code, 400)
+
+    def test_unsigned_orders_are_refused(self):
+        response = requests.post(self.exchange.url + '/orders', data='{}')
+        self.assertEqual(response.status_code, 401)
+
+    def test_signatures_are_checked(self):
+        # Signed with another secret
+        signer = RequestSigner('key', base64.b64encode(b'wrong' * 8).decode(), 'passphrase')
+        client = ExchangeClient(self.exchange.url, headers_fn=signer.headers, registry=MetricsRegistry())
+        self.addCleanup(client.close)
+        self.assertEqual(client.get('/fills', params={'order_id': 'x'}).status_code, 401)
+        # The query string is part of what gets signed
+        headers = self.signer.headers('/fills', 'GET')
+        response = requests.get(self.exchange.url + '/fills', params={'order_id': 'x'}, headers=headers)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.client.get('/fills', params={'order_id': 'x'}).json(), [])
+
+    def test_injected_429s_and_rate_limit(self):
+        self.exchange.error_rate = 1.0
+        response = requests.get(self.exchange.url + '/time')
+        self.assertEqual((response.status_code, response.headers['Retry-After']), (429, '1'))
+        self.exchange.error_rate = 0.0
+        self.exchange.rate_limit = 3
+        statuses = [requests.get(self.exchange.url + '/time').status_code for _ in range(5)]
+        self.assertIn(429, statuses)
+        self.assertEqual(self.exchange.requests[('/time', 429)], statuses.count(429) + 1)
+
+    def test_client_backs_off_on_429s(self):
+        self.exchange.error_rate = 0.5
+        client = ExchangeClient(self.exchange.url, rate_limiter=RateLimiter(), get_retries=10, registry=MetricsRegistry())
+        try:
+            self.assertEqual(client.get('/products/C000-USD/ticker').status_code, 200)
+        finally:
+            client.close()
+
+    def test_latency(self):
+        self.exchange.latency = 0.05
+        started = time.perf_counter()
+        self.client.get('/time')
+        self.assertGreaterEqual(time.perf_counter() - started, 0.05)
+
+    def test_websocket_feed(self):
+        cache = MarketDataCache()
+        feed = MarketFeed(cache, ['C000-USD', 'C002-USD'], url=self.exchange.ws_url)
+        feed.start()
+        try:
+            for _ in range(300):
+                if cache.last_price('C000-USD') and cache.last_price('C002-USD') and cache.best_bid_ask('C002-USD')[0]:
+                    break
+                time.sleep(0.01)
+            self.assertIsNotNone(cache.last_price('C000-USD'))
+            bid, ask = cache.best_bid_ask('C002-USD')
+            self.assertLess(bid, ask)
+            self.assertIsNone(cache.last_price('C001-USD'))
+        finally:
+            feed.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from backtest import StrategyParams, run_backtest
+from optimize import format_table, load_packed, pack_series, param_grid, sweep
+from test_backtest import GRANULARITY, pump_then_dump, series_from_closes
+
+
+class TestOptimize(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.series = {'BTC-USD': pump_then_dump(), 'ETH-USD': series_from_closes('ETH-USD', [50.0] * 120)}
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_param_grid(self):
+        grid = param_grid(increase_2h=[5, 10], take_profit=[20, 25, 30])
+        self.assertEqual(len(grid), 6)
+        self.assertIn(StrategyParams(increase_2h=5, take_profit=30), grid)
+
+    def test_packed_series_round_trip(self):
+        pack_series(self.series, self.tmp.name)
+        loaded = load_packed(self.tmp.name)
+        self.assertEqual(sorted(loaded), ['BTC-USD', 'ETH-USD'])
+        np.testing.assert_array_equal(loaded['BTC-USD'].closes, self.series['BTC-USD'].closes)
+        self.assertIsInstance(loaded['BTC-USD'].closes, np.memmap)
+
+    def test_sweep_ranks_and_caches(self):
+        # Thresholds above the 15% pump mean no trade at all
+        grid = param_grid(increase_2h=[10, 50], increase_1h=[10, 50], increase_since_last_check=[50], fee_rate=[0.0])
+        rows = sweep(self.series, GRANULARITY, grid, workers=2, cache_dir=self.tmp.name)
+
+        self.assertEqual(len(rows), 4)
+        self.assertEqual([row['return_pct'] for row in rows], sorted((row['return_pct'] for row in rows), reverse=True))
+        self.assertFalse(any(row['cached'] for row in rows))
+        no_trades = [row for row in rows if row['increase_2h'] == 50 and row['increase_1h'] == 50][0]
+        self.assertEqual(no_trades['trades'], 0)
+
+        expected = run_backtest(self.series, GRANULARITY, grid[0]).return_pct
+        self.assertAlmostEqual([row for row in rows if row['increase_2h'] == 10 and row['increase_1h'] == 10][0]
+                               ['return_pct'], expected)
+
+        # Second run with one new parameter set only runs that one
+        grid.append(StrategyParams(increase_2h=12, fee_rate=0.0))
+        rows = sweep(self.series, GRANULARITY, grid, workers=2, cache_dir=self.tmp.name)
+        self.assertEqual(sum(1 for row in rows if not row['cached']), 1)
+
+        table = format_table(rows, ['increase_2h', 'return_pct'], limit=3)
+        self.assertEqual(len(table.splitlines()), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import threading
+import unittest
+
+from orders import OrderPipeline, OrderRejected, market_order
+from product_cache import ProductInfo
+
+PRODUCT = ProductInfo({
+    'id': 'BTC-USD', 'base_increment': '0.00000001', 'quote_increment': '0.01', 'base_min_size': '0.0001',
+    'base_max_size': '100', 'min_market_funds': '10', 'max_market_funds': '1000000', 'status': 'online',
+})
+
+
+class TestMarketOrder(unittest.TestCase):
+
+    def test_rounds_down_to_the_increments(self):
+        buy = market_order('BTC-USD', 'buy', PRODUCT, funds='100.129', client_oid='oid')
+        self.assertEqual(buy, {'type': 'market', 'side': 'buy', 'product_id': 'BTC-USD', 'client_oid': 'oid',
+                               'funds': '100.12'})
+        sell = market_order('BTC-USD', 'sell', PRODUCT, size=0.0036710400000000003)
+        self.assertEqual(sell['size'], '0.00367104')
+        self.assertTrue(sell['client_oid'])
+
+    def test_limits(self):
+        with self.assertRaises(OrderRejected):
+            market_order('BTC-USD', 'buy', PRODUCT, funds='9.99')
+        with self.assertRaises(OrderRejected):
+            market_order('BTC-USD', 'sell', PRODUCT, size='0.00009')
+        with self.assertRaises(OrderRejected):
+            market_order('BTC-USD', 'sell', PRODUCT, size='101')
+        with self.assertRaises(OrderRejected):
+            market_order('BTC-USD', 'buy', PRODUCT, funds='FIAT_AMOUNT_TO_SPEND')
+        with self.assertRaises(OrderRejected):
+            market_order('BTC-USD', 'buy', PRODUCT, funds='100', size='1')
+        disabled = ProductInfo({'id': 'BTC-USD', 'trading_disabled': True})
+        with self.assertRaises(OrderRejected):
+            market_order('BTC-USD', 'buy', disabled, funds='100')
+
+    def test_no_product_info_leaves_the_checks_to_the_exchange(self):
+        self.assertEqual(market_order('NEW-USD', 'buy', None, funds='100.129')['funds'], '100.129')
+        with self.assertRaises(OrderRejected):
+            market_order('NEW-USD', 'buy', None, funds='0')
+
+
+class TestOrderPipeline(unittest.TestCase):
+
+    def test_submit_returns_before_the_order_is_sent(self):
+        release = threading.Event()
+        recorded, sent = [], []
+
+        def send(body):
+            release.wait(5)
+            sent.append(body['client_oid'])
+
+        pipeline = OrderPipeline(send, record_fn=lambda body: recorded.append(body['client_oid']), workers=1)
+        self.addCleanup(pipeline.close)
+        pipeline.submit({'client_oid': 'a', 'side': 'buy', 'product_id': 'BTC-USD'})
+        pipeline.submit({'client_oid': 'b', 'side': 'buy', 'product_id': 'ETH-USD'})
+
+        # Journaled right away, still in flight until sent
+        self.assertEqual(recorded, ['a', 'b'])
+        self.assertEqual(sent, [])
+        self.assertIn('a', pipeline)
+        self.assertEqual(len(pipeline), 2)
+
+        release.set()
+        pipeline.join()
+        self.assertEqual(sent, ['a', 'b'])
+        self.assertNotIn('a', pipeline)
+        self.assertEqual(len(pipeline), 0)
+
+    def test_send_errors_dont_stop_the_workers(self):
+        sent = []
+
+        def send(body):
+            if body['client_oid'] == 'bad':
+                raise ConnectionError('reset')
+            sent.append(body['client_oid'])
+
+        pipeline = OrderPipeline(send, workers=1)
+        self.addCleanup(pipeline.close)
+        for client_oid in ('bad', 'good'):
+            pipeline.submit({'client_oid': client_oid, 'side': 'buy', 'product_id': 'BTC-USD'})
+        pipeline.join()
+        self.assertEqual(sent, ['good'])
+        self.assertEqual(len(pipeline), 0)
+
+    def test_orders_sent_right_away_are_in_flight_too(self):
+        pipeline = OrderPipeline(lambda body: body['client_oid'] in pipeline, record_fn=lambda body: None)
+        self.addCleanup(pipeline.close)
+        # send_fn sees its own order in flight, the fill tracker would too
+        self.assertTrue(pipeline.send({'client_oid': 'a', 'side': 'sell', 'product_id': 'BTC-USD'}))
+        self.assertNotIn('a', pipeline)
+
+        def broken(body):
+            raise ConnectionError('reset')
+
+        pipeline.send_fn = broken
+        with self.assertRaises(ConnectionError):
+            pipeline.send({'client_oid': 'b', 'side': 'sell', 'product_id': 'BTC-USD'})
+        self.assertEqual(len(pipeline), 0)
+
+    def test_nothing_is_queued_if_the_intent_cant_be_recorded(self):
+        sent = []
+
+        def record(body):
+            raise OSError('disk full')
+
+        pipeline = OrderPipeline(sent.append, record_fn=record)
+        self.addCleanup(pipeline.close)
+        with self.assertRaises(OSError):
+            pipeline.submit({'client_oid': 'a', 'side': 'buy', 'product_id': 'BTC-USD'})
+        pipeline.join()
+        self.assertEqual((sent, len(pipeline)), ([], 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
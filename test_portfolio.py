@@ -0,0 +1,100 @@
+import threading
+import unittest
+
+import numpy as np
+
+from portfolio import Portfolio, DROP_FROM_PREVIOUS, DROP_FROM_HIGHEST, TAKE_PROFIT
+
+
+class TestPortfolio(unittest.TestCase):
+
+    def setUp(self):
+        self.portfolio = Portfolio(capacity=2)
+
+    def test_open_close_and_slot_reuse(self):
+        for i, product_id in enumerate(['A-USD', 'B-USD', 'C-USD', 'D-USD', 'E-USD']):
+            self.portfolio.open(product_id, 100.0 + i, 1.0 + i)
+        self.assertEqual(len(self.portfolio), 5)
+
+        closed = self.portfolio.close('B-USD')
+        self.assertEqual((closed.product_id, closed.purchase_price, closed.amount), ('B-USD', 101.0, 2.0))
+        self.assertIsNone(self.portfolio.close('B-USD'))
+        # E-USD moved into B-USD's slot and kept its own numbers
+        self.assertEqual(self.portfolio.product_ids(), ['A-USD', 'E-USD', 'C-USD', 'D-USD'])
+        self.assertEqual(self.portfolio.get('E-USD').purchase_price, 104.0)
+        self.assertNotIn('B-USD', self.portfolio)
+
+    def test_buying_more_averages_in(self):
+        self.portfolio.open('A-USD', 100.0, 1.0)
+        self.portfolio.open('A-USD', 130.0, 2.0)
+        position = self.portfolio.get('A-USD')
+        self.assertEqual(position.amount, 3.0)
+        self.assertAlmostEqual(position.purchase_price, 120.0)
+
+    def test_tick_matches_single_position_rules(self):
+        self.portfolio.open('A-USD', 100.0, 1.0)
+        self.portfolio.open('B-USD', 100.0, 1.0)
+        self.portfolio.open('C-USD', 100.0, 1.0)
+        self.portfolio.open('D-USD', 100.0, 1.0)
+
+        self.assertEqual(self.portfolio.tick({'A-USD': 110.0, 'B-USD': 104.0, 'C-USD': 110.0, 'D-USD': 101.0}), [])
+        sells = self.portfolio.tick({'A-USD': 103.0, 'B-USD': 105.0, 'C-USD': 126.0, 'D-USD': None})
+        self.assertEqual([(s.product_id, s.reason) for s in sells], [('A-USD', DROP_FROM_PREVIOUS), ('C-USD', TAKE_PROFIT)])
+
+        # Slow slide: never 5% below the previous price but more than 5% below the high
+        for price in (106.0, 103.0, 100.5):
+            sells = self.portfolio.tick({'B-USD': price})
+        self.assertEqual([(s.product_id, s.reason) for s in sells], [('B-USD', DROP_FROM_HIGHEST)])
+
+        d = self.portfolio.get('D-USD')
+        self.assertEqual((d.highest_price, d.previous_price), (101.0, 101.0))  # a missing price changes nothing
+
+    def test_first_tick_compares_to_purchase_price(self):
+        self.portfolio.open('A-USD', 100.0, 1.0)
+        sells = self.portfolio.tick(np.array([94.0]))
+        self.assertEqual(sells[0].reason, DROP_FROM_PREVIOUS)
+
+    def test_pnl(self):
+        self.portfolio.open('A-USD', 100.0, 2.0)
+        self.portfolio.open('B-USD', 50.0, 4.0)
+        self.portfolio.tick({'A-USD': 102.0, 'B-USD': 49.0})
+        self.assertEqual(self.portfolio.unrealized_pnl(), {'A-USD': 4.0, 'B-USD': -4.0})
+        self.assertEqual(self.portfolio.total_pnl(), 0.0)
+        self.assertEqual(self.portfolio.get('A-USD').pnl, 4.0)
+
+    def test_array_tick_must_match_positions(self):
+        self.portfolio.open('A-USD', 100.0, 1.0)
+        with self.assertRaises(ValueError):
+            self.portfolio.tick(np.array([1.0, 2.0]))
+
+    def test_concurrent_open_close_and_tick(self):
+        def churn(worker):
+            for i in range(200):
+                product_id = f'P{worker}-{i % 5}-USD'
+                self.portfolio.open(product_id, 100.0, 1.0)
+                self.portfolio.tick({product_id: 101.0})
+                self.portfolio.close(product_id)
+
+        threads = [threading.Thread(target=churn, args=(worker,)) for worker in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.portfolio), 0)
+        self.assertEqual(self.portfolio.positions(), [])
+
+    def test_many_positions_in_one_tick(self):
+        portfolio = Portfolio()
+        rng = np.random.default_rng(3)
+        for i in range(500):
+            portfolio.open(f'P{i}-USD', 100.0, 1.0)
+        for _ in range(50):
+            prices = 100 * np.exp(rng.normal(0, 0.01, len(portfolio)))
+            for sell in portfolio.tick(prices):
+                portfolio.close(sell.product_id)
+        highest = np.array([p.highest_price for p in portfolio.positions()])
+        self.assertTrue((highest >= 100.0).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
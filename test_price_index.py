@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+
+from price_index import LastPriceIndex
+
+
+class TestLastPriceIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'last_prices.json')
+        self.index = LastPriceIndex(self.path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_newer_price_wins(self):
+        self.assertTrue(self.index.update('BTC-USD', 100.0, timestamp=10))
+        self.assertTrue(self.index.update('BTC-USD', 110.0, timestamp=20))
+        self.assertFalse(self.index.update('BTC-USD', 90.0, timestamp=15))
+        self.assertEqual(self.index.get('BTC-USD'), 110.0)
+        self.assertEqual(self.index.get_entry('BTC-USD'), (110.0, 20.0))
+        self.assertEqual(self.index.get('ETH-USD', 0), 0)
+
+    def test_update_from_candles_uses_newest_close(self):
+        rows = [[600, 1, 2, 1, 1.5, 1.0], [0, 1, 2, 1, 1.2, 1.0], [300, 1, 2, 1, 1.3, 1.0]]
+        self.index.update_from_candles('BTC-USD', rows)
+        self.assertEqual(self.index.get_entry('BTC-USD'), (1.5, 900.0))
+        # A ticker seen after the candle closed replaces it
+        self.index.update('BTC-USD', 1.7, timestamp=901)
+        self.assertEqual(self.index.get('BTC-USD'), 1.7)
+
+    def test_snapshot_round_trip(self):
+        self.index.update('BTC-USD', 100.0, timestamp=10)
+        self.index.update('ETH-USD', 5.0, timestamp=11)
+        self.assertTrue(self.index.save())
+        # Nothing changed, nothing to write
+        self.assertFalse(self.index.save())
+
+        restored = LastPriceIndex(self.path)
+        self.assertEqual(restored.load(), 2)
+        self.assertEqual(restored.get('ETH-USD'), 5.0)
+        self.assertIn('BTC-USD', restored)
+
+    def test_missing_snapshot(self):
+        self.assertEqual(LastPriceIndex(os.path.join(self.tmp.name, 'nope.json')).load(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
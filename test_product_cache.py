@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+import unittest
+from decimal import Decimal
+
+from product_cache import ProductCache, ProductInfo
+from testutils import FakeClock
+
+
+PRODUCTS = [
+    {'id': 'BTC-USD', 'base_currency': 'BTC', 'quote_currency': 'USD', 'base_increment': '0.00000001',
+     'quote_increment': '0.01', 'base_min_size': '0.0001', 'min_market_funds': '1', 'status': 'online',
+     'trading_disabled': False, 'cancel_only': False, 'post_only': False, 'limit_only': False},
+    {'id': 'ETH-USD', 'base_increment': '0.0001', 'quote_increment': '0.01', 'status': 'online',
+     'trading_disabled': True},
+    {'id': 'DOGE-USD', 'base_increment': '1', 'quote_increment': '0.00001', 'status': 'delisted'},
+]
+
+
+class FakeProductsEndpoint:
+    def __init__(self, products, etag='"v1"'):
+        self.products = products
+        self.etag = etag
+        self.calls = []
+        self.fail = False
+
+    def __call__(self, etag):
+        self.calls.append(etag)
+        if self.fail:
+            raise ConnectionError('down')
+        if etag is not None and etag == self.etag:
+            return 304, self.etag, None
+        return 200, self.etag, self.products
+
+
+class TestProductCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.snapshot = os.path.join(self.directory, 'products.json')
+        self.clock = FakeClock()
+        self.endpoint = FakeProductsEndpoint(PRODUCTS)
+        self.cache = ProductCache(self.endpoint, ttl=300, snapshot_path=self.snapshot, clock=self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_only_tradable_products_are_listed(self):
+        self.assertTrue(self.cache.refresh())
+        self.assertEqual(self.cache.tradable_ids(), ['BTC-USD'])
+        self.assertEqual(len(self.cache), 3)
+        self.assertFalse(self.cache.get('DOGE-USD').tradable)
+
+    def test_metadata_lookup(self):
+        self.cache.refresh()
+        btc = self.cache.get('BTC-USD')
+        self.assertEqual(btc.tick_size, Decimal('0.01'))
+        self.assertEqual(btc.base_increment, Decimal('0.00000001'))
+        self.assertEqual(btc.base_min_size, Decimal('0.0001'))
+        self.assertEqual(btc.status, 'online')
+        self.assertIsNone(self.cache.get('XRP-USD'))
+
+    def test_no_request_while_fresh(self):
+        self.cache.refresh()
+        self.clock.now += 299
+        self.cache.refresh()
+        self.assertEqual(self.endpoint.calls, [None])
+
+    def test_stale_cache_revalidates_with_etag(self):
+        self.cache.refresh()
+        self.clock.now += 300
+        self.assertTrue(self.cache.refresh())
+        self.assertEqual(self.endpoint.calls, [None, '"v1"'])
+        # A 304 keeps the list and restarts the TTL
+        self.assertEqual(self.cache.tradable_ids(), ['BTC-USD'])
+        self.assertEqual(self.cache.fetched_at, self.clock.now)
+
+    def test_changed_list_replaces_the_cache(self):
+        self.cache.refresh()
+        self.endpoint.products = PRODUCTS[:1] + [{'id': 'SOL-USD', 'quote_increment': '0.01'}]
+        self.endpoint.etag = '"v2"'
+        self.cache.refresh(force=True)
+        self.assertEqual(self.cache.tradable_ids(), ['BTC-USD', 'SOL-USD'])
+        self.assertEqual(self.cache.etag, '"v2"')
+
+    def test_failed_refresh_keeps_the_old_list(self):
+        self.cache.refresh()
+        self.endpoint.fail = True
+        self.clock.now += 600
+        self.assertTrue(self.cache.refresh())
+        self.assertEqual(self.cache.tradable_ids(), ['BTC-USD'])
+
+    def test_snapshot_warm_start(self):
+        self.cache.refresh()
+        warm = ProductCache(self.endpoint, ttl=300, snapshot_path=self.snapshot, clock=self.clock)
+        self.assertEqual(warm.load(), 3)
+        self.assertEqual(warm.tradable_ids(), ['BTC-USD'])
+        self.assertEqual(warm.get('BTC-USD').quote_increment, Decimal('0.01'))
+        # Still fresh, so the warm cache doesn't go to the API
+        warm.refresh()
+        self.assertEqual(len(self.endpoint.calls), 1)
+
+    def test_missing_or_broken_snapshot(self):
+        self.assertEqual(self.cache.load(), 0)
+        with open(self.snapshot, 'w') as f:
+            f.write('{not json')
+        self.assertEqual(self.cache.load(), 0)
+
+
+class TestProductInfo(unittest.TestCase):
+
+    def test_rounding_down_to_increments(self):
+        info = ProductInfo(PRODUCTS[0])
+        self.assertEqual(info.round_size(0.123456789), Decimal('0.12345678'))
+        self.assertEqual(info.round_price('27123.4567'), Decimal('27123.45'))
+
+    def test_missing_fields_default(self):
+        info = ProductInfo({'id': 'BTC-USD', 'trading_disabled': False})
+        self.assertTrue(info.tradable)
+        self.assertIsNone(info.tick_size)
+        self.assertEqual(info.round_size('1.5'), Decimal('1.5'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import unittest
+
+from rate_limit import (
+    RateLimiter,
+    TokenBucket,
+    PUBLIC,
+    PRIVATE,
+    endpoint_class_for,
+    parse_retry_after,
+)
+from testutils import FakeClock
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(100.0)
+        self.bucket = TokenBucket(rate=10, capacity=5, clock=self.clock)
+
+    def test_burst_is_free_then_waits_for_refill(self):
+        for _ in range(5):
+            self.assertEqual(self.bucket.reserve(), 0)
+        # Sixth request has to wait one token's worth of refill
+        self.assertAlmostEqual(self.bucket.reserve(), 0.1)
+        self.assertAlmostEqual(self.bucket.reserve(), 0.2)
+
+    def test_refill_is_capped_at_capacity(self):
+        for _ in range(5):
+            self.bucket.reserve()
+        self.clock.now += 60
+        for _ in range(5):
+            self.assertEqual(self.bucket.reserve(), 0)
+        self.assertGreater(self.bucket.reserve(), 0)
+
+    def test_retry_after_blocks_the_bucket(self):
+        self.bucket.penalize(retry_after=3)
+        self.assertAlmostEqual(self.bucket.reserve(), 3)
+        # The bucket keeps refilling while blocked, so it's usable again straight after
+        self.clock.now += 3
+        self.assertEqual(self.bucket.reserve(), 0)
+
+    def test_backoff_doubles_without_retry_after(self):
+        self.assertEqual(self.bucket.penalize(), 1.0)
+        self.assertEqual(self.bucket.penalize(), 2.0)
+        self.assertEqual(self.bucket.penalize(), 4.0)
+        self.bucket.reset_backoff()
+        self.assertEqual(self.bucket.penalize(), 1.0)
+
+    def test_threads_share_the_budget(self):
+        waits = []
+        lock = threading.Lock()
+
+        def worker():
+            for _ in range(10):
+                wait = self.bucket.reserve()
+                with lock:
+                    waits.append(wait)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # 80 requests, 5 free and the rest spaced 0.1s apart
+        self.assertEqual(len(waits), 80)
+        self.assertAlmostEqual(max(waits), 7.5)
+        self.assertEqual(sum(1 for wait in waits if wait == 0), 5)
+
+    def test_acquire_async(self):
+        bucket = TokenBucket(rate=1000, capacity=1)
+
+        async def run():
+            return [await bucket.acquire_async() for _ in range(3)]
+
+        waits = asyncio.run(run())
+        self.assertEqual(waits[0], 0)
+        self.assertGreater(waits[1], 0)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_endpoint_classes(self):
+        self.assertEqual(endpoint_class_for('/products/BTC-USD/candles'), PUBLIC)
+        self.assertEqual(endpoint_class_for('/orders'), PRIVATE)
+        self.assertEqual(endpoint_class_for('/fills'), PRIVATE)
+
+    def test_handle_response(self):
+        clock = FakeClock(100.0)
+        limiter = RateLimiter(clock=clock)
+        self.assertFalse(limiter.handle_response(PUBLIC, 200))
+        self.assertTrue(limiter.handle_response(PUBLIC, 429, {'Retry-After': '2'}))
+        self.assertGreaterEqual(limiter.buckets[PUBLIC].reserve(), 2)
+        # Private budget is not affected by a public 429
+        self.assertEqual(limiter.buckets[PRIVATE].reserve(), 0)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('5'), 5.0)
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after('soon'))
+
+
+if __name__ == '__main__':
+    unittest.main()
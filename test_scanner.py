@@ -0,0 +1,97 @@
+import time
+import unittest
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from scanner import ScanResult, scan_market, window_increase
+
+
+def make_candles(open_price, close_price, count=24, granularity=300):
+    # Newest first, the same order the exchange sends them in
+    now = int(time.time())
+    step = (close_price - open_price) / count
+    rows = []
+    for i in range(count):
+        bar_open = open_price + step * i
+        rows.append([now - (count - i) * granularity, bar_open, bar_open + step, bar_open, bar_open + step, 1.0])
+    return list(reversed(rows))
+
+
+def make_mock_exchange(prices, ticker_requests=None):
+    """
+    prices: product_id -> (open price 2h ago, current price)
+    """
+    async def candles(request):
+        open_price, close_price = prices[request.match_info['product_id']]
+        return web.json_response(make_candles(open_price, close_price))
+
+    async def ticker(request):
+        if ticker_requests is not None:
+            ticker_requests.append(request.match_info['product_id'])
+        _, close_price = prices[request.match_info['product_id']]
+        return web.json_response({'price': str(close_price)})
+
+    app = web.Application()
+    app.router.add_get('/products/{product_id}/candles', candles)
+    app.router.add_get('/products/{product_id}/ticker', ticker)
+    return app
+
+
+class TestScanResult(unittest.TestCase):
+
+    def test_window_increase_uses_oldest_open_and_newest_close(self):
+        candles = [[0, 90, 110, 100, 105, 1.0], [300, 100, 130, 105, 120, 1.0]]
+        self.assertAlmostEqual(window_increase(candles), 20.0)
+        self.assertIsNone(window_increase([]))
+
+    def test_any_condition_is_enough(self):
+        self.assertTrue(ScanResult('BTC-USD', increase_2h=10.0).is_buy_condition_met)
+        self.assertTrue(ScanResult('BTC-USD', increase_since_last_check=5.0).is_buy_condition_met)
+        self.assertFalse(ScanResult('BTC-USD', increase_2h=9.9, increase_1h=2.0).is_buy_condition_met)
+        self.assertFalse(ScanResult('BTC-USD').is_buy_condition_met)
+
+
+class TestScanMarket(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.prices = {'FLAT-USD': (100.0, 101.0)}
+        # A few hundred products that don't move, plus two that do
+        for i in range(300):
+            self.prices[f'P{i}-USD'] = (10.0, 10.1)
+        self.prices['UP20-USD'] = (100.0, 120.0)
+        self.prices['UP50-USD'] = (100.0, 150.0)
+        self.ticker_requests = []
+        self.server = TestServer(make_mock_exchange(self.prices, self.ticker_requests))
+        await self.server.start_server()
+        self.api_url = str(self.server.make_url('')).rstrip('/')
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    async def test_returns_ranked_candidates(self):
+        started = time.monotonic()
+        candidates = await scan_market(list(self.prices), {}, self.api_url, max_concurrency=20)
+        elapsed = time.monotonic() - started
+
+        self.assertEqual([c.product_id for c in candidates], ['UP50-USD', 'UP20-USD'])
+        self.assertAlmostEqual(candidates[0].current_price, 150.0)
+        self.assertAlmostEqual(candidates[0].increase_2h, 50.0)
+        self.assertLess(elapsed, 10)
+
+    async def test_last_checked_price_condition(self):
+        candidates = await scan_market(['FLAT-USD'], {'FLAT-USD': 95.0}, self.api_url)
+        self.assertEqual(len(candidates), 1)
+        self.assertAlmostEqual(candidates[0].increase_since_last_check, (101.0 - 95.0) / 95.0 * 100)
+
+    async def test_prefetched_prices_skip_the_ticker(self):
+        candidates = await scan_market(['FLAT-USD', 'UP20-USD'], {'FLAT-USD': 95.0}, self.api_url,
+                                       current_prices={'FLAT-USD': 110.0})
+        self.assertEqual(self.ticker_requests, ['UP20-USD'])
+        flat = next(c for c in candidates if c.product_id == 'FLAT-USD')
+        self.assertAlmostEqual(flat.current_price, 110.0)
+        self.assertAlmostEqual(flat.increase_since_last_check, (110.0 - 95.0) / 95.0 * 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
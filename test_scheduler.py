@@ -0,0 +1,106 @@
+import threading
+import time
+import unittest
+
+from scheduler import Scheduler
+from testutils import FakeClock
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.monotonic = FakeClock(1000.0)
+        self.wall = FakeClock(1_700_000_000.0 - 1_700_000_000 % 3600 + 3590)  # 10s before the top of an hour
+        self.scheduler = Scheduler(clock=self.monotonic, wall_clock=self.wall)
+        self.calls = []
+
+    def advance(self, seconds):
+        self.monotonic.now += seconds
+        self.wall.now += seconds
+
+    def record(self, name):
+        return lambda: self.calls.append((name, self.monotonic.now))
+
+    def test_aligned_job_runs_at_the_top_of_the_hour(self):
+        job = self.scheduler.every(3600, self.record('scan'), align=True)
+        self.assertEqual(self.scheduler.run_pending(), 10)
+        self.assertEqual(self.calls, [])
+        self.advance(10)
+        self.scheduler.run_pending()
+        self.assertEqual(self.calls, [('scan', 1010.0)])
+        self.assertEqual(job.due, 1010.0 + 3600)
+
+    def test_late_run_is_caught_up_not_skipped(self):
+        job = self.scheduler.every(3600, self.record('scan'), align=True)
+        # The loop was busy past the exact second the old minute == 0 check needed
+        self.advance(12.5)
+        self.scheduler.run_pending()
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(job.missed, 0)
+        # Next run stays on the hour grid
+        self.assertAlmostEqual(job.due - self.monotonic.now, 3600 - 2.5)
+
+    def test_missed_runs_are_folded_into_one(self):
+        job = self.scheduler.every(60, self.record('reconcile'))
+        self.scheduler.run_pending()
+        self.advance(60 * 5 + 10)  # stalled for five periods
+        self.scheduler.run_pending()
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(job.missed, 4)
+        self.assertEqual(job.due, 1000.0 + 60 * 6)
+
+    def test_idle_until_the_earliest_deadline(self):
+        self.scheduler.every(1, self.record('positions'))
+        self.scheduler.every(3600, self.record('scan'), align=True)
+        self.assertEqual(self.scheduler.run_pending(), 1)
+        self.advance(1)
+        self.assertEqual(self.scheduler.run_pending(), 1)
+        self.assertEqual([name for name, _ in self.calls], ['positions', 'positions'])
+
+    def test_failing_job_keeps_its_schedule(self):
+        def broken():
+            raise RuntimeError('boom')
+
+        job = self.scheduler.every(5, broken)
+        self.scheduler.run_pending()
+        self.assertEqual((job.runs, job.due), (1, 1005.0))
+
+    def test_threaded_job_does_not_overlap(self):
+        release = threading.Event()
+        started = []
+
+        def slow():
+            started.append(1)
+            release.wait(5)
+
+        job = self.scheduler.every(1, slow, threaded=True)
+        self.scheduler.run_pending()
+        self.advance(1)
+        self.scheduler.run_pending()
+        self.assertEqual(job.overlaps, 1)
+        release.set()
+        job.thread.join(5)
+        self.advance(1)
+        self.scheduler.run_pending()
+        job.thread.join(5)
+        self.assertEqual((len(started), job.runs), (2, 2))
+
+    def test_run_forever_sleeps_between_jobs(self):
+        scheduler = Scheduler()
+        calls = []
+        scheduler.every(0.05, lambda: calls.append(time.monotonic()), name='tick')
+        thread = threading.Thread(target=scheduler.run_forever)
+        thread.start()
+        time.sleep(0.3)
+        scheduler.stop()
+        thread.join(2)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(4 <= len(calls) <= 8, calls)
+
+    def test_interval_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            self.scheduler.every(0, self.record('x'))
+
+
+if __name__ == '__main__':
+    unittest.main()
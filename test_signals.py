@@ -0,0 +1,108 @@
+import random
+import time
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+import signals
+from scanner import ScanResult, candles_since, evaluate_results, percent_change, window_increase
+
+
+NOW = datetime(2024, 1, 1, 12, 7, 30)
+GRANULARITY = 300
+
+
+def random_universe(n_products, seed=1):
+    """
+    Products with random candles over the last 2 hours, some with gaps or no data at all.
+    """
+    rng = random.Random(seed)
+    end = int(NOW.timestamp())
+    first_bucket = end - 7200 - end % GRANULARITY
+    results = []
+    for i in range(n_products):
+        price = rng.uniform(0.5, 500)
+        candles = []
+        for t in range(first_bucket, end, GRANULARITY):
+            if rng.random() < 0.2:
+                continue  # no trades in this bucket
+            open_price = price
+            price *= rng.uniform(0.9, 1.15)
+            candles.append([t, min(open_price, price), max(open_price, price), open_price, price, 1.0])
+        if rng.random() < 0.05:
+            candles = []
+        current_price = None if rng.random() < 0.05 else price * rng.uniform(0.95, 1.1)
+        last_checked = rng.choice([None, 0, price * rng.uniform(0.8, 1.1)])
+        results.append(ScanResult(f'P{i}-USD', last_checked_price=last_checked, current_price=current_price,
+                                  candles=candles))
+    return results
+
+
+def scalar_conditions(result):
+    # What scan_product used to compute for one product at a time
+    candles_1h = candles_since(result.candles, NOW.replace(hour=NOW.hour - 1))
+    return (
+        window_increase(result.candles),
+        window_increase(candles_1h),
+        percent_change(result.last_checked_price, result.current_price) if result.last_checked_price else None,
+    )
+
+
+class TestSignalEngine(unittest.TestCase):
+
+    def test_matches_scalar_logic(self):
+        results = random_universe(500)
+        expected = [scalar_conditions(result) for result in results]
+        expected_met = [ScanResult('x', increase_2h=a, increase_1h=b, increase_since_last_check=c).is_buy_condition_met
+                        for a, b, c in expected]
+
+        candidates = evaluate_results(results, NOW)
+
+        for result, (inc_2h, inc_1h, inc_last), met in zip(results, expected, expected_met):
+            self.assertEqual(result.increase_2h, inc_2h)
+            self.assertEqual(result.increase_1h, inc_1h)
+            self.assertEqual(result.increase_since_last_check, inc_last)
+            self.assertEqual(result.is_buy_condition_met, met)
+        self.assertEqual({c.product_id for c in candidates}, {r.product_id for r, m in zip(results, expected_met) if m})
+        scores = [c.score for c in candidates]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_thousands_of_products(self):
+        results = random_universe(5000, seed=2)
+        matrix = signals.build_matrix(
+            [r.product_id for r in results],
+            {r.product_id: r.candles for r in results},
+            {r.product_id: r.current_price for r in results},
+            {r.product_id: r.last_checked_price for r in results},
+            NOW.timestamp(),
+        )
+        engine = signals.default_engine()
+        started = time.perf_counter()
+        signal = engine.evaluate(matrix)
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(signal.met.shape, (5000,))
+        self.assertLess(elapsed, 0.1)
+
+    def test_register_extra_condition(self):
+        results = random_universe(50, seed=3)
+        matrix = signals.build_matrix(
+            [r.product_id for r in results],
+            {r.product_id: r.candles for r in results},
+            {r.product_id: r.current_price for r in results},
+            {}, NOW.timestamp(),
+        )
+        engine = signals.SignalEngine().register('always', lambda m: np.full(len(m.product_ids), 1.0), 1.0)
+        signal = engine.evaluate(matrix)
+        self.assertTrue(signal.met.all())
+        self.assertEqual(len(signal.ranked()), 50)
+
+    def test_empty_universe(self):
+        matrix = signals.build_matrix([], {}, {}, {}, NOW.timestamp())
+        signal = signals.default_engine().evaluate(matrix)
+        self.assertEqual(len(signal.met), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import base64
+import hashlib
+import hmac
+import unittest
+
+from signing import RequestSigner
+from testutils import FakeClock
+
+
+SECRET = base64.b64encode(b'not a real secret, just 32 bytes').decode()
+
+
+def expected_signature(timestamp, method, endpoint, body=''):
+    message = timestamp + method + endpoint + body
+    return hmac.new(base64.b64decode(SECRET), message.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+class TestRequestSigner(unittest.TestCase):
+
+    def setUp(self):
+        self.monotonic = FakeClock(50.0)
+        self.wall = FakeClock(1_700_000_000.0)
+        self.signer = RequestSigner('key', SECRET, 'pass', clock=self.monotonic, wall_clock=self.wall)
+
+    def test_matches_a_fresh_hmac(self):
+        body = '{"side": "buy"}'
+        headers = self.signer.headers('/orders', 'POST', body)
+        timestamp = headers['CB-ACCESS-TIMESTAMP']
+        self.assertEqual(headers['CB-ACCESS-SIGN'], expected_signature(timestamp, 'POST', '/orders', body))
+        self.assertEqual(headers['CB-ACCESS-KEY'], 'key')
+        self.assertEqual(headers['CB-ACCESS-PASSPHRASE'], 'pass')
+        # The keyed state is copied, not consumed, so signing again gives the same answer
+        self.assertEqual(self.signer.sign(timestamp, 'POST', '/orders', body), headers['CB-ACCESS-SIGN'])
+        self.assertEqual(self.signer.sign('1.000', 'GET', '/accounts'), expected_signature('1.000', 'GET', '/accounts'))
+
+    def test_timestamp_ignores_wall_clock_jumps(self):
+        self.assertEqual(self.signer.timestamp(), 1_700_000_000.0)
+        self.wall.now -= 3600  # someone set the clock back
+        self.monotonic.now += 2
+        self.assertEqual(self.signer.timestamp(), 1_700_000_002.0)
+
+    def test_sync_uses_midpoint_of_round_trip(self):
+        def server_time():
+            self.monotonic.now += 0.4  # round trip
+            return 1_700_000_010.0
+
+        skew = self.signer.sync_time(server_time)
+        self.assertTrue(self.signer.synced)
+        # Server read its clock at 50.2 on the monotonic clock, it's now 50.4
+        self.assertAlmostEqual(self.signer.timestamp(), 1_700_000_010.2)
+        self.assertAlmostEqual(skew, 10.2)
+        self.assertEqual(self.signer.headers('/accounts')['CB-ACCESS-TIMESTAMP'], '1700000010.200')
+
+    def test_batch_shares_one_timestamp(self):
+        requests = [('/orders', 'POST', '{"a": 1}'), ('/fills', 'GET', ''), ('/accounts', 'GET', None)]
+        batch = self.signer.sign_batch(requests)
+        self.assertEqual(len({headers['CB-ACCESS-TIMESTAMP'] for headers in batch}), 1)
+        for headers, (endpoint, method, body) in zip(batch, requests):
+            self.assertEqual(headers['CB-ACCESS-SIGN'],
+                             expected_signature(headers['CB-ACCESS-TIMESTAMP'], method, endpoint, body or ''))
+
+    def test_bad_secret_raises(self):
+        with self.assertRaises(ValueError):
+            RequestSigner('key', 'API_SECRET', 'pass')
+        with self.assertRaises(ValueError):
+            RequestSigner('key', None, 'pass')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import math
+import threading
+import time
+import unittest
+
+from ticker_batch import BatchPriceFetcher, BULK_RETRY_INTERVAL
+from testutils import FakeClock
+
+
+class FakeExchange:
+    def __init__(self, prices, bulk=True):
+        self.prices = prices
+        self.bulk = bulk
+        self.bulk_calls = 0
+        self.ticker_calls = []
+        self._lock = threading.Lock()
+
+    def fetch_bulk(self):
+        self.bulk_calls += 1
+        return dict(self.prices) if self.bulk else None
+
+    def fetch_one(self, product_id):
+        with self._lock:
+            self.ticker_calls.append(product_id)
+        return self.prices.get(product_id)
+
+
+class TestBatchPriceFetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(1000.0)
+        self.exchange = FakeExchange({f'P{i}-USD': float(i + 1) for i in range(100)})
+
+    def fetcher(self, **kwargs):
+        fetcher = BatchPriceFetcher(self.exchange.fetch_bulk, self.exchange.fetch_one, clock=self.clock, **kwargs)
+        self.addCleanup(fetcher.close)
+        return fetcher
+
+    def test_one_bulk_request_for_the_whole_batch(self):
+        product_ids = [f'P{i}-USD' for i in range(100)]
+        prices = self.fetcher().fetch(product_ids)
+        self.assertEqual(prices.tolist(), [float(i + 1) for i in range(100)])
+        self.assertEqual((self.exchange.bulk_calls, self.exchange.ticker_calls), (1, []))
+
+    def test_products_missing_from_the_bulk_answer_use_their_ticker(self):
+        fetcher = BatchPriceFetcher(lambda: {'P0-USD': 1.0}, self.exchange.fetch_one, clock=self.clock)
+        self.addCleanup(fetcher.close)
+        prices = fetcher.fetch(['P0-USD', 'P1-USD', 'NOPE-USD'])
+        self.assertEqual(prices[:2].tolist(), [1.0, 2.0])
+        self.assertTrue(math.isnan(prices[2]))
+        self.assertEqual(sorted(self.exchange.ticker_calls), ['NOPE-USD', 'P1-USD'])
+
+    def test_falls_back_to_a_fan_out_without_a_bulk_endpoint(self):
+        self.exchange.bulk = False
+        fetcher = self.fetcher(max_workers=4)
+        product_ids = ['P1-USD', 'P2-USD', 'P1-USD', 'P3-USD']
+        self.assertEqual(fetcher.fetch(product_ids).tolist(), [2.0, 3.0, 2.0, 4.0])
+        # The duplicate only went out once
+        self.assertEqual(sorted(self.exchange.ticker_calls), ['P1-USD', 'P2-USD', 'P3-USD'])
+
+        # No second look at the bulk endpoint until the retry interval is up
+        self.clock.now += 10
+        fetcher.fetch(['P4-USD', 'P5-USD'])
+        self.assertEqual(self.exchange.bulk_calls, 1)
+        self.clock.now += BULK_RETRY_INTERVAL
+        fetcher.fetch(['P6-USD', 'P7-USD'])
+        self.assertEqual(self.exchange.bulk_calls, 2)
+
+    def test_a_single_product_skips_the_bulk_request(self):
+        self.assertEqual(self.fetcher().fetch(['P9-USD']).tolist(), [10.0])
+        self.assertEqual((self.exchange.bulk_calls, self.exchange.ticker_calls), (0, ['P9-USD']))
+
+    def test_recent_prices_are_coalesced(self):
+        fetcher = self.fetcher(coalesce_window=1.0)
+        fetcher.fetch(['P1-USD', 'P2-USD'])
+        # The bulk answer covered everything, a different batch inside the window needs no request
+        self.clock.now += 0.5
+        self.assertEqual(fetcher.fetch(['P3-USD']).tolist(), [4.0])
+        self.assertEqual((self.exchange.bulk_calls, self.exchange.ticker_calls), (1, []))
+        self.clock.now += 1.0
+        fetcher.fetch(['P3-USD'])
+        self.assertEqual(self.exchange.ticker_calls, ['P3-USD'])
+
+    def test_concurrent_callers_share_an_in_flight_request(self):
+        release = threading.Event()
+        started = threading.Event()
+        calls = []
+
+        def slow_ticker(product_id):
+            calls.append(product_id)
+            started.set()
+            release.wait(5)
+            return 42.0
+
+        # No coalescing window, only the in-flight request can be shared
+        fetcher = BatchPriceFetcher(self.exchange.fetch_bulk, slow_ticker, coalesce_window=0, clock=self.clock)
+        self.addCleanup(fetcher.close)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(fetcher.fetch(['P1-USD'])[0])) for _ in range(3)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.1)  # the other two are waiting on the first one's request by now
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(calls, ['P1-USD'])
+        self.assertEqual(results, [42.0] * 3)
+
+    def test_failures_are_nan(self):
+        def broken_bulk():
+            raise RuntimeError('503')
+
+        def broken_ticker(product_id):
+            raise RuntimeError('timeout')
+
+        fetcher = BatchPriceFetcher(broken_bulk, broken_ticker, clock=self.clock)
+        self.addCleanup(fetcher.close)
+        self.assertTrue(all(math.isnan(p) for p in fetcher.fetch(['P1-USD', 'P2-USD'])))
+        # A failed bulk request doesn't count as the endpoint missing
+        self.assertTrue(fetcher.bulk_available())
+
+
+if __name__ == '__main__':
+    unittest.main()
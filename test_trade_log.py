@@ -0,0 +1,75 @@
+import csv
+import glob
+import os
+import tempfile
+import time
+import unittest
+
+from trade_log import TRADE_FIELDS, TradeLogWriter, compact, load_compacted, read_trades
+
+
+class TestTradeLog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'trade_log.csv')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_trades_are_written_in_order(self):
+        writer = TradeLogWriter(self.path, flush_interval=0.05)
+        writer.log_trade('BTC-USD', 'buy', '0.5', '40000', fees='10', order_id='o1', client_oid='c1',
+                         submitted_at=100.0, filled_at=100.5)
+        writer.log_trade('BTC-USD', 'sell', 0.5, 41000, order_id='o2', filled_at=200.0)
+        writer.flush()
+
+        with open(self.path, newline='') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(tuple(rows[0]), TRADE_FIELDS)
+        self.assertEqual(rows[1], ['BTC-USD', 'buy', '0.5', '40000.0', '10.0', 'o1', 'c1', '100.0', '100.5'])
+        self.assertEqual(rows[2][:2], ['BTC-USD', 'sell'])
+        self.assertEqual(rows[2][7], '200.0')  # no submit time, same as the fill time
+        writer.close()
+
+        # A new writer appends without a second header
+        writer = TradeLogWriter(self.path)
+        writer.log_trade('ETH-USD', 'buy', 1, 2000)
+        writer.close()
+        self.assertEqual(len(read_trades(self.path)['product_id']), 3)
+
+    def test_logging_does_not_wait_for_the_file(self):
+        writer = TradeLogWriter(self.path)
+        started = time.perf_counter()
+        for i in range(10000):
+            writer.log_trade('BTC-USD', 'buy', 1, 100 + i, filled_at=i)
+        elapsed = time.perf_counter() - started
+        writer.close()
+        self.assertLess(elapsed / 10000, 0.0001)
+        self.assertEqual(len(read_trades(self.path)['price']), 10000)
+
+    def test_rotation_and_compaction(self):
+        writer = TradeLogWriter(self.path, max_bytes=2000)
+        for i in range(300):
+            writer.log_trade(f'P{i % 3}-USD', 'buy' if i % 2 else 'sell', 1, 100 + i, order_id=f'o{i}', filled_at=i)
+            if i % 20 == 0:
+                writer.flush()  # smaller batches so the file rotates more than once
+        writer.close()
+        rotated = glob.glob(os.path.join(self.tmp.name, 'trade_log-*.csv'))
+        self.assertGreater(len(rotated), 1)
+        live = len(read_trades(self.path)['price'])
+
+        output, count = compact(self.path)
+        self.assertEqual(count + live, 300)
+        self.assertEqual(glob.glob(os.path.join(self.tmp.name, 'trade_log-*.csv')), [])
+        columns = load_compacted(output)
+        self.assertEqual(list(columns['filled_at']), list(range(count)))
+        self.assertEqual(columns['order_id'][5], 'o5')
+        self.assertEqual(columns['price'].dtype.kind, 'f')
+
+        # Compacting again with nothing new keeps what is there
+        self.assertEqual(compact(self.path), (output, count))
+
+
+if __name__ == '__main__':
+    unittest.main()
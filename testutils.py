@@ -0,0 +1,10 @@
+class FakeClock:
+    """
+    Stand-in for time.time/time.monotonic, tests move it by setting or adding to now.
+    """
+
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
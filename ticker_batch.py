@@ -0,0 +1,160 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+import metrics
+
+
+DEFAULT_MAX_WORKERS = 10
+DEFAULT_COALESCE_WINDOW = 1.0  # seconds a fetched price gets handed out again without a request
+BULK_RETRY_INTERVAL = 3600  # once the exchange says it has no bulk endpoint, don't ask again for this long
+MIN_BULK = 2  # fewer products than this go straight to their tickers, one ticker is cheaper than every price
+BULK = object()  # key of the bulk request among the in-flight ones, can't clash with a product id
+
+PRICE_REQUESTS = metrics.counter('price_requests_total', 'Current price lookups by source (bulk, ticker, coalesced)')
+
+
+class BatchPriceFetcher:
+    """
+    Current prices for many products with as few requests as possible.
+
+    One bulk request answers every product it lists. Whatever it doesn't have (or everything,
+    on an exchange without a bulk endpoint) is fanned out as ticker requests on a small thread
+    pool. A price younger than coalesce_window is handed out again without a request, and a
+    caller asking for a product whose request is already in flight waits for that one instead
+    of sending its own, so the position check and a scan running at the same time share them.
+    """
+
+    def __init__(self, fetch_bulk, fetch_one, max_workers=DEFAULT_MAX_WORKERS,
+                 coalesce_window=DEFAULT_COALESCE_WINDOW, min_bulk=MIN_BULK, clock=time.monotonic):
+        """
+        :param fetch_bulk: callable() -> dict of product_id -> price, None if the exchange has no bulk endpoint
+        :param fetch_one: callable(product_id) -> price, None if there isn't one
+        """
+        self.fetch_bulk = fetch_bulk
+        self.fetch_one = fetch_one
+        self.max_workers = max_workers
+        self.coalesce_window = coalesce_window
+        self.min_bulk = min_bulk
+        self._clock = clock
+        self._recent = {}  # product_id -> (price, fetched_at)
+        self._inflight = {}  # product_id or BULK -> Future
+        self._bulk_retry_at = None
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def fetch(self, product_ids):
+        """
+        :return: float array aligned with product_ids, NaN where no price could be had
+        """
+        product_ids = list(product_ids)
+        prices = np.full(len(product_ids), np.nan)
+        now = self._clock()
+        missing = []
+        with self._lock:
+            for i, product_id in enumerate(product_ids):
+                entry = self._recent.get(product_id)
+                if entry is not None and now - entry[1] < self.coalesce_window:
+                    prices[i] = entry[0]
+                else:
+                    missing.append(i)
+        if len(missing) < len(product_ids):
+            PRICE_REQUESTS.inc(len(product_ids) - len(missing), source='coalesced')
+        if not missing:
+            return prices
+
+        wanted = {product_ids[i] for i in missing}
+        if len(wanted) >= self.min_bulk and self.bulk_available():
+            bulk = self._bulk()
+            if bulk:
+                for i in missing:
+                    prices[i] = bulk.get(product_ids[i], np.nan)
+                missing = [i for i in missing if np.isnan(prices[i])]
+                wanted = {product_ids[i] for i in missing}
+
+        if wanted:
+            # One request per product, the same product twice in the batch still only goes out once
+            futures = {product_id: self._ticker(product_id) for product_id in wanted}
+            for i in missing:
+                try:
+                    price = futures[product_ids[i]].result()
+                except Exception as e:
+                    logging.error(f"Error fetching current price for {product_ids[i]}: {e}")
+                    price = None
+                prices[i] = np.nan if price is None else price
+        return prices
+
+    def bulk_available(self):
+        return self._bulk_retry_at is None or self._clock() >= self._bulk_retry_at
+
+    def _join_or_start(self, key):
+        # The future of the request already in flight for key, or a new one this caller has to run
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, False
+            future = self._inflight[key] = Future()
+            return future, True
+
+    def _run(self, key, future, fn, *args):
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _bulk(self):
+        future, owner = self._join_or_start(BULK)
+        if owner:
+            self._run(BULK, future, self._fetch_bulk)
+        try:
+            return future.result()
+        except Exception as e:
+            logging.warning(f"Bulk price request failed, falling back to tickers: {e}")
+            return None
+
+    def _fetch_bulk(self):
+        prices = self.fetch_bulk()
+        if prices is None:
+            logging.info(f"No bulk price endpoint, fetching tickers for the next {BULK_RETRY_INTERVAL}s")
+            self._bulk_retry_at = self._clock() + BULK_RETRY_INTERVAL
+            return None
+        PRICE_REQUESTS.inc(source='bulk')
+        self._remember(prices)
+        return prices
+
+    def _ticker(self, product_id):
+        future, owner = self._join_or_start(product_id)
+        if owner:
+            self._executor().submit(self._run, product_id, future, self._fetch_one, product_id)
+        return future
+
+    def _fetch_one(self, product_id):
+        price = self.fetch_one(product_id)
+        PRICE_REQUESTS.inc(source='ticker')
+        if price is not None:
+            self._remember({product_id: price})
+        return price
+
+    def _remember(self, prices):
+        now = self._clock()
+        with self._lock:
+            for product_id, price in prices.items():
+                self._recent[product_id] = (float(price), now)
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix='ticker')
+            return self._pool
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
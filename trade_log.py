@@ -0,0 +1,149 @@
+import argparse
+import csv
+import glob
+import logging
+import os
+import time
+
+import numpy as np
+
+from background_writer import DEFAULT_FLUSH_INTERVAL, BackgroundWriter
+
+
+DEFAULT_PATH = 'trade_log.csv'
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+
+# One row per filled order, timestamps are epoch seconds
+TRADE_FIELDS = ('product_id', 'side', 'size', 'price', 'fees', 'order_id', 'client_oid', 'submitted_at', 'filled_at')
+
+# Column types for the compacted .npz files
+TRADE_DTYPES = {
+    'product_id': str,
+    'side': str,
+    'size': np.float64,
+    'price': np.float64,
+    'fees': np.float64,
+    'order_id': str,
+    'client_oid': str,
+    'submitted_at': np.float64,
+    'filled_at': np.float64,
+}
+
+
+def rotated_path(path, timestamp):
+    base, ext = os.path.splitext(path)
+    stamp = time.strftime('%Y%m%dT%H%M%S', time.gmtime(timestamp))
+    candidate, n = f"{base}-{stamp}{ext}", 1
+    # Two rotations in the same second must not overwrite each other
+    while os.path.exists(candidate):
+        candidate, n = f"{base}-{stamp}.{n}{ext}", n + 1
+    return candidate
+
+
+class TradeLogWriter(BackgroundWriter):
+    """
+    Append-only CSV of filled orders, written by a background thread.
+
+    log_trade() only puts a tuple on a queue, the file write happens off the order path.
+    The writer thread starts on the first trade, flushes at least every flush_interval
+    seconds and rotates the file to <name>-<UTC time>.csv once it passes max_bytes.
+    """
+
+    thread_name = 'trade-log'
+
+    def __init__(self, path=DEFAULT_PATH, max_bytes=DEFAULT_MAX_BYTES, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        super().__init__(flush_interval)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._file = None
+        self._writer = None
+
+    def log_trade(self, product_id, side, size, price, fees=0.0, order_id=None, client_oid=None,
+                  submitted_at=None, filled_at=None):
+        filled_at = time.time() if filled_at is None else filled_at
+        self.put((product_id, side, float(size), float(price), float(fees), order_id or '', client_oid or '',
+                  filled_at if submitted_at is None else submitted_at, filled_at))
+
+    def _open(self):
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self._file = open(self.path, 'a', newline='')
+        self._writer = csv.writer(self._file)
+        if new_file:
+            self._writer.writerow(TRADE_FIELDS)
+
+    def _rotate(self):
+        self._file.close()
+        os.replace(self.path, rotated_path(self.path, time.time()))
+        self._open()
+
+    def opened(self):
+        self._open()
+
+    def write_batch(self, records):
+        try:
+            self._writer.writerows(records)
+            self._file.flush()
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
+        except Exception as e:
+            logging.error(f"Error writing trade log {self.path}: {e}")
+
+    def closed(self):
+        self._file.close()
+
+
+def read_trades(csv_path):
+    """
+    :return: dict of column name -> array
+    """
+    with open(csv_path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    return {name: np.array([row[name] for row in rows], dtype=dtype) for name, dtype in TRADE_DTYPES.items()}
+
+
+def compact(path=DEFAULT_PATH, output=None):
+    """
+    Merges the rotated CSV files of a trade log into one columnar .npz, oldest first.
+
+    The live file is left alone, rotated files are deleted once they are in the output.
+    :return: (output path, number of trades in it)
+    """
+    base, ext = os.path.splitext(path)
+    output = output or base + '.npz'
+    rotated = sorted(glob.glob(f'{glob.escape(base)}-*{ext}'))
+    parts = [load_compacted(output)] if os.path.exists(output) else []
+    parts.extend(read_trades(csv_path) for csv_path in rotated)
+    if not parts:
+        return output, 0
+
+    columns = {name: np.concatenate([part[name] for part in parts]) for name in TRADE_DTYPES}
+    order = np.argsort(columns['filled_at'], kind='stable')
+    columns = {name: values[order] for name, values in columns.items()}
+    tmp_path = output + '.tmp.npz'
+    np.savez(tmp_path, **columns)
+    os.replace(tmp_path, output)
+    for csv_path in rotated:
+        os.remove(csv_path)
+    return output, len(order)
+
+
+def load_compacted(npz_path):
+    with np.load(npz_path) as data:
+        return {name: data[name] for name in TRADE_DTYPES}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Trade log tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    compact_parser = subparsers.add_parser('compact', help='merge rotated trade logs into one .npz')
+    compact_parser.add_argument('--path', default=DEFAULT_PATH)
+    compact_parser.add_argument('--output')
+    args = parser.parse_args(argv)
+
+    if args.command == 'compact':
+        output, trades = compact(args.path, args.output)
+        print(f"{trades} trades in {output}")
+
+
+if __name__ == '__main__':
+    main()